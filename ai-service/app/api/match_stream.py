@@ -0,0 +1,207 @@
+"""
+Progressive (streamed) event matching for guest galleries.
+
+A full scan of a large event returns nothing until every face has been compared
+and the matches sorted. The progressive matcher scans the event index in chunks
+instead, starting small and growing geometrically, and reports after every
+chunk the photos that were newly matched (or matched closer than before), so a
+gallery can render its first photos after a small fraction of the scan. The
+last event is the complete, ordered result, identical to a regular full scan.
+
+Events (one dict each, streamed as NDJSON by the API):
+
+- {"type": "chunk", "photos": [...], "faces_scanned", "faces_total", "elapsed_ms"}
+  photos: best match per new or improved photo in this chunk, closest first
+- {"type": "summary", "matches": [...], "photos": [...], "faces_compared",
+  "content_key", "elapsed_ms", "first_result_ms"}
+  content_key: index content key the result is valid for (None if faces were
+  added or re-encoded during the scan), for caching
+- {"type": "error", "detail": ...} when faces are removed during the scan
+"""
+
+import asyncio
+import logging
+import time
+from typing import AsyncIterator, Callable, Iterator, Optional
+
+import numpy as np
+
+from app.api.responses import match_list, ndjson_line
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def best_per_photo(matches: list[dict]) -> list[dict]:
+    """Closest match of every photo, from face matches sorted closest first."""
+    best = {}
+    for match in matches:
+        best.setdefault(match["photo_id"], match)
+    return list(best.values())
+
+
+class ProgressiveMatcher:
+    """Scans an event index in growing chunks, reporting photo matches as they are found."""
+    
+    def __init__(self, first_chunk_rows: int = 4096, max_chunk_rows: int = 262144, growth: int = 4):
+        """
+        Initialize ProgressiveMatcher.
+        
+        Args:
+            first_chunk_rows: Faces compared before the first report
+            max_chunk_rows: Upper bound of the chunk size
+            growth: Factor by which each chunk is larger than the previous one
+        """
+        if first_chunk_rows < 1 or max_chunk_rows < first_chunk_rows or growth < 1:
+            raise ValueError("Progressive matching needs 1 <= first_chunk_rows <= max_chunk_rows and growth >= 1")
+        self.first_chunk_rows = first_chunk_rows
+        self.max_chunk_rows = max_chunk_rows
+        self.growth = growth
+        
+        self.scans = 0
+        self.completed = 0
+        self.aborted = 0
+        self.first_result_seconds = 0.0
+        self.scan_seconds = 0.0
+    
+    def chunks(self, total: int) -> list[tuple[int, int]]:
+        """Row ranges [start, stop) covering total rows in growing chunks."""
+        ranges = []
+        start, size = 0, self.first_chunk_rows
+        while start < total:
+            ranges.append((start, min(start + size, total)))
+            start += size
+            size = min(size * self.growth, self.max_chunk_rows)
+        return ranges
+    
+    def scan(self, index, target: np.ndarray, threshold: float) -> Iterator[dict]:
+        """
+        Match compact query encodings against an event index chunk by chunk.
+        
+        The faces present when the scan starts are compared; faces appended
+        meanwhile are left to incremental matching. The index lock is only held
+        per chunk, so ingestion continues during long scans.
+        
+        Args:
+            index: EventFaceIndex of the event
+            target: (k, 128) compact query encodings (closest one counts)
+            threshold: Maximum Euclidean distance for a match
+        
+        Yields:
+            chunk events, then one summary event (or an error event)
+        """
+        started = time.perf_counter()
+        with index.lock:
+            total = len(index)
+            compactions = index.compactions
+            content_key = index.content_key
+        self.scans += 1
+        
+        best: dict[str, float] = {}
+        found_rows, found_distances = [], []
+        first_result_ms: Optional[float] = None
+        scanned = 0
+        
+        for start, stop in self.chunks(total):
+            with index.lock:
+                if index.compactions != compactions:
+                    self.aborted += 1
+                    yield {"type": "error", "detail": "Faces were removed during the scan, retry the match"}
+                    return
+                rows, distances = index.search_range(target, threshold, start, stop)
+                photo_ids = [index.photo_ids[row] for row in rows.tolist()]
+                face_ids = [index.face_ids[row] for row in rows.tolist()]
+            scanned = stop
+            found_rows.append(rows)
+            found_distances.append(distances)
+            
+            # Photos not reported yet, or matched closer than reported before
+            improved = [
+                i for i, (photo_id, distance) in enumerate(zip(photo_ids, distances.tolist()))
+                if distance < best.get(photo_id, np.inf)
+            ]
+            photos = best_per_photo(match_list(
+                [photo_ids[i] for i in improved], [face_ids[i] for i in improved], distances[improved], threshold
+            ))
+            for photo in photos:
+                best[photo["photo_id"]] = photo["distance"]
+            
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if photos and first_result_ms is None:
+                first_result_ms = elapsed_ms
+            yield {
+                "type": "chunk",
+                "photos": photos,
+                "faces_scanned": scanned,
+                "faces_total": total,
+                "elapsed_ms": elapsed_ms
+            }
+        
+        rows = np.concatenate(found_rows) if found_rows else np.empty(0, dtype=np.intp)
+        distances = np.concatenate(found_distances) if found_distances else np.empty(0)
+        order = np.argsort(distances, kind="stable")
+        rows, distances = rows[order], distances[order]
+        with index.lock:
+            if index.compactions != compactions:
+                self.aborted += 1
+                yield {"type": "error", "detail": "Faces were removed during the scan, retry the match"}
+                return
+            photo_ids = [index.photo_ids[row] for row in rows.tolist()]
+            face_ids = [index.face_ids[row] for row in rows.tolist()]
+            # The result is complete (and cacheable) only if the faces did not change meanwhile
+            complete = index.content_key == content_key
+        
+        elapsed = time.perf_counter() - started
+        self.completed += 1
+        self.scan_seconds += elapsed
+        self.first_result_seconds += (first_result_ms if first_result_ms is not None else elapsed * 1000) / 1000
+        matches = match_list(photo_ids, face_ids, distances, threshold)
+        yield {
+            "type": "summary",
+            "matches": matches,
+            "photos": best_per_photo(matches),
+            "faces_compared": scanned,
+            "content_key": content_key if complete else None,
+            "elapsed_ms": elapsed * 1000,
+            "first_result_ms": first_result_ms
+        }
+    
+    def stats(self) -> dict:
+        return {
+            "first_chunk_rows": self.first_chunk_rows,
+            "max_chunk_rows": self.max_chunk_rows,
+            "growth": self.growth,
+            "scans": self.scans,
+            "completed": self.completed,
+            "aborted": self.aborted,
+            "avg_first_result_ms": 1000 * self.first_result_seconds / self.completed if self.completed else 0.0,
+            "avg_scan_ms": 1000 * self.scan_seconds / self.completed if self.completed else 0.0
+        }
+
+
+async def ndjson_stream(
+    events: Iterator[dict],
+    on_summary: Optional[Callable[[dict], None]] = None
+) -> AsyncIterator[bytes]:
+    """
+    Serialize scan events as NDJSON lines, advancing the scan in a worker thread.
+    
+    on_summary is called (in a worker thread, as it may reach Redis) with the
+    summary event before it is sent; it may modify it, e.g. to cache the result
+    and drop the content key.
+    """
+    while True:
+        event = await asyncio.to_thread(next, events, None)
+        if event is None:
+            return
+        if event["type"] == "summary" and on_summary is not None:
+            await asyncio.to_thread(on_summary, event)
+        yield ndjson_line(event)
+
+
+# Singleton instance
+progressive_matcher = ProgressiveMatcher(
+    first_chunk_rows=settings.progressive_match_first_chunk,
+    max_chunk_rows=settings.progressive_match_max_chunk,
+    growth=settings.progressive_match_growth
+)
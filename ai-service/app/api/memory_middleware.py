@@ -0,0 +1,48 @@
+"""
+ASGI middleware measuring the memory of sampled requests.
+
+A pure ASGI middleware rather than an @app.middleware("http") function, so a
+streamed response (NDJSON matching) is measured until its last chunk is sent,
+and background tasks started by the request are not.
+"""
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.services.memory_profiler import memory_profiler
+
+
+class MemoryProfilingMiddleware:
+    """Hands HTTP requests to the memory profiler, which measures a sample of them."""
+    
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not memory_profiler.enabled:
+            await self.app(scope, receive, send)
+            return
+        
+        sample = memory_profiler.begin_request(scope["path"])
+        if sample is None:
+            await self.app(scope, receive, send)
+            return
+        
+        finished = False
+        
+        def finish():
+            nonlocal finished
+            if not finished:
+                finished = True
+                # Aggregate by route template (/events/{event_id}/match), not by raw path
+                route = scope.get("route")
+                memory_profiler.end_request(sample, getattr(route, "path", None))
+        
+        async def send_and_measure(message: Message):
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                finish()
+        
+        try:
+            await self.app(scope, receive, send_and_measure)
+        finally:
+            finish()
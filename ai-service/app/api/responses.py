@@ -0,0 +1,102 @@
+"""
+Fast JSON responses for large face and match payloads.
+
+Hot endpoints return an ORJSONNumpyResponse built from plain dicts instead of
+one Pydantic model per face or match. FastAPI passes Response instances through
+untouched, so the per-item validation and the jsonable_encoder pass are skipped,
+while the routes keep their response_model for the OpenAPI schema. NumPy arrays
+(e.g. 40 x 128 encodings) and scalars are serialized natively by orjson.
+"""
+
+import json
+import logging
+from datetime import date, datetime
+from typing import Any, Callable
+
+import numpy as np
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    orjson = None
+    ORJSON_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+
+def _default(obj: Any) -> Any:
+    """Fallback for values orjson (or json) cannot serialize natively."""
+    if isinstance(obj, np.ndarray):
+        # Non-contiguous arrays and dtypes orjson does not support (e.g. float16)
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class ORJSONNumpyResponse(JSONResponse):
+    """JSON response rendered with orjson, with native NumPy array support."""
+    
+    def render(self, content: Any) -> bytes:
+        if ORJSON_AVAILABLE:
+            return orjson.dumps(content, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+        return json.dumps(content, default=_default, separators=(",", ":")).encode("utf-8")
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that calls on_close once it was sent or aborted.
+    
+    Unlike a finally block in the body generator, which never runs when the
+    client disconnects before the body starts, this covers the whole response.
+    """
+    
+    def __init__(self, content: Any, on_close: Callable[[], None], **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.on_close()
+
+
+def ndjson_line(content: Any) -> bytes:
+    """One newline-terminated JSON line of a streamed (NDJSON) response."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(
+            content, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_APPEND_NEWLINE
+        )
+    return json.dumps(content, default=_default, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+def match_list(photo_ids, face_ids, distances: np.ndarray, threshold: float) -> list[dict]:
+    """
+    Build match dicts from parallel id sequences and a distance array.
+    
+    Confidences are computed for all matches in one vectorized step and the
+    arrays are converted to Python floats in bulk.
+    
+    Args:
+        photo_ids: Photo id per match
+        face_ids: Face id per match
+        distances: (n,) match distances
+        threshold: Match threshold used for the confidence score
+    
+    Returns:
+        List of dicts with photo_id, face_id, distance and confidence
+    """
+    distances = np.asarray(distances, dtype=np.float64)
+    confidences = np.maximum(0, 1 - distances / threshold)
+    return [
+        {"photo_id": photo_id, "face_id": face_id, "distance": distance, "confidence": confidence}
+        for photo_id, face_id, distance, confidence in zip(
+            photo_ids, face_ids, distances.tolist(), confidences.tolist()
+        )
+    ]
@@ -1,22 +1,129 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
+import asyncio
+import time
+from fastapi import APIRouter, HTTPException, Request, Response, Depends
 from datetime import datetime
 from typing import Optional, List
 from pydantic import BaseModel
-from app.models.schemas import HealthResponse
+from PIL import UnidentifiedImageError
+from app.models.schemas import HealthResponse, ReadinessResponse
+from app.config import settings
 from app.services.redis_service import redis_service
 from app.services.face_service import face_service
 from app.services.photo_processor import photo_processor
+from app.services.image_tagger import image_tagger
+from app.services.event_index import IndexUnavailable, event_indexes
+from app.services.incremental_matcher import incremental_matcher
+from app.services.face_clustering import face_clusterer
+from app.services.encodings import encoding_codec
+from app.services.match_cache import match_cache
+from app.services.sharded_matcher import sharded_matcher
+from app.services.result_stream import result_stream
+from app.services.tiled_detector import tiled_detector
+from app.services.synthetic_engine import synthetic_engine
+from app.services.video_processor import video_processor
+from app.services.face_chips import face_chip_store
+from app.services.reencoder import reencoder
+from app.services.ingest_scheduler import ingest_scheduler
+from app.services.memory_profiler import memory_profiler
+from app.services.single_flight import single_flight, content_key
+from app.services.admission import admission_controller, AdmissionRejected, INTERACTIVE, BATCH
+from app.api.uploads import receive_image_upload, IMAGE_UPLOAD_OPENAPI
+from app.api.responses import ORJSONNumpyResponse, ClosingStreamingResponse, match_list, ndjson_line
+from app.api.match_stream import progressive_matcher, ndjson_stream, best_per_photo
+import numpy as np
 import logging
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
 
+def reference_encodings(single: Optional[List[float]], many: Optional[List[List[float]]]) -> list:
+    """Collect the reference encodings given as a single encoding and/or a list."""
+    return ([single] if single is not None else []) + (many or [])
+
+
+async def acquire_slot(work_class: str) -> float:
+    """Take an admission slot of the given work class, or fail the request with 429."""
+    try:
+        return await admission_controller.acquire(work_class)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Service busy ({e.reason}), retry later",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+
+async def run_on_index(func, *args):
+    """
+    Run an event index operation in a worker thread, as it may load an evicted
+    index from Redis; fails the request with 503 if the index is unavailable.
+    """
+    try:
+        return await asyncio.to_thread(func, *args)
+    except IndexUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
+
+def require_event_state():
+    """Dependency of event-scoped routes, whose state lives in this process's memory."""
+    if not settings.event_state_enabled:
+        raise HTTPException(status_code=503, detail="Event matching is disabled on this instance")
+
+
+def admit(work_class: str):
+    """Dependency that holds an admission slot of the given work class for the request."""
+    async def dependency():
+        started = await acquire_slot(work_class)
+        try:
+            yield
+        finally:
+            admission_controller.release(work_class, started)
+    return dependency
+
+
 # URL-based API models (for PR #9 backend integration)
 class ImageUrlRequest(BaseModel):
     image_url: str
 
 
+class DetectFacesUrlRequest(ImageUrlRequest):
+    # When both are set, detected faces are added to the event index and
+    # matched incrementally against the event's registered guests.
+    event_id: Optional[str] = None
+    photo_id: Optional[str] = None
+    # Also write thumbnails and face crops from the decoded image (needs photo_id)
+    generate_derivatives: bool = False
+    # Also store aligned face chips and landmarks for re-encoding (needs photo_id)
+    store_chips: bool = False
+
+
+class EventPhotoUrlRequest(ImageUrlRequest):
+    event_id: str
+    photo_id: str
+    generate_derivatives: bool = False
+    store_chips: bool = False
+
+
+class DetectionAcceptedResponse(BaseModel):
+    accepted: bool
+    event_id: str
+    photo_id: str
+    stream: str
+
+
+class IngestQueuedResponse(BaseModel):
+    queued: bool
+    event_id: str
+    photo_id: str
+    queue_depth: int
+    stream: str
+
+
+class EventLiveRequest(BaseModel):
+    ttl_seconds: Optional[int] = None  # default: INGEST_LIVE_TTL
+
+
 class PhotoFaceInput(BaseModel):
     photo_id: str
     face_id: str
@@ -24,7 +131,10 @@ class PhotoFaceInput(BaseModel):
 
 
 class MatchFacesRequest(BaseModel):
-    target_encoding: List[float]
+    # One encoding, or several references of the same person (or both)
+    target_encoding: Optional[List[float]] = None
+    target_encodings: Optional[List[List[float]]] = None
+    fusion: Optional[str] = None  # min or centroid
     photo_faces: List[PhotoFaceInput]
 
 
@@ -52,6 +162,43 @@ class DetectFacesResponse(BaseModel):
     face_count: int
     faces: List[DetectedFace]
     error: Optional[str] = None
+    derivatives: Optional[dict] = None
+    chips: Optional[dict] = None
+
+
+class VideoUrlRequest(BaseModel):
+    video_url: str
+    # When both are set, the tracks are added to the event index as faces of
+    # the clip (face ids "{clip_id}:{track}") and matched against the guests
+    event_id: Optional[str] = None
+    clip_id: Optional[str] = None
+
+
+class VideoFaceTrack(DetectedFace):
+    start_ms: float
+    end_ms: float
+    best_ms: float
+    detections: int
+
+
+class DetectVideoFacesResponse(BaseModel):
+    track_count: int
+    tracks: List[VideoFaceTrack]
+    video: Optional[dict] = None
+    error: Optional[str] = None
+
+
+class PhotoDerivativesRequest(ImageUrlRequest):
+    photo_id: str
+    event_id: Optional[str] = None
+    # Fractional face boxes (e.g. from an earlier detection) to crop
+    faces: Optional[List[FaceBoundingBox]] = None
+
+
+class PhotoDerivativesResponse(BaseModel):
+    photo_id: str
+    thumbnails: dict[str, str]
+    faces: List[dict]
 
 
 class EncodeSelfieResponse(BaseModel):
@@ -64,6 +211,116 @@ class MatchFacesResponse(BaseModel):
     matches: List[FaceMatch]
 
 
+# Incremental event matching models
+class RegisterGuestRequest(BaseModel):
+    guest_id: str
+    # One selfie encoding, or several reference encodings (or both)
+    encoding: Optional[List[float]] = None
+    encodings: Optional[List[List[float]]] = None
+
+
+class RegisterGuestResponse(BaseModel):
+    guest_id: str
+    reference_count: int
+    matches: List[FaceMatch]
+
+
+class AddGuestReferencesRequest(BaseModel):
+    # Encodings of additional selfies and/or indexed faces confirmed by the guest
+    encodings: List[List[float]] = []
+    face_ids: List[str] = []
+
+
+class AddEventFacesRequest(BaseModel):
+    faces: List[PhotoFaceInput]
+
+
+class RemoveEventFacesRequest(BaseModel):
+    face_ids: List[str]
+
+
+class MatchDelta(FaceMatch):
+    guest_id: str
+    sequence: int
+    detected_at: datetime
+
+
+class AddEventFacesResponse(BaseModel):
+    faces_added: int
+    total_faces: int
+    new_matches: List[MatchDelta]
+
+
+class MatchDeltasResponse(BaseModel):
+    event_id: str
+    deltas: List[MatchDelta]
+    latest_sequence: int
+
+
+# Event clustering models
+class ClusterEventRequest(BaseModel):
+    method: Optional[str] = None  # chinese_whispers or components
+    threshold: Optional[float] = None
+
+
+class ClusterEventResponse(BaseModel):
+    event_id: str
+    face_count: int
+    cluster_count: int
+    method: str
+    threshold: float
+    seconds: float
+
+
+class EventCluster(BaseModel):
+    cluster_id: int
+    size: int
+    photo_ids: List[str]
+    representative_face_id: str
+
+
+class EventClustersResponse(BaseModel):
+    event_id: str
+    index_version: int
+    clusters: List[EventCluster]
+
+
+# Re-encoding models
+class ReencodeEventRequest(BaseModel):
+    num_jitters: int = 1
+
+
+class ReencodeJobResponse(BaseModel):
+    job_id: str
+    event_id: str
+    num_jitters: int
+    status: str  # pending, running, completed or failed
+    error: Optional[str] = None
+    photos_total: int
+    photos_done: int
+    photos_failed: int
+    faces: int
+    seconds: float
+    created_at: str
+    finished_at: Optional[str] = None
+
+
+class EventMatchRequest(BaseModel):
+    # Target encoding(s), and/or the references of a registered guest
+    target_encoding: Optional[List[float]] = None
+    target_encodings: Optional[List[List[float]]] = None
+    guest_id: Optional[str] = None
+    fusion: Optional[str] = None  # min or centroid
+
+
+class EventMatchResponse(BaseModel):
+    matches: List[FaceMatch]
+    faces_compared: int
+    used_clusters: bool
+    sharded: bool = False
+    cached: bool = False
+
+
 # File upload API models (for PR #7 direct upload approach)
 class FaceDetectionResponse(BaseModel):
     face_count: int
@@ -101,6 +358,141 @@ async def health_check():
     )
 
 
+@router.get("/ready", response_model=ReadinessResponse)
+async def readiness_check(response: Response):
+    """
+    Readiness probe, separate from /health.
+    
+    Returns 503 until the face models have been loaded and warmed up, so load
+    balancers only route traffic to workers that can serve at full speed.
+    Redis status is reported but does not affect readiness.
+    """
+    ready = face_service.is_warm or not settings.warmup_on_startup
+    if not ready:
+        response.status_code = 503
+    
+    return ReadinessResponse(
+        ready=ready,
+        models_loaded=face_service.is_warm,
+        face_recognition_available=face_service.is_available if face_service.is_warm else False,
+        warmup_seconds=face_service.warmup_seconds,
+        redis_connected=redis_service.client is not None
+    )
+
+
+@router.get("/admission/stats")
+async def admission_stats():
+    """Per work class concurrency, queueing and load-shedding statistics."""
+    return admission_controller.stats()
+
+
+@router.get("/event-indexes/stats")
+async def event_index_stats():
+    """Resident event indexes, memory budget, hits, lazy loads and evictions."""
+    return event_indexes.stats()
+
+
+@router.get("/match-cache/stats")
+async def match_cache_stats():
+    """Hit/miss, eviction and invalidation counters of the event match cache."""
+    return match_cache.stats()
+
+
+@router.get("/result-stream/stats")
+async def result_stream_stats():
+    """Published entries, failures and bytes of the detection result stream."""
+    return result_stream.stats()
+
+
+@router.get("/tiled-detection/stats")
+async def tiled_detection_stats():
+    """Images, tiles and merged faces of tiled detection for large images."""
+    return tiled_detector.stats()
+
+
+@router.get("/match-stream/stats")
+async def match_stream_stats():
+    """Scans, time to first result and scan time of streamed event matching."""
+    return progressive_matcher.stats()
+
+
+@router.get("/single-flight/stats")
+async def single_flight_stats():
+    """Executions and coalesced calls of concurrent identical detection and encoding requests."""
+    return single_flight.stats()
+
+
+@router.get("/video/stats")
+async def video_stats():
+    """Clips, decoded frames, detected keyframes and face tracks of video ingestion."""
+    return video_processor.stats()
+
+
+@router.get("/ingest-scheduler/stats")
+async def ingest_scheduler_stats():
+    """Queued events, dispatched photos and per-event queue waits of fair ingest scheduling."""
+    return await asyncio.to_thread(ingest_scheduler.stats)
+
+
+@router.get("/memory/stats")
+async def memory_stats():
+    """Peak traced allocation and RSS of sampled requests per route and detection stage."""
+    return memory_profiler.stats()
+
+
+@router.get("/admin/memory/top")
+async def memory_top_allocators(limit: int = 20, group_by: str = "lineno", compare: bool = False):
+    """
+    Largest live allocations by source location, from a heap snapshot.
+    
+    group_by is lineno, filename or traceback (frames per MEMORY_PROFILING_FRAMES).
+    With compare, reports the growth since POST /admin/memory/baseline, to find
+    what accumulates between two points in time.
+    """
+    if group_by not in ("lineno", "filename", "traceback"):
+        raise HTTPException(status_code=400, detail="group_by must be lineno, filename or traceback")
+    if not memory_profiler.tracing:
+        raise HTTPException(status_code=400, detail="Memory profiling is disabled")
+    try:
+        # Snapshots of a large heap take seconds; keep them off the event loop
+        return await asyncio.to_thread(memory_profiler.top_allocators, limit, group_by, compare)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@router.post("/admin/memory/baseline")
+async def memory_baseline():
+    """Take the heap snapshot that /admin/memory/top?compare=true reports growth against."""
+    if not memory_profiler.tracing:
+        raise HTTPException(status_code=400, detail="Memory profiling is disabled")
+    traced = await asyncio.to_thread(memory_profiler.take_baseline)
+    return {"baseline": True, "traced_bytes": traced}
+
+
+@router.get("/reencode/stats")
+async def reencode_stats():
+    """Re-encode jobs run and faces re-encoded from stored chips."""
+    return reencoder.stats()
+
+
+@router.get("/tagging/stats")
+async def tagging_stats():
+    """Photos tagged and average time of the image statistics."""
+    return image_tagger.stats()
+
+
+@router.get("/synthetic-engine/stats")
+async def synthetic_engine_stats():
+    """Configuration and detections of the synthetic face engine used for load tests."""
+    return {"engine": face_service.engine, **synthetic_engine.stats()}
+
+
+@router.get("/sharded-matching/stats")
+async def sharded_matching_stats():
+    """Worker processes and shared memory snapshots of sharded event matching."""
+    return sharded_matcher.stats()
+
+
 @router.get("/")
 async def root():
     """Root endpoint"""
@@ -120,74 +512,328 @@ async def root():
 
 
 # URL-based face detection endpoint (for PR #9 backend)
-@router.post("/detect-faces-url", response_model=DetectFacesResponse)
-async def detect_faces_url(request: ImageUrlRequest):
+@router.post(
+    "/detect-faces-url",
+    response_model=DetectFacesResponse,
+    dependencies=[Depends(admit(BATCH))]
+)
+async def detect_faces_url(request: DetectFacesUrlRequest):
     """
     Detect all faces in an image from a URL and return their encodings.
     
     This endpoint is called by the background worker when processing uploaded photos.
+    If event_id and photo_id are given, the faces are also matched incrementally
+    against the guests registered for the event and, when result streaming is
+    enabled, published to the event's detection stream. With generate_derivatives,
+    thumbnails and face crops are written from the image decoded for detection.
+    With store_chips, the aligned face chips and landmarks are stored as well,
+    so the photo's faces can be re-encoded later without re-detection.
     """
-    result = await face_service.detect_faces_from_url(request.image_url)
+    for option in ("generate_derivatives", "store_chips"):
+        if getattr(request, option):
+            if not request.photo_id:
+                raise HTTPException(status_code=400, detail=f"{option} requires photo_id")
+            validate_derivative_ids(request.photo_id, request.event_id)
+    
+    result = await face_service.detect_faces_from_url(
+        request.image_url,
+        keep_image=request.generate_derivatives,
+        store_chips=request.store_chips
+    )
     
     if "error" in result and result.get("face_count", 0) == 0:
         # Still return the result, let the caller decide what to do
         pass
     
-    return DetectFacesResponse(
-        face_count=result.get("face_count", 0),
-        faces=[
-            DetectedFace(
-                index=f["index"],
-                encoding=f["encoding"],
-                bounding_box=FaceBoundingBox(**f["bounding_box"])
+    await attach_derivatives(result, request.photo_id, request.event_id)
+    await attach_chips(result, request.photo_id, request.event_id)
+    
+    if request.event_id and request.photo_id:
+        await ingest_detection(request.event_id, request.photo_id, result)
+    
+    # Encodings stay NumPy arrays and are serialized directly (schema: DetectFacesResponse)
+    return ORJSONNumpyResponse({
+        "face_count": result.get("face_count", 0),
+        "faces": result.get("faces", []),
+        "error": result.get("error"),
+        "derivatives": result.get("derivatives"),
+        "chips": result.get("chips")
+    })
+
+
+def validate_derivative_ids(photo_id: str, event_id: Optional[str]):
+    try:
+        photo_processor.derivative_prefix(photo_id, event_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def attach_derivatives(result: dict, photo_id: Optional[str], event_id: Optional[str]):
+    """Write derivatives from the decoded image kept in the detection result, if any."""
+    image = result.pop("image", None)
+    if image is None:
+        return
+    started = time.perf_counter()
+    try:
+        with memory_profiler.stage("derivatives"):
+            result["derivatives"] = await asyncio.to_thread(
+                photo_processor.generate_derivatives, image, photo_id, event_id, result.get("faces")
             )
-            for f in result.get("faces", [])
-        ],
-        error=result.get("error")
+    except Exception as e:
+        # Detection results are still delivered without derivatives
+        logger.error(f"Derivative generation failed for photo {photo_id}: {e}")
+    result.setdefault("timings", {})["derivatives_ms"] = (time.perf_counter() - started) * 1000
+
+
+async def attach_chips(result: dict, photo_id: Optional[str], event_id: Optional[str]):
+    """Store the aligned face chips kept in the detection result, if any."""
+    chips = result.pop("chips", None)
+    landmarks = result.pop("landmarks", None)
+    if not chips:
+        return
+    started = time.perf_counter()
+    try:
+        with memory_profiler.stage("chips"):
+            result["chips"] = await asyncio.to_thread(
+                face_chip_store.save, photo_id, event_id, result["faces"], chips, landmarks
+            )
+    except Exception as e:
+        # As with derivatives, detection results are still delivered without chips
+        logger.error(f"Storing face chips failed for photo {photo_id}: {e}")
+    result.setdefault("timings", {})["chips_ms"] = (time.perf_counter() - started) * 1000
+
+
+async def ingest_detection(event_id: str, photo_id: str, result: dict):
+    """Feed an event photo's detected faces to incremental matching and the result stream."""
+    if result.get("faces") and settings.event_state_enabled:
+        await run_on_index(
+            incremental_matcher.ingest_faces,
+            event_id,
+            [
+                {
+                    "photo_id": photo_id,
+                    "face_id": f"{photo_id}:{f['index']}",
+                    "encoding": f["encoding"]
+                }
+                for f in result["faces"]
+            ]
+        )
+    if result_stream.enabled:
+        await asyncio.to_thread(result_stream.publish, event_id, photo_id, result)
+
+
+async def detect_event_photo(request: EventPhotoUrlRequest):
+    """Detect an event photo and deliver the result (derivatives, chips, matching, stream)."""
+    result = await face_service.detect_faces_from_url(
+        request.image_url,
+        keep_image=request.generate_derivatives,
+        store_chips=request.store_chips
     )
+    await attach_derivatives(result, request.photo_id, request.event_id)
+    await attach_chips(result, request.photo_id, request.event_id)
+    await ingest_detection(request.event_id, request.photo_id, result)
+
+
+async def process_ingest_job(job: dict):
+    """Detection of a photo dispatched by the ingest scheduler (which holds the admission slot)."""
+    await detect_event_photo(EventPhotoUrlRequest(**job))
+
+
+# Background detections of /detect-faces-url/async (the event loop keeps only weak references)
+background_detections: set[asyncio.Task] = set()
+
+
+async def detect_and_publish(request: EventPhotoUrlRequest):
+    """Background task of /detect-faces-url/async."""
+    try:
+        await detect_event_photo(request)
+    except Exception as e:
+        logger.error(f"Background detection of photo {request.photo_id} failed: {e}")
+
+
+def finish_background_detection(task: asyncio.Task, started: float):
+    """Done callback of a background detection: runs even if the task was cancelled before starting."""
+    background_detections.discard(task)
+    admission_controller.release(BATCH, started)
+
+
+@router.post("/detect-faces-url/async", response_model=DetectionAcceptedResponse, status_code=202)
+async def detect_faces_url_async(request: EventPhotoUrlRequest):
+    """
+    Fire-and-forget variant of /detect-faces-url for event photos.
+    
+    Returns 202 immediately; detection runs in the background and the result is
+    appended to the event's Redis Stream, where the backend reads results in
+    batches with XREADGROUP instead of holding a connection open per photo.
+    The batch admission slot is held until the background detection finishes,
+    so overload is still answered with 429 at submission. The detection task is
+    started before the response is sent and returns the slot when it completes,
+    fails or is cancelled, so a client that disconnects early cannot leak it.
+    """
+    if not result_stream.enabled:
+        raise HTTPException(status_code=400, detail="Detection result streaming is disabled")
+    if request.generate_derivatives or request.store_chips:
+        validate_derivative_ids(request.photo_id, request.event_id)
+    if not await asyncio.to_thread(redis_service.is_connected):
+        raise HTTPException(status_code=503, detail="Redis unavailable, detection results cannot be delivered")
+    
+    started = await acquire_slot(BATCH)
+    task = asyncio.ensure_future(detect_and_publish(request))
+    background_detections.add(task)
+    task.add_done_callback(lambda done: finish_background_detection(done, started))
+    return DetectionAcceptedResponse(
+        accepted=True,
+        event_id=request.event_id,
+        photo_id=request.photo_id,
+        stream=result_stream.stream_key(request.event_id)
+    )
+
+
+@router.post("/ingest/photos", response_model=IngestQueuedResponse, status_code=202)
+async def ingest_photo(request: EventPhotoUrlRequest):
+    """
+    Queue an event photo for detection behind the other photos of its event.
+    
+    Events are served by weighted fair queueing instead of first come, first
+    served: an event with thousands of queued photos gets the same share of
+    detection as one with a few, and events with active guests or in live mode
+    get a larger share. Results are delivered to the event's detection stream,
+    as with /detect-faces-url/async.
+    """
+    if not ingest_scheduler.enabled:
+        raise HTTPException(status_code=400, detail="Ingest scheduling is disabled")
+    if not result_stream.enabled:
+        raise HTTPException(status_code=400, detail="Detection result streaming is disabled")
+    if request.generate_derivatives or request.store_chips:
+        validate_derivative_ids(request.photo_id, request.event_id)
+    
+    depth = await asyncio.to_thread(ingest_scheduler.enqueue, request.model_dump())
+    if depth is None:
+        raise HTTPException(status_code=503, detail="Redis unavailable, photo cannot be queued")
+    return IngestQueuedResponse(
+        queued=True,
+        event_id=request.event_id,
+        photo_id=request.photo_id,
+        queue_depth=depth,
+        stream=result_stream.stream_key(request.event_id)
+    )
+
+
+@router.get("/events/{event_id}/ingest")
+async def event_ingest_status(event_id: str):
+    """Queued photos, current share (weight and boosts) and queue waits of an event."""
+    stats = await asyncio.to_thread(ingest_scheduler.event_stats, event_id)
+    if stats is None:
+        raise HTTPException(status_code=503, detail="Redis unavailable")
+    return stats
+
+
+@router.post("/events/{event_id}/live")
+async def start_event_live(event_id: str, request: EventLiveRequest = EventLiveRequest()):
+    """
+    Put an event in live mode: its photos get the largest ingest share.
+    
+    Live mode ends after ttl_seconds unless renewed, or with DELETE.
+    """
+    if not await asyncio.to_thread(ingest_scheduler.set_live, event_id, True, request.ttl_seconds):
+        raise HTTPException(status_code=503, detail="Redis unavailable")
+    return {"event_id": event_id, "live": True}
+
+
+@router.delete("/events/{event_id}/live")
+async def end_event_live(event_id: str):
+    """End an event's live mode."""
+    if not await asyncio.to_thread(ingest_scheduler.set_live, event_id, False):
+        raise HTTPException(status_code=503, detail="Redis unavailable")
+    return {"event_id": event_id, "live": False}
+
+
+@router.post(
+    "/detect-faces-video-url",
+    response_model=DetectVideoFacesResponse,
+    dependencies=[Depends(admit(BATCH))]
+)
+async def detect_faces_video_url(request: VideoUrlRequest):
+    """
+    Face tracks of a short video clip from a URL, one encoding per tracked face.
+    
+    The clip is decoded as a stream; faces are detected only on keyframes
+    chosen by scene change (or a maximum interval), linked into tracks by box
+    overlap, and each track is encoded once from its best frame. With event_id
+    and clip_id the tracks are added to the event and matched like photo faces.
+    """
+    result = await face_service.detect_faces_in_video_from_url(request.video_url)
+    
+    if request.event_id and request.clip_id:
+        await ingest_detection(request.event_id, request.clip_id, result)
+    
+    return ORJSONNumpyResponse({
+        "track_count": result.get("track_count", 0),
+        "tracks": result.get("faces", []),
+        "video": result.get("video"),
+        "error": result.get("error")
+    })
+
+
+@router.post(
+    "/photos/derivatives",
+    response_model=PhotoDerivativesResponse,
+    dependencies=[Depends(admit(BATCH))]
+)
+async def photo_derivatives(request: PhotoDerivativesRequest):
+    """
+    Write thumbnails (and crops of the given face boxes) of a photo without detection.
+    
+    The photo is decoded with reduce-on-decode, only at the scale of the largest
+    thumbnail. Photos that go through /detect-faces-url should request
+    generate_derivatives there instead, reusing the detection download and decode.
+    """
+    validate_derivative_ids(request.photo_id, request.event_id)
+    image_data = await face_service.download_image_bytes(request.image_url)
+    if image_data is None:
+        raise HTTPException(status_code=400, detail="Failed to load image")
+    
+    faces = [{"index": i, "bounding_box": box.model_dump()} for i, box in enumerate(request.faces or [])]
+    try:
+        derivatives = await asyncio.to_thread(
+            photo_processor.generate_derivatives, image_data, request.photo_id, request.event_id, faces
+        )
+    except UnidentifiedImageError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid image: {e}")
+    return PhotoDerivativesResponse(photo_id=request.photo_id, **derivatives)
 
 
 # File upload face detection endpoint (for PR #7 direct upload)
-@router.post("/detect-faces", response_model=FaceDetectionResponse)
-async def detect_faces(file: UploadFile = File(...)):
+@router.post(
+    "/detect-faces",
+    response_model=FaceDetectionResponse,
+    dependencies=[Depends(admit(BATCH))],
+    openapi_extra=IMAGE_UPLOAD_OPENAPI
+)
+async def detect_faces(request: Request):
     """
     Detect faces in an uploaded photo.
     Returns face count and encoded face data for each detected face.
     """
+    # Stream, validate and decode the upload (raises 400/413/415)
+    with memory_profiler.stage("upload"):
+        upload = await receive_image_upload(request)
+    
     try:
-        # Validate file type
-        if not file.content_type or not file.content_type.startswith("image/"):
-            raise HTTPException(status_code=400, detail="File must be an image")
-        
-        # Validate specific image formats
-        allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/gif", "image/webp"]
-        if file.content_type not in allowed_types:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Unsupported image format. Allowed formats: {', '.join(allowed_types)}"
-            )
-        
-        # Read image data
-        image_data = await file.read()
-        
-        # Validate file size (10MB max)
-        max_size = 10 * 1024 * 1024  # 10MB
-        if len(image_data) > max_size:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"File size exceeds maximum limit of {max_size / (1024 * 1024):.0f}MB"
-            )
-        
-        # Detect faces
-        result = face_service.detect_faces(image_data)
+        # Detect faces (identical concurrent uploads share one detection)
+        result = await single_flight.run(
+            "detect_faces_upload",
+            content_key(upload.data),
+            lambda: asyncio.to_thread(face_service.detect_faces, upload.image)
+        )
         
         logger.info(f"Detected {result['face_count']} faces in uploaded image")
         
-        return FaceDetectionResponse(
-            face_count=result["face_count"],
-            encodings=result["encodings"],
-            locations=result["locations"]
-        )
+        return ORJSONNumpyResponse({
+            "face_count": result["face_count"],
+            "encodings": result["encodings"],
+            "locations": result["locations"]
+        })
         
     except Exception as e:
         logger.error(f"Face detection error: {e}")
@@ -195,7 +841,11 @@ async def detect_faces(file: UploadFile = File(...)):
 
 
 # URL-based selfie encoding endpoint (for PR #9 backend)
-@router.post("/encode-selfie-url", response_model=EncodeSelfieResponse)
+@router.post(
+    "/encode-selfie-url",
+    response_model=EncodeSelfieResponse,
+    dependencies=[Depends(admit(INTERACTIVE))]
+)
 async def encode_selfie_url(request: ImageUrlRequest):
     """
     Encode a single face from a selfie image URL.
@@ -205,45 +855,35 @@ async def encode_selfie_url(request: ImageUrlRequest):
     """
     result = await face_service.encode_selfie_from_url(request.image_url)
     
-    return EncodeSelfieResponse(
-        face_detected=result.get("face_detected", False),
-        encoding=result.get("encoding"),
-        error=result.get("error")
-    )
+    return ORJSONNumpyResponse({
+        "face_detected": result.get("face_detected", False),
+        "encoding": result.get("encoding"),
+        "error": result.get("error")
+    })
 
 
 # File upload selfie encoding endpoint (for PR #7 direct upload)
-@router.post("/encode-selfie", response_model=SelfieEncodingResponse)
-async def encode_selfie(file: UploadFile = File(...)):
+@router.post(
+    "/encode-selfie",
+    response_model=SelfieEncodingResponse,
+    dependencies=[Depends(admit(INTERACTIVE))],
+    openapi_extra=IMAGE_UPLOAD_OPENAPI
+)
+async def encode_selfie(request: Request):
     """
     Process a selfie and return the face encoding for matching.
     """
+    # Stream, validate and decode the upload (raises 400/413/415)
+    with memory_profiler.stage("upload"):
+        upload = await receive_image_upload(request)
+    
     try:
-        # Validate file type
-        if not file.content_type or not file.content_type.startswith("image/"):
-            raise HTTPException(status_code=400, detail="File must be an image")
-        
-        # Validate specific image formats
-        allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/gif", "image/webp"]
-        if file.content_type not in allowed_types:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Unsupported image format. Allowed formats: {', '.join(allowed_types)}"
-            )
-        
-        # Read image data
-        image_data = await file.read()
-        
-        # Validate file size (10MB max)
-        max_size = 10 * 1024 * 1024  # 10MB
-        if len(image_data) > max_size:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"File size exceeds maximum limit of {max_size / (1024 * 1024):.0f}MB"
-            )
-        
-        # Encode selfie
-        encoding = face_service.encode_selfie(image_data)
+        # Encode selfie (identical concurrent uploads share one encoding)
+        encoding = await single_flight.run(
+            "encode_selfie_upload",
+            content_key(upload.data),
+            lambda: asyncio.to_thread(face_service.encode_selfie, upload.image)
+        )
         
         if encoding is None:
             return SelfieEncodingResponse(
@@ -264,13 +904,19 @@ async def encode_selfie(file: UploadFile = File(...)):
 
 
 # Unified face matching endpoint (works with both approaches)
-@router.post("/match-faces-structured", response_model=MatchFacesResponse)
+@router.post(
+    "/match-faces-structured",
+    response_model=MatchFacesResponse,
+    dependencies=[Depends(admit(INTERACTIVE))]
+)
 async def match_faces_structured(request: MatchFacesRequest):
     """
     Match a target face encoding against a list of photo faces (structured format).
     
     This endpoint performs the face matching algorithm to find photos
-    containing a specific person based on their selfie encoding.
+    containing a specific person based on their selfie encoding. Several
+    reference encodings are evaluated in one pass (closest reference, or
+    their centroid with fusion=centroid).
     """
     photo_faces = [
         {
@@ -281,22 +927,454 @@ async def match_faces_structured(request: MatchFacesRequest):
         for pf in request.photo_faces
     ]
     
-    matches = face_service.match_faces(request.target_encoding, photo_faces)
+    references = reference_encodings(request.target_encoding, request.target_encodings)
+    if not references:
+        raise HTTPException(status_code=400, detail="target_encoding or target_encodings is required")
     
-    return MatchFacesResponse(
-        matches=[
-            FaceMatch(
-                photo_id=m["photo_id"],
-                face_id=m["face_id"],
-                distance=m["distance"],
-                confidence=m["confidence"]
-            )
-            for m in matches
+    try:
+        matches = await asyncio.to_thread(
+            face_service.match_faces, references, photo_faces, request.fusion or settings.guest_fusion
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return ORJSONNumpyResponse({"matches": matches})
+
+
+@router.post(
+    "/events/{event_id}/guests",
+    response_model=RegisterGuestResponse,
+    dependencies=[Depends(require_event_state), Depends(admit(INTERACTIVE))]
+)
+async def register_event_guest(event_id: str, request: RegisterGuestRequest):
+    """
+    Register a guest's selfie encoding(s) for incremental matching.
+    
+    Returns the matches among the faces already indexed for the event. Faces
+    added later are matched automatically and reported as match deltas.
+    """
+    await ingest_scheduler.note_guest_activity(event_id)
+    try:
+        matches = await run_on_index(
+            incremental_matcher.register_guest,
+            event_id, request.guest_id, reference_encodings(request.encoding, request.encodings)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return ORJSONNumpyResponse({
+        "guest_id": request.guest_id,
+        "reference_count": incremental_matcher.reference_count(event_id, request.guest_id),
+        "matches": matches
+    })
+
+
+@router.post(
+    "/events/{event_id}/guests/{guest_id}/references",
+    response_model=RegisterGuestResponse,
+    dependencies=[Depends(require_event_state), Depends(admit(INTERACTIVE))]
+)
+async def add_guest_references(event_id: str, guest_id: str, request: AddGuestReferencesRequest):
+    """
+    Add reference encodings to a guest profile to improve recall.
+    
+    References can come from additional selfies or from faces the guest confirmed
+    as themselves. Returns all matches of the updated profile.
+    """
+    await ingest_scheduler.note_guest_activity(event_id)
+    try:
+        matches = await run_on_index(
+            incremental_matcher.add_references, event_id, guest_id, request.encodings, request.face_ids
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if matches is None:
+        raise HTTPException(status_code=404, detail="Guest not registered for this event")
+    
+    return ORJSONNumpyResponse({
+        "guest_id": guest_id,
+        "reference_count": incremental_matcher.reference_count(event_id, guest_id),
+        "matches": matches
+    })
+
+
+@router.delete("/events/{event_id}/guests/{guest_id}", dependencies=[Depends(require_event_state)])
+async def unregister_event_guest(event_id: str, guest_id: str):
+    """Stop incremental matching for a guest."""
+    if not incremental_matcher.unregister_guest(event_id, guest_id):
+        raise HTTPException(status_code=404, detail="Guest not registered for this event")
+    return {"event_id": event_id, "guest_id": guest_id, "removed": True}
+
+
+@router.post(
+    "/events/{event_id}/faces",
+    response_model=AddEventFacesResponse,
+    dependencies=[Depends(require_event_state)]
+)
+async def add_event_faces(event_id: str, request: AddEventFacesRequest):
+    """
+    Add newly detected faces to the event index.
+    
+    Only the new faces are matched against the event's registered guests.
+    """
+    faces_before = len(await run_on_index(event_indexes.get_or_create, event_id))
+    
+    deltas = await run_on_index(
+        incremental_matcher.ingest_faces,
+        event_id,
+        [
+            {"photo_id": f.photo_id, "face_id": f.face_id, "encoding": f.encoding}
+            for f in request.faces
         ]
     )
+    
+    # Re-resolved: the index may have been evicted and reloaded meanwhile
+    total_faces = len(await run_on_index(event_indexes.get_or_create, event_id))
+    return ORJSONNumpyResponse({
+        "faces_added": total_faces - faces_before,
+        "total_faces": total_faces,
+        "new_matches": deltas
+    })
+
+
+@router.post("/events/{event_id}/faces/remove", dependencies=[Depends(require_event_state)])
+async def remove_event_faces(event_id: str, request: RemoveEventFacesRequest):
+    """Remove faces (e.g. of deleted photos) from the event index."""
+    index, removed = await run_on_index(event_indexes.remove_faces, event_id, request.face_ids)
+    
+    return {
+        "event_id": event_id,
+        "faces_removed": removed,
+        "total_faces": len(index) if index else 0
+    }
+
+
+@router.post("/events/{event_id}/pin", dependencies=[Depends(require_event_state)])
+async def pin_event(event_id: str):
+    """
+    Keep an event's face index resident (e.g. while the event is live).
+    
+    Pinned indexes are never evicted under the index memory budget; the index
+    is loaded now if it was evicted.
+    """
+    event_indexes.pin(event_id)
+    index = await run_on_index(event_indexes.get, event_id)
+    return {"event_id": event_id, "pinned": True, "resident": index is not None}
+
+
+@router.delete("/events/{event_id}/pin", dependencies=[Depends(require_event_state)])
+async def unpin_event(event_id: str):
+    """Make an event's face index evictable again."""
+    if not await run_on_index(event_indexes.unpin, event_id):
+        raise HTTPException(status_code=404, detail="Event is not pinned")
+    return {"event_id": event_id, "pinned": False}
+
+
+@router.delete("/events/{event_id}/index", dependencies=[Depends(require_event_state)])
+async def drop_event_index(event_id: str):
+    """
+    Forget an event's face index (e.g. when the event is deleted).
+    
+    Also deletes its Redis snapshot and releases its clusters, cached matches
+    and sharded matching memory.
+    """
+    resident = await asyncio.to_thread(event_indexes.drop, event_id)
+    return {"event_id": event_id, "dropped": True, "was_resident": resident}
+
+
+@router.get(
+    "/events/{event_id}/match-deltas",
+    response_model=MatchDeltasResponse,
+    dependencies=[Depends(require_event_state)]
+)
+async def get_match_deltas(event_id: str, since: int = 0, guest_id: Optional[str] = None):
+    """
+    Poll for new guest matches found since the given sequence number.
+    
+    The same deltas are published on the Redis channel snapory:event:{event_id}:matches.
+    """
+    deltas, latest = incremental_matcher.get_deltas(event_id, since, guest_id)
+    
+    return ORJSONNumpyResponse({
+        "event_id": event_id,
+        "deltas": deltas,
+        "latest_sequence": latest
+    })
+
+
+@router.post(
+    "/events/{event_id}/cluster",
+    response_model=ClusterEventResponse,
+    dependencies=[Depends(require_event_state), Depends(admit(BATCH))]
+)
+async def cluster_event(event_id: str, request: ClusterEventRequest = ClusterEventRequest()):
+    """
+    Group the event's indexed faces by identity.
+    
+    Runs in a worker thread; event matching uses the stored clusters afterwards.
+    """
+    try:
+        result = await run_on_index(face_clusterer.cluster_event, event_id, request.method, request.threshold)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if result is None:
+        raise HTTPException(status_code=404, detail="No faces indexed for this event")
+    
+    return ClusterEventResponse(
+        event_id=event_id,
+        face_count=result.face_count,
+        cluster_count=result.cluster_count,
+        method=result.method,
+        threshold=result.threshold,
+        seconds=result.seconds
+    )
+
+
+@router.get(
+    "/events/{event_id}/clusters",
+    response_model=EventClustersResponse,
+    dependencies=[Depends(require_event_state)]
+)
+async def get_event_clusters(event_id: str, min_size: int = 2):
+    """
+    People in this event: clusters of faces by identity, largest first.
+    """
+    result = face_clusterer.get(event_id)
+    index = await run_on_index(event_indexes.get, event_id)
+    if result is None or index is None:
+        raise HTTPException(status_code=404, detail="Event has not been clustered")
+    
+    # Reads the index under its lock: off the event loop, so ingestion does not stall it
+    clusters = await asyncio.to_thread(_event_cluster_list, index, result, min_size)
+    if clusters is None:
+        raise HTTPException(status_code=409, detail="Faces were removed or re-encoded since clustering, re-cluster the event")
+    
+    return EventClustersResponse(
+        event_id=event_id,
+        index_version=result.index_version,
+        clusters=clusters
+    )
+
+
+def _event_cluster_list(index, result, min_size: int) -> Optional[List[EventCluster]]:
+    """Clusters of at least min_size faces with their photos and representative face (None if stale)."""
+    clusters = []
+    with index.lock:
+        if not result.is_valid_for(index):
+            return None
+        
+        for cluster_id in np.flatnonzero(result.sizes >= min_size):
+            members = result.members(cluster_id)
+            vectors = encoding_codec.to_float(index.matrix[members])
+            closest = members[np.argmin(np.linalg.norm(vectors - result.centroids[cluster_id], axis=1))]
+            clusters.append(EventCluster(
+                cluster_id=int(cluster_id),
+                size=len(members),
+                photo_ids=list(dict.fromkeys(index.photo_ids[row] for row in members)),
+                representative_face_id=index.face_ids[closest]
+            ))
+    return clusters
 
 
-@router.post("/match-faces", response_model=FaceMatchResponse)
+@router.post(
+    "/events/{event_id}/reencode",
+    response_model=ReencodeJobResponse,
+    status_code=202,
+    dependencies=[Depends(require_event_state)]
+)
+async def reencode_event(event_id: str, request: ReencodeEventRequest = ReencodeEventRequest()):
+    """
+    Recompute the encodings of an event's faces from their stored chips.
+    
+    For photos detected with store_chips. Returns 202 with the job, which runs
+    in the background (poll GET /reencode/{job_id}); the new encodings replace
+    the old ones in the event index and are published to the detection stream.
+    """
+    if face_service.is_synthetic or not face_service.is_available:
+        raise HTTPException(status_code=503, detail="Re-encoding requires the dlib face engine")
+    if request.num_jitters < 1:
+        raise HTTPException(status_code=400, detail="num_jitters must be at least 1")
+    try:
+        photo_processor.event_prefix(event_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    job = reencoder.start(event_id, request.num_jitters)
+    return ReencodeJobResponse(**job.as_dict())
+
+
+@router.get("/reencode/{job_id}", response_model=ReencodeJobResponse)
+async def get_reencode_job(job_id: str):
+    """Progress of a re-encode job."""
+    job = reencoder.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown re-encode job")
+    return ReencodeJobResponse(**job.as_dict())
+
+
+@router.post(
+    "/events/{event_id}/match",
+    response_model=EventMatchResponse,
+    dependencies=[Depends(require_event_state), Depends(admit(INTERACTIVE))]
+)
+async def match_event(event_id: str, request: EventMatchRequest):
+    """
+    Match a guest encoding against all faces indexed for an event.
+    
+    Several references (target_encodings, or a registered guest's profile) are
+    matched in one pass by their closest reference or their centroid.
+    Results are cached until the event's faces change, so repeat lookups
+    (e.g. gallery reloads) skip matching. Otherwise uses the event's clusters
+    when available (centroids first, then only the candidate clusters), or
+    scans every face, split across worker processes for very large events.
+    """
+    target = event_match_target(event_id, request)
+    await ingest_scheduler.note_guest_activity(event_id)
+    
+    index = await run_on_index(event_indexes.get, event_id)
+    if index is None:
+        return ORJSONNumpyResponse({"matches": [], "faces_compared": 0, "used_clusters": False})
+    
+    threshold = face_service.match_threshold
+    digest = match_cache.encoding_digest(target, threshold)
+    
+    cached = await asyncio.to_thread(match_cache.get, event_id, index.content_key, digest)
+    if cached is not None:
+        return ORJSONNumpyResponse({**cached, "cached": True})
+    
+    content_key, response = await asyncio.to_thread(_match_event_index, index, target, threshold)
+    await asyncio.to_thread(match_cache.put, event_id, content_key, digest, response)
+    
+    return ORJSONNumpyResponse({**response, "cached": False})
+
+
+def event_match_target(event_id: str, request: EventMatchRequest) -> np.ndarray:
+    """Compact query encodings of an event match request (raises 400/404)."""
+    references = reference_encodings(request.target_encoding, request.target_encodings)
+    try:
+        target = encoding_codec.fuse(
+            encoding_codec.to_compact(references), request.fusion or settings.guest_fusion
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if request.guest_id is not None:
+        guest_queries = incremental_matcher.guest_references(event_id, request.guest_id)
+        if guest_queries is None:
+            raise HTTPException(status_code=404, detail="Guest not registered for this event")
+        target = np.vstack([target, guest_queries])
+    if len(target) == 0:
+        raise HTTPException(status_code=400, detail="target_encoding, target_encodings or guest_id is required")
+    return target
+
+
+@router.post("/events/{event_id}/match/stream", dependencies=[Depends(require_event_state)])
+async def match_event_stream(event_id: str, request: EventMatchRequest):
+    """
+    Streaming variant of /events/{event_id}/match for guest galleries (NDJSON).
+    
+    The event is scanned in growing chunks; after each chunk a "chunk" line
+    lists the photos newly matched (or matched closer than before), closest
+    first, so galleries can show the best photos found so far long before the
+    scan completes. A final "summary" line carries the complete ordered match
+    list (as /events/{event_id}/match) and the best match per photo. Cached
+    results are streamed as a single chunk and summary.
+    """
+    target = event_match_target(event_id, request)
+    await ingest_scheduler.note_guest_activity(event_id)
+    threshold = face_service.match_threshold
+    index = await run_on_index(event_indexes.get, event_id)
+    
+    async def lines():
+        if index is None:
+            yield ndjson_line({"type": "summary", "matches": [], "photos": [], "faces_compared": 0, "cached": False})
+            return
+        
+        digest = match_cache.encoding_digest(target, threshold)
+        cached = await asyncio.to_thread(match_cache.get, event_id, index.content_key, digest)
+        if cached is not None:
+            matches = cached["matches"]
+            photos = best_per_photo(matches)
+            yield ndjson_line({
+                "type": "chunk",
+                "photos": photos,
+                "faces_scanned": cached["faces_compared"],
+                "faces_total": cached["faces_compared"]
+            })
+            yield ndjson_line({
+                "type": "summary",
+                "matches": matches,
+                "photos": photos,
+                "faces_compared": cached["faces_compared"],
+                "cached": True
+            })
+            return
+        
+        events = progressive_matcher.scan(index, target, threshold)
+        async for line in ndjson_stream(events, on_summary=lambda summary: cache_stream_summary(
+            event_id, digest, summary
+        )):
+            yield line
+    
+    # Taken before streaming so a busy service still answers 429; released
+    # when the response ends, even if the client left before the body started
+    started = await acquire_slot(INTERACTIVE)
+    return ClosingStreamingResponse(
+        lines(),
+        on_close=lambda: admission_controller.release(INTERACTIVE, started),
+        media_type="application/x-ndjson"
+    )
+
+
+def cache_stream_summary(event_id: str, digest: str, summary: dict):
+    """Store a complete streamed match result in the match cache."""
+    content_key = summary.pop("content_key", None)
+    if content_key is not None:
+        match_cache.put(event_id, content_key, digest, {
+            "matches": summary["matches"],
+            "faces_compared": summary["faces_compared"],
+            "used_clusters": False,
+            "sharded": False
+        })
+    summary["cached"] = False
+
+
+def _match_event_index(index, target: np.ndarray, threshold: float) -> tuple[tuple[int, int], dict]:
+    """Match against an event index; returns the index content key and the response body."""
+    with index.lock:
+        # The result describes the faces as of this content key
+        content_key = index.content_key
+        result = face_clusterer.match(index.event_id, target, threshold)
+        used_clusters = result is not None
+        sharded = not used_clusters and sharded_matcher.should_shard(index)
+        if not sharded:
+            if result is None:
+                rows, distances = index.search(target, threshold)
+                result = {"rows": rows, "distances": distances, "faces_compared": len(index)}
+            rows = result["rows"].tolist()
+            photo_ids = [index.photo_ids[row] for row in rows]
+            face_ids = [index.face_ids[row] for row in rows]
+    
+    if sharded:
+        # Waits for the worker processes without holding the index lock
+        result = sharded_matcher.search(index, target, threshold)
+        content_key, photo_ids, face_ids = result["content_key"], result["photo_ids"], result["face_ids"]
+    
+    return content_key, {
+        "matches": match_list(photo_ids, face_ids, result["distances"], threshold),
+        "faces_compared": result["faces_compared"],
+        "used_clusters": used_clusters,
+        "sharded": sharded
+    }
+
+
+@router.post(
+    "/match-faces",
+    response_model=FaceMatchResponse,
+    dependencies=[Depends(admit(INTERACTIVE))]
+)
 async def match_faces(request: FaceMatchRequest):
     """
     Match a selfie encoding against photos to find all photos containing the person.
@@ -309,30 +1387,34 @@ async def match_faces(request: FaceMatchRequest):
         
         logger.info(f"Found {len(matches)} matching photos out of {len(request.photos)}")
         
-        return FaceMatchResponse(
-            matches=matches,
-            total_searched=len(request.photos)
-        )
+        return ORJSONNumpyResponse({
+            "matches": matches,
+            "total_searched": len(request.photos)
+        })
         
     except Exception as e:
         logger.error(f"Face matching error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/analyze-photo")
-async def analyze_photo(file: UploadFile = File(...)):
+@router.post(
+    "/analyze-photo",
+    dependencies=[Depends(admit(BATCH))],
+    openapi_extra=IMAGE_UPLOAD_OPENAPI
+)
+async def analyze_photo(request: Request):
     """
     Analyze a photo for metadata and basic properties.
     """
+    # Stream, validate and decode the upload (raises 400/413/415)
+    with memory_profiler.stage("upload"):
+        upload = await receive_image_upload(request)
+    
     try:
-        if not file.content_type or not file.content_type.startswith("image/"):
-            raise HTTPException(status_code=400, detail="File must be an image")
-        
-        image_data = await file.read()
-        metadata = photo_processor.analyze_photo(image_data)
+        metadata = await asyncio.to_thread(photo_processor.analyze_photo, upload.image)
         
         # Also detect faces
-        face_result = face_service.detect_faces(image_data)
+        face_result = await asyncio.to_thread(face_service.detect_faces, upload.image)
         
         return {
             "metadata": metadata,
@@ -0,0 +1,226 @@
+"""
+Streaming image upload handling for the file-upload endpoints.
+
+The multipart body is parsed straight from the request stream instead of being
+buffered by FastAPI first. Uploads are rejected as early as possible: on the
+Content-Length header, on the running byte count, and on the magic bytes of the
+first chunk (the client-supplied content type is not trusted). Accepted chunks
+are fed into PIL's incremental decoder as they arrive, so per-request memory is
+bounded by the size limit.
+"""
+
+import asyncio
+import logging
+from typing import Optional
+
+from fastapi import HTTPException, Request
+from PIL import Image, ImageFile
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Allowance for multipart boundaries and part headers on top of the file itself
+MULTIPART_OVERHEAD = 64 * 1024
+
+# Bytes needed to identify every supported format
+SNIFF_LENGTH = 12
+
+ALLOWED_FORMATS = ["image/jpeg", "image/png", "image/gif", "image/webp"]
+
+# OpenAPI description of the multipart body, since the routes read the stream themselves
+IMAGE_UPLOAD_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {"file": {"type": "string", "format": "binary"}}
+                }
+            }
+        }
+    }
+}
+
+
+def sniff_image_format(head: bytes) -> Optional[str]:
+    """Identify the image format from its leading magic bytes."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+class UploadedImage:
+    """An image upload that passed validation, with its raw bytes and decoded image."""
+    
+    def __init__(self, data: bytes, image: Image.Image, content_type: str):
+        self.data = data
+        self.image = image
+        self.content_type = content_type
+    
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+
+class _ImageSink:
+    """Receives file bytes, enforces the size limit, sniffs the format and decodes incrementally."""
+    
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self.content_type: Optional[str] = None
+        self._head = b""
+        self._chunks: list[bytes] = []
+        self._pending: list[bytes] = []
+        self._decoder = ImageFile.Parser()
+    
+    @property
+    def has_pending(self) -> bool:
+        return bool(self._pending)
+    
+    def write(self, data: bytes):
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise _too_large(self.max_size)
+        
+        if self.content_type is None:
+            self._head += data
+            if len(self._head) < SNIFF_LENGTH:
+                return
+            self._detect_format()
+            data, self._head = self._head, b""
+        
+        self._chunks.append(data)
+        self._pending.append(data)
+    
+    def drain(self):
+        """Feed received chunks into the incremental decoder."""
+        pending, self._pending = self._pending, []
+        try:
+            for chunk in pending:
+                self._decoder.feed(chunk)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Invalid or corrupt image: {e}")
+    
+    def finish(self) -> UploadedImage:
+        if self.content_type is None:
+            # File shorter than SNIFF_LENGTH
+            self._detect_format()
+            self._chunks.append(self._head)
+            self._pending.append(self._head)
+        self.drain()
+        
+        try:
+            image = self._decoder.close()
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Invalid or corrupt image: {e}")
+        
+        return UploadedImage(b"".join(self._chunks), image, self.content_type)
+    
+    def _detect_format(self):
+        self.content_type = sniff_image_format(self._head)
+        if self.content_type is None:
+            raise HTTPException(
+                status_code=415,
+                detail=f"Unsupported image format. Allowed formats: {', '.join(ALLOWED_FORMATS)}"
+            )
+
+
+async def receive_image_upload(request: Request, field_name: str = "file") -> UploadedImage:
+    """
+    Stream a multipart image upload from the request body.
+    
+    Args:
+        request: Incoming request with a multipart/form-data body
+        field_name: Name of the form field holding the image
+    
+    Returns:
+        The validated and decoded upload
+    
+    Raises:
+        HTTPException: 413 when too large, 415 for unsupported formats, 400 for
+            malformed bodies, missing files or undecodable images
+    """
+    max_size = settings.max_upload_size_mb * 1024 * 1024
+    max_body = max_size + MULTIPART_OVERHEAD
+    
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > max_body:
+        raise _too_large(max_size)
+    
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+    
+    sink = _ImageSink(max_size)
+    part = {"headers": {}, "field": b"", "value": b"", "is_file": False, "found": False}
+    
+    def on_part_begin():
+        part["headers"] = {}
+        part["is_file"] = False
+    
+    def on_header_field(data, start, end):
+        part["field"] += data[start:end]
+    
+    def on_header_value(data, start, end):
+        part["value"] += data[start:end]
+    
+    def on_header_end():
+        part["headers"][part["field"].lower()] = part["value"]
+        part["field"], part["value"] = b"", b""
+    
+    def on_headers_finished():
+        _, disposition = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        if not part["found"] and disposition.get(b"name") == field_name.encode():
+            part["is_file"] = part["found"] = True
+    
+    def on_part_data(data, start, end):
+        if part["is_file"]:
+            sink.write(bytes(data[start:end]))
+    
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data
+    })
+    
+    received = 0
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > max_body:
+                raise _too_large(max_size)
+            parser.write(chunk)
+            if sink.has_pending:
+                # Decode off the event loop while the rest of the body is still arriving
+                await asyncio.to_thread(sink.drain)
+        parser.finalize()
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Malformed multipart body: {e}")
+    
+    if not part["found"]:
+        raise HTTPException(status_code=400, detail=f"No '{field_name}' file in upload")
+    
+    return await asyncio.to_thread(sink.finish)
+
+
+def _too_large(max_size: int) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"File size exceeds maximum limit of {max_size / (1024 * 1024):.0f}MB"
+    )
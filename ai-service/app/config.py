@@ -1,4 +1,5 @@
 import os
+from typing import Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -7,6 +8,184 @@ class Settings(BaseSettings):
     redis_host: str = "localhost"
     redis_port: int = 6379
     redis_db: int = 0
+    redis_connect_timeout: float = 2.0
+    redis_reconnect_interval: float = 5.0
+    
+    # Startup: defer the face_recognition/dlib import until first use or warm-up,
+    # and warm the models (dummy inference) in the app lifespan before serving.
+    lazy_model_loading: bool = True
+    warmup_on_startup: bool = True
+    
+    # In-memory dtype for face encodings used by the matching engine:
+    # float64, float32, float16 or int8 (scalar-quantised).
+    encoding_dtype: str = "float32"
+    
+    # Distance kernel: "auto" (direct for a single query against fewer than
+    # gemm_min_rows faces, BLAS GEMV/GEMM otherwise), "direct" or "gemm".
+    # blas_threads caps the BLAS threads of each worker process (0 = library default).
+    distance_kernel: str = "auto"
+    gemm_min_rows: int = 256
+    blas_threads: int = 0
+    
+    # Event state (face indexes, guest profiles, match deltas, clusters) lives in
+    # process memory, so all requests of an event must reach the same process:
+    # one worker per instance, events routed to instances by event_id. Disable it
+    # on stateless detection pools running several workers: event routes then
+    # return 503 and detections are only delivered through the result stream.
+    event_state_enabled: bool = True
+    
+    # Incremental matching: number of match deltas kept per event for polling
+    match_delta_retention: int = 10000
+    
+    # Guest profiles: up to max_guest_references encodings per guest, fused as
+    # "min" (closest reference counts) or "centroid" (mean of the references)
+    guest_fusion: str = "min"
+    max_guest_references: int = 10
+    
+    # Event face clustering: linking threshold and method (chinese_whispers or components)
+    cluster_threshold: float = 0.5
+    cluster_method: str = "chinese_whispers"
+    
+    # Event index memory budget: beyond it, least recently used unpinned event
+    # indexes are snapshotted to Redis and reloaded on their next query
+    # (0 = unlimited). Snapshots expire after index_snapshot_ttl seconds.
+    index_memory_budget_mb: float = 0
+    index_snapshot_ttl: int = 604800
+    
+    # Event match result cache: in-process LRU entries, plus an optional shared
+    # Redis tier (entries expire after the TTL)
+    match_cache_size: int = 10000
+    match_cache_redis: bool = False
+    match_cache_ttl: int = 3600
+    
+    # Streamed event matching: the first chunk of faces compared before the first
+    # results are sent, growing by this factor per chunk up to the maximum
+    progressive_match_first_chunk: int = 4096
+    progressive_match_max_chunk: int = 262144
+    progressive_match_growth: int = 4
+    
+    # Sharded matching: events with at least sharded_match_min_faces faces are
+    # scanned by this many worker processes over shared memory (0 = disabled)
+    sharded_match_workers: int = 0
+    sharded_match_min_faces: int = 250000
+    
+    # Detection result stream: detect-faces-url results of event photos are
+    # published to a per-event Redis Stream, capped at about this many entries
+    result_stream_enabled: bool = False
+    result_stream_maxlen: int = 10000
+    
+    # Tiled detection: images of at least tiled_detection_min_pixels are split into
+    # overlapping tiles (the overlap should exceed the largest face) detected by
+    # tiled_detection_workers processes (0 = in process) and merged with NMS
+    tiled_detection_min_pixels: int = 12000000
+    detection_tile_size: int = 2048
+    detection_tile_overlap: int = 256
+    tiled_detection_workers: int = 2
+    detection_nms_iou: float = 0.4
+    
+    # Video clips (needs PyAV): frames per second scored for scene changes, the
+    # thumbnail difference (0-1) that triggers detection and the one treated as
+    # a hard cut, maximum seconds between detections, IoU linking detections
+    # into tracks, seconds after which an unseen track ends, and limits
+    video_sample_fps: float = 5.0
+    video_scene_threshold: float = 0.08
+    video_scene_cut_threshold: float = 0.3
+    video_keyframe_interval: float = 1.0
+    video_track_iou: float = 0.2
+    video_max_track_gap: float = 2.0
+    video_min_track_detections: int = 1
+    video_detect_width: int = 1280
+    video_max_seconds: float = 120.0
+    video_max_size_mb: int = 200
+    
+    # Photo derivatives: thumbnail sizes (longest side in px), format (webp or
+    # jpeg) and quality, square face crops, and the store they are written to
+    # ("local" directory or an S3-compatible bucket, e.g. MinIO via the endpoint)
+    derivative_sizes: list[int] = [320, 1024, 2048]
+    derivative_format: str = "webp"
+    derivative_quality: int = 80
+    face_crop_size: int = 160
+    face_crop_margin: float = 0.3
+    derivative_store: str = "local"
+    derivative_local_dir: str = "derivatives"
+    derivative_s3_bucket: str = "snapory-derivatives"
+    derivative_s3_endpoint: Optional[str] = None
+    derivative_s3_region: Optional[str] = None
+    
+    # Face chips: aligned 150x150 chips and landmarks stored next to the
+    # derivatives when detection asks for them (store_chips), so encodings can
+    # be recomputed without re-detection. Grid image format (png for bit-exact
+    # re-encoding) and quality; re-encode worker processes (0 = in process) and
+    # photos per worker batch
+    face_chip_format: str = "webp"
+    face_chip_quality: int = 90
+    reencode_workers: int = 2
+    reencode_batch_size: int = 64
+    
+    # Photo tagging: statistics are computed on a copy reduced to this longest
+    # side; palette colours and pixels sampled for them; Laplacian variance
+    # below which a photo is tagged blurry
+    tagging_analysis_size: int = 512
+    tagging_palette_colors: int = 5
+    tagging_palette_samples: int = 4096
+    tagging_blur_threshold: float = 60.0
+    
+    # Single-flight: concurrent identical detection/encoding calls (same URL or
+    # upload content) share one computation
+    single_flight_enabled: bool = True
+    
+    # Face engine: "dlib" (face_recognition) or "synthetic" (deterministic fake
+    # faces for load tests without dlib). Synthetic faces per image, identity
+    # pool size and Zipf popularity skew, and simulated detector latency
+    # (busy = spin a core instead of sleeping, like dlib)
+    face_engine: str = "dlib"
+    synthetic_identities: int = 1000
+    synthetic_identity_skew: float = 1.0
+    synthetic_min_faces: int = 0
+    synthetic_max_faces: int = 3
+    synthetic_latency_ms: float = 0
+    synthetic_latency_ms_per_mp: float = 0
+    synthetic_busy_latency: bool = False
+    synthetic_seed: int = 0
+    
+    # Ingest scheduler: event photos submitted to /ingest/photos wait in
+    # per-event Redis queues and are dispatched to detection by weighted fair
+    # queueing, so one large upload cannot starve other events. Events with
+    # active guests (a guest call within the session TTL) or in live mode get
+    # a larger share. Dispatchers per process, and poll interval when idle
+    ingest_scheduler_enabled: bool = False
+    ingest_workers: int = 2
+    ingest_poll_interval: float = 0.5
+    ingest_guest_weight: float = 4.0
+    ingest_live_weight: float = 8.0
+    ingest_guest_session_ttl: int = 300
+    ingest_live_ttl: int = 43200
+    
+    # Memory profiling: trace allocations with tracemalloc and measure a sample
+    # of requests (peak traced allocation, RSS change, detection stage deltas).
+    # Costs CPU while enabled; frames per traced allocation for the admin
+    # top-allocator report
+    memory_profiling_enabled: bool = False
+    memory_profiling_sample_rate: float = 0.05
+    memory_profiling_frames: int = 1
+    
+    # SSRF test mode: private networks (CIDR) image URLs may point to anyway,
+    # e.g. ["127.0.0.1/32"] for the load generator's local image server.
+    # Leave empty in production
+    ssrf_allowed_networks: list[str] = []
+    
+    # Maximum size of a file upload (detect-faces, encode-selfie, analyze-photo)
+    max_upload_size_mb: int = 10
+    
+    # Admission control: interactive (guest) and batch (detection) work get
+    # separate concurrency budgets; requests are shed with 429 when the queue
+    # is full or the predicted queue wait exceeds the latency target.
+    interactive_max_concurrency: int = 8
+    interactive_max_queue: int = 64
+    interactive_latency_target_ms: float = 500
+    batch_max_concurrency: int = 2
+    batch_max_queue: int = 32
+    batch_latency_target_ms: float = 30000
     
     class Config:
         env_file = ".env"
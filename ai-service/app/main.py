@@ -1,8 +1,18 @@
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.api.routes import router
+from app.api.routes import router, process_ingest_job
 from app.config import settings
+from app.services.blas import limit_blas_threads
+from app.services.face_service import face_service
+from app.services.redis_service import redis_service
+from app.services.sharded_matcher import sharded_matcher
+from app.services.tiled_detector import tiled_detector
+from app.services.reencoder import reencoder
+from app.services.ingest_scheduler import ingest_scheduler
+from app.services.memory_profiler import memory_profiler
+from app.api.memory_middleware import MemoryProfilingMiddleware
 import logging
 
 # Configure logging
@@ -19,9 +29,34 @@ async def lifespan(app: FastAPI):
     logger.info(f"Starting {settings.app_name}")
     logger.info(f"Environment: {settings.python_env}")
     logger.info(f"Redis: {settings.redis_host}:{settings.redis_port}")
+    
+    # Before the models load, so their allocations show up in heap snapshots
+    memory_profiler.start()
+    
+    # Per-worker cap so concurrent distance batches do not oversubscribe the cores
+    limit_blas_threads(settings.blas_threads)
+    
+    # Neither step is fatal: a Redis outage only degrades /health, and a failed
+    # warm-up falls back to loading the models on the first request.
+    if not await asyncio.to_thread(redis_service.connect):
+        logger.warning("Redis unavailable at startup, will retry on demand")
+    
+    if settings.warmup_on_startup:
+        try:
+            await asyncio.to_thread(face_service.warm_up)
+        except Exception as e:
+            logger.error(f"Model warm-up failed: {e}")
+    
+    ingest_scheduler.start(process_ingest_job)
+    
     yield
     # Shutdown
     logger.info(f"Shutting down {settings.app_name}")
+    await ingest_scheduler.close()
+    # Stops the matching worker processes and unlinks their shared memory
+    sharded_matcher.close()
+    tiled_detector.close()
+    reencoder.close()
 
 # Create FastAPI app
 app = FastAPI(
@@ -40,6 +75,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Measures a sample of requests when memory profiling is enabled
+app.add_middleware(MemoryProfilingMiddleware)
+
 # Include routers
 app.include_router(router)
 
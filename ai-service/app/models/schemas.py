@@ -21,3 +21,10 @@ class HealthResponse(BaseModel):
     timestamp: datetime
     redis_connected: bool
     queue_length: int
+
+class ReadinessResponse(BaseModel):
+    ready: bool
+    models_loaded: bool
+    face_recognition_available: bool
+    warmup_seconds: Optional[float] = None
+    redis_connected: bool
@@ -0,0 +1,171 @@
+"""
+Priority-aware admission control for Snapory's AI service.
+
+Requests are split into work classes with separate concurrency budgets and
+queues, so latency-sensitive guest calls ("interactive") never queue behind
+bulk photo detection ("batch"). When a class's queue is full, or the predicted
+queue wait exceeds its latency target, requests are rejected immediately with
+a Retry-After hint instead of piling up.
+"""
+
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed instead of being queued."""
+    
+    def __init__(self, work_class: str, retry_after: int, reason: str):
+        super().__init__(f"{work_class} work rejected: {reason}")
+        self.work_class = work_class
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class WorkClass:
+    """Concurrency budget, wait queue and load statistics of one class of work."""
+    
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, latency_target_ms: float):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.latency_target = latency_target_ms / 1000.0
+        self.in_flight = 0
+        self.waiters: deque[asyncio.Future] = deque()
+        
+        # Exponentially weighted moving average of service time, seeded so that
+        # a full queue exactly meets the latency target until real timings arrive.
+        self.service_time = self.latency_target * max_concurrency / max(1, max_queue)
+        self.admitted = 0
+        self.completed = 0
+        self.rejected_queue_full = 0
+        self.rejected_latency = 0
+        self.queue_waits: deque[float] = deque(maxlen=1000)
+    
+    def predicted_wait(self, position: int) -> float:
+        """Expected queue wait for a request at the given queue position."""
+        return position / self.max_concurrency * self.service_time
+    
+    def stats(self) -> dict:
+        waits = sorted(self.queue_waits)
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "latency_target_ms": self.latency_target * 1000,
+            "in_flight": self.in_flight,
+            "queued": len(self.waiters),
+            "admitted": self.admitted,
+            "completed": self.completed,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_latency": self.rejected_latency,
+            "service_time_ms": self.service_time * 1000,
+            "queue_wait_p50_ms": _percentile(waits, 0.50) * 1000,
+            "queue_wait_p99_ms": _percentile(waits, 0.99) * 1000
+        }
+
+
+class AdmissionController:
+    """Admits, queues or sheds requests per work class. Must be used from one event loop."""
+    
+    def __init__(self, classes: list[WorkClass], ewma_alpha: float = 0.2):
+        self._classes = {c.name: c for c in classes}
+        self.ewma_alpha = ewma_alpha
+    
+    async def acquire(self, work_class: str) -> float:
+        """
+        Wait for a slot in the given work class.
+        
+        Returns:
+            Start time to pass to release()
+        
+        Raises:
+            AdmissionRejected: If the request should be shed
+        """
+        wc = self._classes[work_class]
+        enqueued = time.monotonic()
+        
+        if wc.in_flight < wc.max_concurrency and not wc.waiters:
+            wc.in_flight += 1
+        else:
+            position = len(wc.waiters) + 1
+            predicted = wc.predicted_wait(position)
+            if len(wc.waiters) >= wc.max_queue:
+                wc.rejected_queue_full += 1
+                raise AdmissionRejected(work_class, _retry_after(predicted), "queue full")
+            if predicted > wc.latency_target:
+                wc.rejected_latency += 1
+                raise AdmissionRejected(work_class, _retry_after(predicted), "latency target exceeded")
+            
+            waiter = asyncio.get_running_loop().create_future()
+            wc.waiters.append(waiter)
+            try:
+                # release() hands its slot directly to the next waiter
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self._release_slot(wc)
+                else:
+                    wc.waiters.remove(waiter)
+                raise
+        
+        started = time.monotonic()
+        wc.admitted += 1
+        wc.queue_waits.append(started - enqueued)
+        return started
+    
+    def release(self, work_class: str, started: float):
+        """Return a slot and record the service time of the finished request."""
+        wc = self._classes[work_class]
+        elapsed = time.monotonic() - started
+        wc.service_time += self.ewma_alpha * (elapsed - wc.service_time)
+        wc.completed += 1
+        self._release_slot(wc)
+    
+    def stats(self) -> dict:
+        return {name: wc.stats() for name, wc in self._classes.items()}
+    
+    @staticmethod
+    def _release_slot(wc: WorkClass):
+        while wc.waiters:
+            waiter = wc.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        wc.in_flight -= 1
+
+
+def _retry_after(predicted_wait: float) -> int:
+    return max(1, math.ceil(predicted_wait))
+
+
+def _percentile(sorted_values: list[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+# Singleton instance
+admission_controller = AdmissionController([
+    WorkClass(
+        INTERACTIVE,
+        settings.interactive_max_concurrency,
+        settings.interactive_max_queue,
+        settings.interactive_latency_target_ms
+    ),
+    WorkClass(
+        BATCH,
+        settings.batch_max_concurrency,
+        settings.batch_max_queue,
+        settings.batch_latency_target_ms
+    )
+])
@@ -0,0 +1,75 @@
+"""
+BLAS thread limits for Snapory's matching engine.
+
+Distance batches run as BLAS matrix products. By default OpenBLAS/MKL start one
+thread per core in every process, so several uvicorn or gunicorn workers (plus
+the sharded matching workers) running products at the same time oversubscribe
+the CPU. Each process is capped to its share of the cores instead.
+
+The thread count can only be set through the environment before NumPy is first
+imported (gunicorn.conf.py does this ahead of preloading the app). At runtime it
+is changed with threadpoolctl, when installed.
+"""
+
+import logging
+import os
+from typing import Optional
+
+try:
+    from threadpoolctl import threadpool_info, threadpool_limits
+    THREADPOOLCTL_AVAILABLE = True
+except ImportError:
+    threadpool_info = threadpool_limits = None
+    THREADPOOLCTL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+BLAS_ENV_VARS = ("OPENBLAS_NUM_THREADS", "OMP_NUM_THREADS", "MKL_NUM_THREADS")
+
+
+def set_blas_thread_env(threads: int):
+    """
+    Cap the BLAS threads of this process and its children through the environment.
+    
+    Only effective before NumPy is imported; variables already set by the
+    deployment take precedence.
+    """
+    for var in BLAS_ENV_VARS:
+        os.environ.setdefault(var, str(threads))
+
+
+def limit_blas_threads(threads: int) -> Optional[int]:
+    """
+    Cap the BLAS threads of the running process.
+    
+    Args:
+        threads: Maximum number of BLAS threads (0 keeps the current setting)
+    
+    Returns:
+        The applied limit, or None if nothing was changed
+    """
+    if threads <= 0:
+        return None
+    if THREADPOOLCTL_AVAILABLE:
+        threadpool_limits(limits=threads, user_api="blas")
+        logger.info(f"BLAS threads limited to {threads}")
+        return threads
+    if any(os.environ.get(var) == str(threads) for var in BLAS_ENV_VARS):
+        # Already applied through the environment when NumPy was loaded
+        return threads
+    logger.warning(
+        f"threadpoolctl not installed, cannot limit BLAS threads to {threads} at runtime; "
+        f"set {BLAS_ENV_VARS[0]}={threads} before starting the service"
+    )
+    return None
+
+
+def blas_thread_info() -> list[dict]:
+    """Loaded BLAS libraries and their thread counts (empty without threadpoolctl)."""
+    if not THREADPOOLCTL_AVAILABLE:
+        return []
+    return [
+        {"library": info.get("internal_api"), "version": info.get("version"), "threads": info.get("num_threads")}
+        for info in threadpool_info()
+        if info.get("user_api") == "blas"
+    ]
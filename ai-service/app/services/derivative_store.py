@@ -0,0 +1,125 @@
+"""
+Storage for photo derivatives (thumbnails and face crops).
+
+Derivatives are written under stable keys such as
+events/{event_id}/photos/{photo_id}/1024.webp, either to a local directory
+(development, or a volume shared with the web tier) or to an S3-compatible
+bucket (AWS S3, or MinIO via derivative_s3_endpoint). The S3 backend needs
+boto3, which is an optional dependency.
+"""
+
+import logging
+import os
+import threading
+from typing import Optional
+
+from app.config import settings
+
+try:
+    import boto3
+    BOTO3_AVAILABLE = True
+except ImportError:
+    boto3 = None
+    BOTO3_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVE_STORES = ("local", "s3")
+
+
+class LocalDerivativeStore:
+    """Writes derivatives below a local directory."""
+    
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+    
+    def put(self, key: str, data: bytes, content_type: str) -> str:
+        """Store an object. Returns its location (a file path)."""
+        path = os.path.join(self.root, *key.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename, so readers never see a partially written file
+        temp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        return path
+    
+    def get(self, key: str) -> bytes:
+        """Read an object (raises FileNotFoundError if missing)."""
+        with open(os.path.join(self.root, *key.split("/")), "rb") as f:
+            return f.read()
+    
+    def list(self, prefix: str) -> list[str]:
+        """Keys of all objects below a prefix."""
+        directory = os.path.join(self.root, *prefix.rstrip("/").split("/"))
+        keys = []
+        for dirpath, _, filenames in os.walk(directory):
+            relative = os.path.relpath(dirpath, self.root).replace(os.sep, "/")
+            keys.extend(f"{relative}/{name}" for name in filenames if not name.endswith(".tmp"))
+        return sorted(keys)
+    
+    def describe(self) -> dict:
+        return {"backend": "local", "root": self.root}
+
+
+class S3DerivativeStore:
+    """Uploads derivatives to an S3-compatible bucket."""
+    
+    def __init__(self, bucket: str, endpoint_url: Optional[str] = None, region: Optional[str] = None):
+        """
+        Initialize S3DerivativeStore.
+        
+        Args:
+            bucket: Target bucket
+            endpoint_url: Custom endpoint for S3-compatible stores (e.g. MinIO)
+            region: Bucket region
+        
+        Credentials come from the standard AWS environment/configuration chain.
+        """
+        if not BOTO3_AVAILABLE:
+            raise RuntimeError("The s3 derivative store requires boto3 (pip install boto3)")
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+    
+    def put(self, key: str, data: bytes, content_type: str) -> str:
+        """Store an object. Returns its location (an s3:// URI)."""
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=key,
+            Body=data,
+            ContentType=content_type,
+            CacheControl="public, max-age=31536000, immutable"
+        )
+        return f"s3://{self.bucket}/{key}"
+    
+    def get(self, key: str) -> bytes:
+        """Read an object."""
+        return self.client.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+    
+    def list(self, prefix: str) -> list[str]:
+        """Keys of all objects below a prefix."""
+        paginator = self.client.get_paginator("list_objects_v2")
+        return [
+            item["Key"]
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix)
+            for item in page.get("Contents", [])
+        ]
+    
+    def describe(self) -> dict:
+        return {"backend": "s3", "bucket": self.bucket, "endpoint_url": self.endpoint_url}
+
+
+def create_derivative_store(backend: str):
+    """Build the derivative store selected by configuration."""
+    if backend not in DERIVATIVE_STORES:
+        raise ValueError(
+            f"Unsupported derivative store '{backend}'. Supported: {', '.join(DERIVATIVE_STORES)}"
+        )
+    if backend == "s3":
+        return S3DerivativeStore(
+            settings.derivative_s3_bucket,
+            endpoint_url=settings.derivative_s3_endpoint,
+            region=settings.derivative_s3_region
+        )
+    return LocalDerivativeStore(settings.derivative_local_dir)
@@ -0,0 +1,355 @@
+"""
+Compact face encoding representations for Snapory.
+
+face_recognition produces 128-dimensional float64 encodings, but match decisions
+at a 0.6 distance threshold do not need that precision. Encodings are converted
+at the API boundary into a compact in-memory dtype and matched natively in it:
+
+- float64: original precision (8 bytes/dim, 1024 bytes/face)
+- float32: default, bit-for-bit identical decisions in practice (512 bytes/face)
+- float16: stored at half precision, upcast per batch for arithmetic (256 bytes/face)
+- int8: symmetric scalar quantisation with a fixed global scale (128 bytes/face)
+
+Distances are computed in row blocks with per-thread scratch buffers that are
+reused across requests. The kernel is picked per batch shape: a direct
+difference + einsum for a single query against a few rows, and BLAS
+(|a|^2 + |b|^2 - 2 a.b as GEMV/GEMM, with cached row norms) for everything else.
+"""
+
+import base64
+import logging
+import math
+import threading
+from typing import Optional, Sequence, Union
+
+import numpy as np
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+ENCODING_DIM = 128
+
+SUPPORTED_DTYPES = ("float64", "float32", "float16", "int8")
+
+# How several reference encodings of one guest are combined into a query:
+# "min" matches a face if it is close to any reference, "centroid" matches
+# against the mean of the references (one comparison per face).
+FUSION_MODES = ("min", "centroid")
+
+# dlib encodings are small-magnitude values well inside [-0.5, 0.5]. A fixed,
+# global scale keeps int8 codes from different faces directly comparable.
+INT8_CLIP = 0.5
+INT8_SCALE = INT8_CLIP / 127.0
+
+# Distance kernels: "direct" (difference + einsum) or "gemm" (BLAS matrix
+# product); "auto" picks per batch shape
+DISTANCE_KERNELS = ("auto", "direct", "gemm")
+
+EncodingInput = Union[Sequence[float], Sequence[Sequence[float]], np.ndarray]
+
+
+class EncodingCodec:
+    """Converts face encodings to and from a compact dtype and computes distances in it."""
+    
+    def __init__(
+        self,
+        dtype: str = "float32",
+        kernel: str = "auto",
+        gemm_min_rows: int = 256,
+        block_rows: int = 4096
+    ):
+        """
+        Initialize EncodingCodec.
+        
+        Args:
+            dtype: Compact storage dtype, one of float64, float32, float16 or int8
+            kernel: Distance kernel, "auto" (by batch shape), "direct" or "gemm"
+            gemm_min_rows: With kernel="auto", single-query batches of at least
+                this many rows use GEMV instead of the direct kernel
+            block_rows: Rows per block; bounds the per-thread scratch memory
+        """
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(
+                f"Unsupported encoding dtype '{dtype}'. Supported: {', '.join(SUPPORTED_DTYPES)}"
+            )
+        if kernel not in DISTANCE_KERNELS:
+            raise ValueError(
+                f"Unsupported distance kernel '{kernel}'. Supported: {', '.join(DISTANCE_KERNELS)}"
+            )
+        self.dtype_name = dtype
+        self.dtype = np.dtype(dtype)
+        self.kernel = kernel
+        self.gemm_min_rows = gemm_min_rows
+        self.block_rows = block_rows
+        
+        # Arithmetic runs in float32 (float64 for the float64 codec). int8 codes
+        # are used unscaled: every partial sum stays below 2^24, so float32 is
+        # exact for them and the scale is applied once to the final distances.
+        self._compute_dtype = np.dtype(np.float64 if dtype == "float64" else np.float32)
+        self._result_dtype = self._compute_dtype
+        self._scale = np.float32(INT8_SCALE) if dtype == "int8" else 1
+    
+    @property
+    def bytes_per_face(self) -> int:
+        return ENCODING_DIM * self.dtype.itemsize
+    
+    @property
+    def result_dtype(self) -> np.dtype:
+        """dtype of computed distances and squared norms."""
+        return self._result_dtype
+    
+    def to_compact(self, encodings: EncodingInput) -> np.ndarray:
+        """
+        Convert one encoding or a batch of encodings to the compact dtype.
+        
+        Args:
+            encodings: A single 128-d encoding or an (n, 128) batch (lists or arrays)
+        
+        Returns:
+            (n, 128) array in the compact dtype
+        """
+        array = np.asarray(encodings)
+        if array.dtype == self.dtype and array.ndim == 2:
+            return array
+        if array.ndim == 1:
+            array = array.reshape(1, -1)
+        if array.size == 0:
+            return np.empty((0, ENCODING_DIM), dtype=self.dtype)
+        if array.shape[1] != ENCODING_DIM:
+            raise ValueError(f"Face encodings must have {ENCODING_DIM} dimensions, got {array.shape[1]}")
+        
+        if self.dtype_name == "int8":
+            quantised = np.rint(np.asarray(array, dtype=np.float32) / INT8_SCALE)
+            return np.clip(quantised, -127, 127).astype(np.int8)
+        
+        return np.ascontiguousarray(array, dtype=self.dtype)
+    
+    def to_float(self, compact: np.ndarray) -> np.ndarray:
+        """Expand compact encodings back to float32 (dequantising int8)."""
+        if self.dtype_name == "int8":
+            return compact.astype(np.float32) * np.float32(INT8_SCALE)
+        if self.dtype_name == "float64":
+            return compact
+        return compact.astype(np.float32, copy=False)
+    
+    def decode_base64(self, encoded: str) -> np.ndarray:
+        """
+        Decode a base64 encoding produced by the file-upload endpoints.
+        
+        Both the original float64 payloads (1024 bytes) and float32 payloads
+        (512 bytes) are accepted; the width is inferred from the byte length.
+        
+        Returns:
+            (128,) array in the compact dtype
+        """
+        raw = base64.b64decode(encoded)
+        if len(raw) == ENCODING_DIM * 8:
+            vector = np.frombuffer(raw, dtype=np.float64)
+        elif len(raw) == ENCODING_DIM * 4:
+            vector = np.frombuffer(raw, dtype=np.float32)
+        else:
+            raise ValueError(f"Invalid face encoding payload of {len(raw)} bytes")
+        return self.to_compact(vector)[0]
+    
+    def squared_norms(self, compact: np.ndarray) -> np.ndarray:
+        """
+        Squared row norms in the kernel's compute space, for caching alongside
+        stored encodings and passing to distances() as `norms`.
+        """
+        vectors = compact.astype(self._compute_dtype, copy=False)
+        return np.einsum("ij,ij->i", vectors, vectors)
+    
+    def select_kernel(self, rows: int, queries: int) -> str:
+        """
+        Pick the distance kernel for a batch shape.
+        
+        The direct kernel (blocked difference + einsum) has the least overhead
+        for a single query against a few rows; everything larger goes through
+        BLAS as |a|^2 + |b|^2 - 2 a.b (GEMV for one query, GEMM for several).
+        """
+        if self.kernel != "auto":
+            return self.kernel
+        if queries == 1 and rows < self.gemm_min_rows:
+            return "direct"
+        return "gemm"
+    
+    def scratch(self, name: str, shape: Union[int, tuple]) -> np.ndarray:
+        """
+        Per-thread reusable buffer in the distance result dtype.
+        
+        Only for results that are consumed before the thread computes the next
+        batch under the same name (e.g. thresholding inside a search).
+        """
+        return _workspace.get(name, shape, self._result_dtype)
+    
+    def distances(
+        self,
+        matrix: np.ndarray,
+        query: np.ndarray,
+        norms: Optional[np.ndarray] = None,
+        out: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """
+        Euclidean distances between one query and every row of a matrix, in the compact dtype.
+        
+        Args:
+            matrix: (n, 128) compact encodings
+            query: (128,) compact encoding
+            norms: Optional cached squared_norms() of the matrix rows
+            out: Optional (n,) output buffer in the result dtype
+        
+        Returns:
+            (n,) float32 distances (float64 when the codec dtype is float64)
+        """
+        return self.min_distances(matrix, query[None, :], norms=norms, out=out)
+    
+    def fuse(self, references: np.ndarray, mode: str = "min") -> np.ndarray:
+        """
+        Turn a guest's reference encodings into query encodings.
+        
+        Args:
+            references: (k, 128) compact reference encodings
+            mode: "min" keeps every reference (min-over-references distance),
+                "centroid" averages them into a single query
+        
+        Returns:
+            (k, 128) or (1, 128) compact query encodings
+        """
+        if mode not in FUSION_MODES:
+            raise ValueError(f"Unsupported fusion mode '{mode}'. Supported: {', '.join(FUSION_MODES)}")
+        if mode == "centroid" and len(references) > 1:
+            return self.to_compact(self.to_float(references).mean(axis=0))
+        return references
+    
+    def min_distances(
+        self,
+        matrix: np.ndarray,
+        queries: np.ndarray,
+        norms: Optional[np.ndarray] = None,
+        out: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """
+        Distance from every row of a matrix to its closest query encoding.
+        
+        All queries are evaluated together, block by block, so several queries
+        cost one matrix product instead of one scan each and the (n, k) distance
+        matrix is never materialised.
+        
+        Args:
+            matrix: (n, 128) compact encodings
+            queries: (k, 128) compact query encodings
+            norms: Optional cached squared_norms() of the matrix rows
+            out: Optional (n,) output buffer in the result dtype
+        
+        Returns:
+            (n,) float32 distances (float64 when the codec dtype is float64)
+        """
+        if out is None:
+            out = np.empty(len(matrix), dtype=self._result_dtype)
+        return self._compute(matrix, queries, norms, out, reduce_min=True)
+    
+    def pairwise_distances(self, a: np.ndarray, b: np.ndarray, a_norms: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Euclidean distances between every row of a and every row of b.
+        
+        Args:
+            a: (m, 128) compact encodings
+            b: (n, 128) compact encodings
+            a_norms: Optional cached squared_norms() of the rows of a
+        
+        Returns:
+            (m, n) float32 distances (float64 when the codec dtype is float64)
+        """
+        out = np.empty((len(a), len(b)), dtype=self._result_dtype)
+        return self._compute(a, b, a_norms, out, reduce_min=False)
+    
+    def _compute(
+        self,
+        matrix: np.ndarray,
+        queries: np.ndarray,
+        norms: Optional[np.ndarray],
+        out: np.ndarray,
+        reduce_min: bool
+    ) -> np.ndarray:
+        """Blocked distance computation with the kernel selected for the batch shape."""
+        rows, count = len(matrix), len(queries)
+        if rows == 0 or count == 0:
+            return out
+        
+        kernel = self.select_kernel(rows, count)
+        compute = self._compute_dtype
+        q = queries.astype(compute, copy=False)
+        if kernel == "gemm":
+            q_norms = np.einsum("ij,ij->i", q, q)
+        # A single query's distances are written straight into the output
+        direct_out = reduce_min and count == 1
+        
+        # Fewer rows per block for many queries keeps the scratch buffers bounded
+        step = max(256, self.block_rows * 16 // max(count, 16))
+        for start in range(0, rows, step):
+            end = min(start + step, rows)
+            block = matrix[start:end]
+            if block.dtype != compute:
+                # int8 codes / float16 are widened one cache-sized block at a time
+                block = _workspace.get("block", (end - start, ENCODING_DIM), compute)
+                block[...] = matrix[start:end]
+            if direct_out:
+                squared = out[start:end, None]
+            else:
+                squared = _workspace.get("squared", (end - start, count), compute)
+            
+            if kernel == "gemm":
+                np.matmul(block, q.T, out=squared)
+                squared *= -2
+                if norms is not None:
+                    squared += norms[start:end, None]
+                else:
+                    squared += np.einsum("ij,ij->i", block, block)[:, None]
+                squared += q_norms
+                # Rounding can push identical vectors slightly below zero
+                np.maximum(squared, 0, out=squared)
+            else:
+                diff = _workspace.get("diff", (end - start, ENCODING_DIM), compute)
+                for j in range(count):
+                    np.subtract(block, q[j], out=diff)
+                    np.einsum("ij,ij->i", diff, diff, out=squared[:, j])
+            
+            if direct_out:
+                pass
+            elif reduce_min:
+                np.min(squared, axis=1, out=out[start:end])
+            else:
+                out[start:end] = squared
+        
+        np.sqrt(out, out=out)
+        if self._scale != 1:
+            out *= self._scale
+        return out
+
+
+class _Workspace(threading.local):
+    """Per-thread scratch buffers reused across requests, grown on demand."""
+    
+    def __init__(self):
+        self.buffers: dict[tuple, np.ndarray] = {}
+    
+    def get(self, name: str, shape: Union[int, tuple], dtype) -> np.ndarray:
+        shape = (shape,) if isinstance(shape, int) else shape
+        size = math.prod(shape)
+        key = (name, dtype)
+        buffer = self.buffers.get(key)
+        if buffer is None or buffer.size < size:
+            buffer = np.empty(max(size, 2 * (buffer.size if buffer is not None else 0)), dtype=dtype)
+            self.buffers[key] = buffer
+        return buffer[:size].reshape(shape)
+
+
+_workspace = _Workspace()
+
+
+encoding_codec = EncodingCodec(
+    settings.encoding_dtype,
+    kernel=settings.distance_kernel,
+    gemm_min_rows=settings.gemm_min_rows
+)
@@ -0,0 +1,676 @@
+"""
+In-memory per-event face index for Snapory.
+
+Holds every known face of an event as one contiguous matrix in the compact
+encoding dtype, alongside the photo and face ids of each row. The index version
+is bumped on every change so derived results can be invalidated cheaply. The
+content key (fingerprint, epoch) identifies the indexed faces independently of
+the process: the fingerprint hashes the face ids, and the epoch is bumped
+whenever faces are removed or re-encoded, so a face set that returns to earlier
+ids (or keeps its ids with new encodings) never reuses an earlier key.
+
+The index manager keeps the resident indexes within a memory budget: when the
+budget is exceeded, the least recently used events that are not pinned (live
+events) are snapshotted to Redis and dropped from memory, and loaded back
+lazily on their next query. Without Redis nothing is evicted, since the
+snapshot is the only other copy of an index. State derived from an index
+(shared matching memory, clusters, cached matches) is released through the
+manager's release callbacks when the index is evicted or dropped.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional, TypeVar
+
+import numpy as np
+
+from app.config import settings
+from app.services.encodings import ENCODING_DIM, encoding_codec
+from app.services.redis_service import redis_service
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_KEY = "snapory:event-index:{event_id}"
+
+_INITIAL_CAPACITY = 256
+
+_FINGERPRINT_MASK = (1 << 64) - 1
+
+T = TypeVar("T")
+
+
+def _face_id_hash(face_id: str) -> int:
+    """Stable 64-bit hash of a face id (unlike hash(), identical in every process)."""
+    return int.from_bytes(hashlib.blake2b(face_id.encode(), digest_size=8).digest(), "little")
+
+
+class IndexEvicted(RuntimeError):
+    """Raised when modifying an index that was evicted; re-resolve it through the manager."""
+
+
+class IndexUnavailable(RuntimeError):
+    """Raised when an evicted index cannot be loaded back because Redis is failing."""
+
+
+class EventFaceIndex:
+    """Face encodings of one event, stored row-wise in a growable compact matrix."""
+    
+    def __init__(self, event_id: str):
+        self.event_id = event_id
+        self.version = 0
+        # Bumped whenever rows are removed and the remaining rows shift
+        self.compactions = 0
+        # Order-independent hash of the indexed face ids: equal in every process
+        # (and after a rebuild) that holds the same faces
+        self.fingerprint = 0
+        # Bumped whenever faces are removed or their encodings replaced, so the
+        # content key never repeats even when the fingerprint does
+        self.epoch = 0
+        self.face_ids: list[str] = []
+        self.photo_ids: list[str] = []
+        self._rows: dict[str, int] = {}
+        self._buffer = np.empty((_INITIAL_CAPACITY, ENCODING_DIM), dtype=encoding_codec.dtype)
+        # Squared row norms, cached so single-query scans are one GEMV
+        self._norms = np.empty(_INITIAL_CAPACITY, dtype=encoding_codec.result_dtype)
+        self._size = 0
+        # Set (under the lock) once the manager evicted the index; it is then read-only
+        self.evicted = False
+        self.lock = threading.RLock()
+    
+    def __len__(self) -> int:
+        return self._size
+    
+    @property
+    def matrix(self) -> np.ndarray:
+        """(n, 128) view of the stored encodings in the compact dtype."""
+        return self._buffer[:self._size]
+    
+    @property
+    def norms(self) -> np.ndarray:
+        """(n,) cached squared norms of the stored encodings."""
+        return self._norms[:self._size]
+    
+    @property
+    def content_key(self) -> tuple[int, int]:
+        """(fingerprint, epoch): changes whenever the indexed faces or their encodings change."""
+        with self.lock:
+            return self.fingerprint, self.epoch
+    
+    @property
+    def nbytes(self) -> int:
+        return self._buffer.nbytes + self._norms.nbytes
+    
+    def add_faces(self, faces: list[dict]) -> tuple[int, int]:
+        """
+        Append faces to the index, skipping face ids that are already present.
+        
+        Args:
+            faces: List of dicts with photo_id, face_id and encoding
+        
+        Returns:
+            (start, end) row range of the newly added faces
+        """
+        with self.lock:
+            self._check_writable()
+            start = self._size
+            new_faces = [f for f in faces if f["face_id"] not in self._rows]
+            if not new_faces:
+                return start, start
+            
+            encodings = encoding_codec.to_compact([f["encoding"] for f in new_faces])
+            end = start + len(new_faces)
+            self._reserve(end)
+            self._buffer[start:end] = encodings
+            self._norms[start:end] = encoding_codec.squared_norms(encodings)
+            
+            for row, face in enumerate(new_faces, start):
+                self._rows[face["face_id"]] = row
+                self.face_ids.append(face["face_id"])
+                self.photo_ids.append(face["photo_id"])
+            
+            self._size = end
+            self.fingerprint = (
+                self.fingerprint + sum(_face_id_hash(f["face_id"]) for f in new_faces)
+            ) & _FINGERPRINT_MASK
+            self.version += 1
+            return start, end
+    
+    def remove_faces(self, face_ids: list[str]) -> int:
+        """
+        Remove faces by id.
+        
+        Returns:
+            Number of faces removed
+        """
+        with self.lock:
+            self._check_writable()
+            removed = list(dict.fromkeys(f for f in face_ids if f in self._rows))
+            if not removed:
+                return 0
+            rows = [self._rows[f] for f in removed]
+            
+            keep = np.ones(self._size, dtype=bool)
+            keep[rows] = False
+            kept = self.matrix[keep]
+            self._buffer[:len(kept)] = kept
+            self._norms[:len(kept)] = self.norms[keep]
+            self._size = len(kept)
+            
+            self.face_ids = [f for f, k in zip(self.face_ids, keep) if k]
+            self.photo_ids = [p for p, k in zip(self.photo_ids, keep) if k]
+            self._rows = {f: i for i, f in enumerate(self.face_ids)}
+            self.fingerprint = (
+                self.fingerprint - sum(_face_id_hash(f) for f in removed)
+            ) & _FINGERPRINT_MASK
+            self.version += 1
+            self.compactions += 1
+            self.epoch += 1
+            return len(rows)
+    
+    def replace_encodings(self, faces: list[dict]) -> np.ndarray:
+        """
+        Overwrite the encodings of indexed faces in place (e.g. after re-encoding).
+        
+        Rows keep their position, so concurrent scans never see the faces
+        missing. Face ids that are not indexed yet are appended.
+        
+        Args:
+            faces: List of dicts with photo_id, face_id and encoding
+        
+        Returns:
+            Rows of the replaced and appended faces
+        """
+        with self.lock:
+            self._check_writable()
+            known = [f for f in faces if f["face_id"] in self._rows]
+            rows = np.array([self._rows[f["face_id"]] for f in known], dtype=np.intp)
+            if known:
+                encodings = encoding_codec.to_compact([f["encoding"] for f in known])
+                self._buffer[rows] = encodings
+                self._norms[rows] = encoding_codec.squared_norms(encodings)
+                self.version += 1
+                # Same face ids, new content: the fingerprint alone would not change
+                self.epoch += 1
+            start, end = self.add_faces([f for f in faces if f["face_id"] not in self._rows])
+            return np.concatenate([rows, np.arange(start, end, dtype=np.intp)])
+    
+    def get_encodings(self, face_ids: list[str]) -> np.ndarray:
+        """Compact encodings of the given faces (unknown face ids are skipped)."""
+        with self.lock:
+            rows = [self._rows[f] for f in face_ids if f in self._rows]
+            return self.matrix[rows]
+    
+    def search(
+        self,
+        target: np.ndarray,
+        threshold: float,
+        rows: Optional[np.ndarray] = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Find faces within the distance threshold of a target encoding.
+        
+        Args:
+            target: (128,) compact target encoding, or (k, 128) query encodings
+                of which the closest one counts (min-over-references)
+            threshold: Maximum Euclidean distance for a match
+            rows: Optional subset of rows to compare against (default: all faces)
+        
+        Returns:
+            Tuple of (rows, distances) of the matching faces, closest first
+        """
+        with self.lock:
+            if rows is None:
+                rows = np.arange(self._size)
+                candidates, norms = self.matrix, self.norms
+            else:
+                candidates, norms = self.matrix[rows], self.norms[rows]
+            # Thresholded right away, so the thread's reusable buffer is safe
+            distances = encoding_codec.min_distances(
+                candidates, np.atleast_2d(target), norms=norms, out=encoding_codec.scratch("search", len(rows))
+            )
+        
+        hits = np.flatnonzero(distances <= threshold)
+        order = np.argsort(distances[hits], kind="stable")
+        return rows[hits[order]], distances[hits[order]]
+    
+    def search_range(
+        self,
+        target: np.ndarray,
+        threshold: float,
+        start: int,
+        stop: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        search() over the rows [start, stop) only, without copying them.
+        
+        Used by chunked scans; stop is clamped to the current size.
+        
+        Returns:
+            Tuple of (rows, distances) of the matching faces, closest first
+        """
+        with self.lock:
+            stop = min(stop, self._size)
+            if start >= stop:
+                return np.empty(0, dtype=np.intp), np.empty(0, dtype=encoding_codec.result_dtype)
+            distances = encoding_codec.min_distances(
+                self.matrix[start:stop],
+                np.atleast_2d(target),
+                norms=self.norms[start:stop],
+                out=encoding_codec.scratch("search", stop - start)
+            )
+        
+        hits = np.flatnonzero(distances <= threshold)
+        order = np.argsort(distances[hits], kind="stable")
+        return start + hits[order], distances[hits[order]]
+    
+    def snapshot(self) -> dict[str, bytes]:
+        """Serialized index (Redis hash fields), restored with from_snapshot()."""
+        with self.lock:
+            return {
+                "event_id": self.event_id.encode(),
+                "dtype": self.matrix.dtype.str.encode(),
+                "encodings": self.matrix.tobytes(),
+                "face_ids": json.dumps(self.face_ids).encode(),
+                "photo_ids": json.dumps(self.photo_ids).encode(),
+                "version": str(self.version).encode(),
+                "compactions": str(self.compactions).encode(),
+                "fingerprint": str(self.fingerprint).encode(),
+                "epoch": str(self.epoch).encode()
+            }
+    
+    @classmethod
+    def from_snapshot(cls, fields: dict[bytes, bytes]) -> "EventFaceIndex":
+        """
+        Rebuild an index from snapshot() fields.
+        
+        Version, compaction and epoch counters are restored too, so cached
+        results shared through Redis stay valid and are not confused with those
+        of earlier face sets.
+        
+        Raises:
+            ValueError: If the snapshot was taken with another encoding dtype
+        """
+        dtype = np.dtype(fields[b"dtype"].decode())
+        if dtype != encoding_codec.dtype:
+            raise ValueError(f"Snapshot dtype {dtype} does not match the encoding dtype {encoding_codec.dtype}")
+        index = cls(fields[b"event_id"].decode())
+        encodings = np.frombuffer(fields[b"encodings"], dtype=dtype).reshape(-1, ENCODING_DIM)
+        index._reserve(len(encodings))
+        index._size = len(encodings)
+        index.matrix[...] = encodings
+        index.norms[...] = encoding_codec.squared_norms(encodings)
+        index.face_ids = json.loads(fields[b"face_ids"])
+        index.photo_ids = json.loads(fields[b"photo_ids"])
+        index._rows = {f: i for i, f in enumerate(index.face_ids)}
+        index.version = int(fields[b"version"])
+        index.compactions = int(fields[b"compactions"])
+        index.fingerprint = int(fields[b"fingerprint"])
+        index.epoch = int(fields.get(b"epoch", 0))
+        return index
+    
+    def _check_writable(self):
+        if self.evicted:
+            raise IndexEvicted(f"Index of event {self.event_id} was evicted")
+    
+    def _reserve(self, capacity: int):
+        if capacity <= len(self._buffer):
+            return
+        new_capacity = max(capacity, 2 * len(self._buffer))
+        buffer = np.empty((new_capacity, ENCODING_DIM), dtype=self._buffer.dtype)
+        buffer[:self._size] = self.matrix
+        norms = np.empty(new_capacity, dtype=self._norms.dtype)
+        norms[:self._size] = self.norms
+        self._buffer, self._norms = buffer, norms
+
+
+class EventIndexManager:
+    """Face indexes of the events served by this process, within a memory budget."""
+    
+    def __init__(self, memory_budget_mb: float = 0, snapshot_ttl: int = 604800):
+        """
+        Initialize EventIndexManager.
+        
+        Args:
+            memory_budget_mb: Memory allowed for resident indexes (0 = unlimited, never evict)
+            snapshot_ttl: Expiry of the Redis snapshots of evicted indexes (seconds)
+        """
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+        self.snapshot_ttl = snapshot_ttl
+        # Least recently used first
+        self._indexes: OrderedDict[str, EventFaceIndex] = OrderedDict()
+        self._pinned: set[str] = set()
+        self._last_used: dict[str, float] = {}
+        # Events this process snapshotted to Redis (a missing client then means
+        # the index is unavailable, not absent)
+        self._snapshotted: set[str] = set()
+        self._release_callbacks: list[Callable[[str], object]] = []
+        self._drop_callbacks: list[Callable[[str], object]] = []
+        self._lock = threading.Lock()
+        
+        self.hits = 0
+        self.loads = 0
+        self.misses = 0
+        self.evictions = 0
+        self.eviction_failures = 0
+        self.bytes_evicted = 0
+    
+    def on_release(self, callback: Callable[[str], object]):
+        """Call callback(event_id) whenever an event's index is evicted or dropped."""
+        self._release_callbacks.append(callback)
+    
+    def on_drop(self, callback: Callable[[str], object]):
+        """Call callback(event_id) when an event's index is dropped (not on eviction)."""
+        self._drop_callbacks.append(callback)
+    
+    def get(self, event_id: str) -> Optional[EventFaceIndex]:
+        """
+        Resident index of an event, loaded from its snapshot if evicted, or None.
+        
+        Raises:
+            IndexUnavailable: If the index was evicted and Redis is failing
+        """
+        with self._lock:
+            index = self._touch(event_id)
+            if index is not None:
+                self.hits += 1
+                return index
+        
+        index = self._load(event_id)
+        with self._lock:
+            if index is None:
+                self.misses += 1
+                return None
+            # Another thread may have loaded (or created) it meanwhile
+            resident = self._touch(event_id)
+            if resident is not None:
+                return resident
+            self._indexes[event_id] = index
+            self._last_used[event_id] = time.monotonic()
+            self.loads += 1
+        self.enforce_budget()
+        return index
+    
+    def get_or_create(self, event_id: str) -> EventFaceIndex:
+        """
+        Index of an event, created empty if it has none.
+        
+        Raises:
+            IndexUnavailable: If the index was evicted and Redis is failing (an
+                empty index would shadow the snapshot)
+        """
+        index = self.get(event_id)
+        if index is not None:
+            return index
+        with self._lock:
+            index = self._touch(event_id)
+            if index is None:
+                index = EventFaceIndex(event_id)
+                self._indexes[event_id] = index
+                self._last_used[event_id] = time.monotonic()
+            return index
+    
+    def update(self, event_id: str, change: Callable[[EventFaceIndex], T]) -> tuple[EventFaceIndex, T]:
+        """
+        Apply change(index) to an event's index (created or loaded as needed)
+        under the index lock, so it can read back what it wrote atomically.
+        
+        Returns:
+            (index, result): the index and what change returned
+        """
+        while True:
+            index = self.get_or_create(event_id)
+            try:
+                with index.lock:
+                    result = change(index)
+            except IndexEvicted:
+                # Evicted between lookup and write: the snapshot holds every
+                # earlier write, so load it back and retry
+                continue
+            self.enforce_budget()
+            return index, result
+    
+    def add_faces(self, event_id: str, faces: list[dict]) -> tuple[EventFaceIndex, int, int]:
+        """
+        Append faces to an event's index (created or loaded as needed).
+        
+        Returns:
+            (index, start, end): the index and the row range of the new faces
+        """
+        index, (start, end) = self.update(event_id, lambda index: index.add_faces(faces))
+        return index, start, end
+    
+    def remove_faces(self, event_id: str, face_ids: list[str]) -> tuple[Optional[EventFaceIndex], int]:
+        """
+        Remove faces from an event's index.
+        
+        Returns:
+            (index, removed): the index (None if the event has none) and the number removed
+        """
+        while True:
+            index = self.get(event_id)
+            if index is None:
+                return None, 0
+            try:
+                return index, index.remove_faces(face_ids)
+            except IndexEvicted:
+                continue
+    
+    def drop(self, event_id: str) -> bool:
+        """
+        Forget an event's index, its snapshot and the state derived from it.
+        
+        Returns:
+            True if the index was resident
+        """
+        with self._lock:
+            index = self._indexes.pop(event_id, None)
+            self._last_used.pop(event_id, None)
+            self._pinned.discard(event_id)
+            self._snapshotted.discard(event_id)
+        if index is not None:
+            with index.lock:
+                # Writers still holding it re-resolve the event
+                index.evicted = True
+        client = redis_service.get_binary_client()
+        if client is not None:
+            try:
+                client.delete(SNAPSHOT_KEY.format(event_id=event_id))
+            except Exception as e:
+                logger.error(f"Error deleting the index snapshot of event {event_id}: {e}")
+        self._release(event_id, self._release_callbacks + self._drop_callbacks)
+        return index is not None
+    
+    def pin(self, event_id: str):
+        """Keep an event's index resident (e.g. while the event is live)."""
+        with self._lock:
+            self._pinned.add(event_id)
+    
+    def unpin(self, event_id: str) -> bool:
+        """Make an event's index evictable again. Returns False if it was not pinned."""
+        with self._lock:
+            if event_id not in self._pinned:
+                return False
+            self._pinned.discard(event_id)
+        self.enforce_budget()
+        return True
+    
+    def is_pinned(self, event_id: str) -> bool:
+        return event_id in self._pinned
+    
+    @property
+    def resident_bytes(self) -> int:
+        with self._lock:
+            return sum(index.nbytes for index in self._indexes.values())
+    
+    def enforce_budget(self) -> int:
+        """
+        Evict least recently used unpinned indexes until within the budget.
+        
+        Indexes in use (locked by another thread) are skipped. Eviction stops
+        when no candidate is left or a snapshot cannot be written.
+        
+        Returns:
+            Number of indexes evicted
+        """
+        if self.memory_budget <= 0:
+            return 0
+        evicted = 0
+        skipped = set()
+        while True:
+            with self._lock:
+                total = sum(index.nbytes for index in self._indexes.values())
+                if total <= self.memory_budget:
+                    return evicted
+                victim = next(
+                    (
+                        index for event_id, index in self._indexes.items()
+                        if event_id not in self._pinned and event_id not in skipped
+                    ),
+                    None
+                )
+            if victim is None:
+                logger.warning(
+                    f"Event indexes use {total / 2**20:.0f} MB, above the "
+                    f"{self.memory_budget / 2**20:.0f} MB budget, with nothing evictable"
+                )
+                return evicted
+            if not victim.lock.acquire(blocking=False):
+                skipped.add(victim.event_id)
+                continue
+            try:
+                if not self._evict(victim):
+                    # Redis unavailable or failing: keep everything resident
+                    return evicted
+            finally:
+                victim.lock.release()
+            self._release(victim.event_id, self._release_callbacks)
+            evicted += 1
+    
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            events = [
+                {
+                    "event_id": event_id,
+                    "faces": len(index),
+                    "bytes": index.nbytes,
+                    "pinned": event_id in self._pinned,
+                    "idle_seconds": now - self._last_used.get(event_id, now)
+                }
+                for event_id, index in reversed(self._indexes.items())
+            ]
+            pinned = sorted(self._pinned)
+        lookups = self.hits + self.loads + self.misses
+        resident_bytes = sum(event["bytes"] for event in events)
+        return {
+            "memory_budget_bytes": self.memory_budget,
+            "resident_bytes": resident_bytes,
+            "budget_used": resident_bytes / self.memory_budget if self.memory_budget else 0.0,
+            "resident_events": len(events),
+            "pinned_events": pinned,
+            "hits": self.hits,
+            "loads": self.loads,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "eviction_failures": self.eviction_failures,
+            "bytes_evicted": self.bytes_evicted,
+            "events": events
+        }
+    
+    def _touch(self, event_id: str) -> Optional[EventFaceIndex]:
+        """Resident index, marked as most recently used. Caller holds the lock."""
+        index = self._indexes.get(event_id)
+        if index is not None:
+            self._indexes.move_to_end(event_id)
+            self._last_used[event_id] = time.monotonic()
+        return index
+    
+    def _evict(self, index: EventFaceIndex) -> bool:
+        """
+        Snapshot an index to Redis and drop it from memory. Caller holds the index lock.
+        
+        Returns:
+            False if the index was kept because the snapshot could not be written
+        """
+        client = redis_service.get_binary_client()
+        if client is None:
+            self.eviction_failures += 1
+            logger.warning(f"Redis unavailable, not evicting the index of event {index.event_id}")
+            return False
+        key = SNAPSHOT_KEY.format(event_id=index.event_id)
+        try:
+            pipeline = client.pipeline()
+            pipeline.delete(key)
+            pipeline.hset(key, mapping=index.snapshot())
+            if self.snapshot_ttl > 0:
+                pipeline.expire(key, self.snapshot_ttl)
+            pipeline.execute()
+        except Exception as e:
+            self.eviction_failures += 1
+            logger.error(f"Error snapshotting the index of event {index.event_id}: {e}")
+            return False
+        
+        with self._lock:
+            if self._indexes.get(index.event_id) is index:
+                del self._indexes[index.event_id]
+                self._last_used.pop(index.event_id, None)
+            self._snapshotted.add(index.event_id)
+        index.evicted = True
+        self.evictions += 1
+        self.bytes_evicted += index.nbytes
+        logger.info(f"Evicted the index of event {index.event_id} ({len(index)} faces, {index.nbytes / 2**20:.1f} MB)")
+        return True
+    
+    def _release(self, event_id: str, callbacks: list[Callable[[str], object]]):
+        for callback in callbacks:
+            try:
+                callback(event_id)
+            except Exception as e:
+                logger.error(f"Error releasing state derived from the index of event {event_id}: {e}")
+    
+    def _load(self, event_id: str) -> Optional[EventFaceIndex]:
+        """
+        Index restored from its Redis snapshot, or None if there is none.
+        
+        Raises:
+            IndexUnavailable: If the snapshot cannot be read (Redis down or
+                failing), so callers do not mistake the event for a new one
+        """
+        if self.memory_budget <= 0:
+            return None
+        client = redis_service.get_binary_client()
+        if client is None:
+            if event_id in self._snapshotted:
+                raise IndexUnavailable(f"Redis unavailable, cannot load the index of event {event_id}")
+            return None
+        try:
+            fields = client.hgetall(SNAPSHOT_KEY.format(event_id=event_id))
+        except Exception as e:
+            logger.error(f"Error reading the index snapshot of event {event_id}: {e}")
+            raise IndexUnavailable(f"Cannot load the index of event {event_id}: {e}") from e
+        if not fields:
+            return None
+        started = time.perf_counter()
+        try:
+            index = EventFaceIndex.from_snapshot(fields)
+        except Exception as e:
+            # Unusable (e.g. another encoding dtype): the event is rebuilt from scratch
+            logger.error(f"Error loading the index snapshot of event {event_id}: {e}")
+            return None
+        logger.info(
+            f"Loaded the index of event {event_id} ({len(index)} faces) in "
+            f"{(time.perf_counter() - started) * 1000:.0f} ms"
+        )
+        return index
+
+
+# Singleton instance
+event_indexes = EventIndexManager(
+    memory_budget_mb=settings.index_memory_budget_mb,
+    snapshot_ttl=settings.index_snapshot_ttl
+)
@@ -0,0 +1,198 @@
+"""
+Aligned face chips and landmarks, stored for re-encoding without re-detection.
+
+The dlib encoder does not look at the photo: it looks at a 150x150 chip of each
+face, rotated and scaled from the five-point landmarks. Keeping those chips
+(and the landmarks they were aligned from) means a change of encoding model or
+parameters (e.g. num_jitters) can recompute every encoding from the chips
+alone, without downloading and re-detecting the photos.
+
+Per photo, two objects are written to the derivative store next to the
+thumbnails (events/{event_id}/photos/{photo_id}/):
+
+- chips.{ext}: the chips of all faces tiled in a grid, one compressed image
+- chips.json: chip size and layout, and per face its index, bounding box,
+  landmarks (five (x, y) points in photo pixels) and grid cell
+
+With a lossy chip format, encodings recomputed from the chips differ slightly
+from the originals; use png for bit-exact re-encoding.
+"""
+
+import json
+import logging
+from io import BytesIO
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+from app.config import settings
+from app.services.derivative_store import create_derivative_store
+from app.services.photo_processor import DERIVATIVE_FORMATS, PhotoProcessor
+
+logger = logging.getLogger(__name__)
+
+# As used by dlib's face encoder when it extracts chips itself
+CHIP_SIZE = 150
+CHIP_PADDING = 0.25
+
+# Chips per grid row (keeps the grid within WebP's 16383 px limit)
+GRID_COLUMNS = 100
+
+MANIFEST_NAME = "chips.json"
+
+
+def align_faces(image: np.ndarray, locations: list) -> tuple[list[np.ndarray], list[list[list[int]]]]:
+    """
+    Five-point landmarks and aligned chips of located faces (requires dlib).
+    
+    Args:
+        image: RGB image
+        locations: Face locations (top, right, bottom, left)
+    
+    Returns:
+        (chips, landmarks): (150, 150, 3) uint8 chips, exactly as the encoder
+        extracts them, and the five landmark points of each face
+    """
+    import dlib
+    import face_recognition
+    
+    shapes = dlib.full_object_detections()
+    for top, right, bottom, left in locations:
+        shapes.append(face_recognition.api.pose_predictor_5_point(image, dlib.rectangle(left, top, right, bottom)))
+    if len(shapes) == 0:
+        return [], []
+    chips = [np.asarray(chip) for chip in dlib.get_face_chips(image, shapes, size=CHIP_SIZE, padding=CHIP_PADDING)]
+    landmarks = [[[point.x, point.y] for point in shape.parts()] for shape in shapes]
+    return chips, landmarks
+
+
+def encode_chips(chips: list[np.ndarray], num_jitters: int = 1) -> np.ndarray:
+    """(n, 128) encodings of aligned chips, in one batched encoder call (requires dlib)."""
+    import face_recognition
+    
+    if not chips:
+        return np.empty((0, 128))
+    return np.array(face_recognition.api.face_encoder.compute_face_descriptor(list(chips), num_jitters))
+
+
+class FaceChipStore:
+    """Writes and reads the aligned chips and landmarks of photos in the derivative store."""
+    
+    def __init__(self, chip_format: str = "webp", chip_quality: int = 90, store_backend: str = "local"):
+        """
+        Initialize FaceChipStore.
+        
+        Args:
+            chip_format: Image format of the chip grid (webp, jpeg or png; png is lossless)
+            chip_quality: Encoder quality for lossy formats
+            store_backend: Derivative store the chips are written to ("local" or "s3")
+        """
+        if chip_format not in DERIVATIVE_FORMATS:
+            raise ValueError(
+                f"Unsupported chip format '{chip_format}'. "
+                f"Supported: {', '.join(DERIVATIVE_FORMATS)}"
+            )
+        self.chip_format = chip_format
+        self.chip_quality = chip_quality
+        self.store_backend = store_backend
+        self._store = None
+    
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = create_derivative_store(self.store_backend)
+        return self._store
+    
+    @staticmethod
+    def prefix(photo_id: str, event_id: Optional[str] = None) -> str:
+        """Storage key prefix of a photo's chips (the photo's derivative prefix)."""
+        return PhotoProcessor.derivative_prefix(photo_id, event_id)
+    
+    def save(
+        self,
+        photo_id: str,
+        event_id: Optional[str],
+        faces: list[dict],
+        chips: list[np.ndarray],
+        landmarks: list[list[list[int]]]
+    ) -> Optional[dict]:
+        """
+        Store the chips and landmarks of a photo's detected faces.
+        
+        Args:
+            faces: Detected faces (index and bounding_box), in chip order
+        
+        Returns:
+            Locations of the chip grid and manifest, or None without faces
+        """
+        if not chips:
+            return None
+        prefix = self.prefix(photo_id, event_id)
+        pillow_format, content_type, extension = DERIVATIVE_FORMATS[self.chip_format]
+        
+        columns = min(len(chips), GRID_COLUMNS)
+        rows = -(-len(chips) // columns)
+        grid = np.zeros((rows * CHIP_SIZE, columns * CHIP_SIZE, 3), dtype=np.uint8)
+        for i, chip in enumerate(chips):
+            row, column = divmod(i, columns)
+            grid[row * CHIP_SIZE:(row + 1) * CHIP_SIZE, column * CHIP_SIZE:(column + 1) * CHIP_SIZE] = chip
+        
+        buffer = BytesIO()
+        Image.fromarray(grid).save(buffer, format=pillow_format, quality=self.chip_quality)
+        grid_key = f"{prefix}/chips.{extension}"
+        grid_location = self.store.put(grid_key, buffer.getvalue(), content_type)
+        
+        manifest = {
+            "photo_id": photo_id,
+            "event_id": event_id,
+            "chip_size": CHIP_SIZE,
+            "chip_padding": CHIP_PADDING,
+            "columns": columns,
+            "grid": grid_key,
+            "faces": [
+                {
+                    "index": face["index"],
+                    "bounding_box": face["bounding_box"],
+                    "landmarks": points,
+                    "cell": i
+                }
+                for i, (face, points) in enumerate(zip(faces, landmarks))
+            ]
+        }
+        manifest_location = self.store.put(
+            f"{prefix}/{MANIFEST_NAME}", json.dumps(manifest).encode(), "application/json"
+        )
+        return {"grid": grid_location, "manifest": manifest_location, "count": len(chips)}
+    
+    def load_manifest(self, manifest_key: str) -> dict:
+        return json.loads(self.store.get(manifest_key))
+    
+    def load(self, manifest_key: str) -> tuple[dict, list[np.ndarray]]:
+        """Manifest and chips (in manifest face order) of one photo."""
+        manifest = self.load_manifest(manifest_key)
+        return manifest, self.load_chips(manifest, self.store.get(manifest["grid"]))
+    
+    @staticmethod
+    def load_chips(manifest: dict, grid_data: bytes) -> list[np.ndarray]:
+        """Cut a decoded chip grid back into chips."""
+        size, columns = manifest["chip_size"], manifest["columns"]
+        grid = np.asarray(Image.open(BytesIO(grid_data)).convert("RGB"))
+        chips = []
+        for face in manifest["faces"]:
+            row, column = divmod(face["cell"], columns)
+            chips.append(np.ascontiguousarray(grid[row * size:(row + 1) * size, column * size:(column + 1) * size]))
+        return chips
+    
+    def manifest_keys(self, event_id: str) -> list[str]:
+        """Manifest keys of all photos of an event with stored chips."""
+        prefix = f"{PhotoProcessor.event_prefix(event_id)}/"
+        return [key for key in self.store.list(prefix) if key.endswith(f"/{MANIFEST_NAME}")]
+
+
+# Singleton instance
+face_chip_store = FaceChipStore(
+    chip_format=settings.face_chip_format,
+    chip_quality=settings.face_chip_quality,
+    store_backend=settings.derivative_store
+)
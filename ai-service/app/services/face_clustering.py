@@ -0,0 +1,320 @@
+"""
+Event-level face clustering for Snapory.
+
+Groups the faces of an event by identity so the photographer gets "people in
+this event" groupings and guest queries can be pruned to a few clusters:
+
+1. Pairwise distances are computed in fixed-size blocks (one matrix product per
+   block), keeping only pairs under the clustering threshold as graph edges.
+2. The threshold graph is partitioned with Chinese whispers (as used with dlib)
+   or plain connected components.
+3. Each cluster stores its centroid and radius (largest member distance to the
+   centroid). A guest query only expands clusters whose centroid lies within
+   threshold + radius, which by the triangle inequality never misses a match.
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+from app.config import settings
+from app.services.encodings import EncodingCodec, encoding_codec
+from app.services.event_index import EventFaceIndex, event_indexes
+
+logger = logging.getLogger(__name__)
+
+CLUSTER_METHODS = ("chinese_whispers", "components")
+
+# Centroids are stored dequantised, whatever the compact encoding dtype
+_centroid_codec = EncodingCodec(
+    "float32",
+    kernel=settings.distance_kernel,
+    gemm_min_rows=settings.gemm_min_rows
+)
+
+
+class EventClusters:
+    """Clustering result for one event, valid for the index rows it was computed on."""
+    
+    def __init__(
+        self,
+        event_id: str,
+        index_version: int,
+        compactions: int,
+        epoch: int,
+        labels: np.ndarray,
+        centroids: np.ndarray,
+        radii: np.ndarray,
+        method: str,
+        threshold: float,
+        seconds: float
+    ):
+        self.event_id = event_id
+        self.index_version = index_version
+        self.compactions = compactions
+        self.epoch = epoch
+        self.face_count = len(labels)
+        self.labels = labels
+        self.centroids = centroids
+        self.centroid_norms = _centroid_codec.squared_norms(centroids)
+        self.radii = radii
+        self.sizes = np.bincount(labels, minlength=len(centroids))
+        self.method = method
+        self.threshold = threshold
+        self.seconds = seconds
+        self.created_at = datetime.now(timezone.utc)
+        
+        # Members of cluster c are _order[_offsets[c]:_offsets[c + 1]]
+        self._order = np.argsort(labels, kind="stable")
+        self._offsets = np.concatenate([[0], np.cumsum(self.sizes)])
+    
+    @property
+    def cluster_count(self) -> int:
+        return len(self.centroids)
+    
+    def members(self, cluster_id: int) -> np.ndarray:
+        """Index rows belonging to a cluster."""
+        return self._order[self._offsets[cluster_id]:self._offsets[cluster_id + 1]]
+    
+    def is_valid_for(self, index: EventFaceIndex) -> bool:
+        """
+        Rows only shift when faces are removed, and clustered encodings only
+        change when faces are removed or re-encoded (both bump the epoch);
+        appended faces are handled separately.
+        """
+        return (
+            self.compactions == index.compactions
+            and self.epoch == index.epoch
+            and self.face_count <= len(index)
+        )
+
+
+class FaceClusterer:
+    """Clusters event face indexes and answers guest queries through the clusters."""
+    
+    def __init__(
+        self,
+        threshold: float = 0.5,
+        method: str = "chinese_whispers",
+        block_size: int = 2048,
+        iterations: int = 20
+    ):
+        """
+        Initialize FaceClusterer.
+        
+        Args:
+            threshold: Maximum distance for two faces to be linked in the graph.
+                Stricter than the 0.6 match threshold to avoid chaining identities.
+            method: "chinese_whispers" or "components"
+            block_size: Rows per block of the pairwise distance computation
+            iterations: Maximum Chinese whispers iterations
+        """
+        if method not in CLUSTER_METHODS:
+            raise ValueError(f"Unsupported clustering method '{method}'")
+        self.threshold = threshold
+        self.method = method
+        self.block_size = block_size
+        self.iterations = iterations
+        self._results: dict[str, EventClusters] = {}
+        self._lock = threading.Lock()
+    
+    def get(self, event_id: str) -> Optional[EventClusters]:
+        return self._results.get(event_id)
+    
+    def drop(self, event_id: str) -> bool:
+        """Forget an event's clustering (its index was evicted or dropped)."""
+        with self._lock:
+            return self._results.pop(event_id, None) is not None
+    
+    def cluster_event(
+        self,
+        event_id: str,
+        method: Optional[str] = None,
+        threshold: Optional[float] = None
+    ) -> Optional[EventClusters]:
+        """
+        Cluster all faces currently in an event's index and store the result.
+        
+        Returns:
+            The clustering result, or None if the event has no indexed faces
+        """
+        index = event_indexes.get(event_id)
+        if index is None or len(index) == 0:
+            return None
+        
+        method = method or self.method
+        threshold = threshold if threshold is not None else self.threshold
+        if method not in CLUSTER_METHODS:
+            raise ValueError(f"Unsupported clustering method '{method}'")
+        
+        started = time.perf_counter()
+        with index.lock:
+            matrix = index.matrix.copy()
+            # The labels describe the index as of this version
+            index_version, compactions, epoch = index.version, index.compactions, index.epoch
+        
+        vectors = np.ascontiguousarray(encoding_codec.to_float(matrix), dtype=np.float32)
+        adjacency = self._threshold_graph(vectors, threshold)
+        if method == "components":
+            _, labels = connected_components(adjacency, directed=False)
+        else:
+            labels = self._chinese_whispers(adjacency)
+        
+        labels = self._relabel_by_size(labels)
+        centroids, radii = self._centroids(vectors, labels)
+        seconds = time.perf_counter() - started
+        
+        result = EventClusters(
+            event_id, index_version, compactions, epoch, labels, centroids, radii, method, threshold, seconds
+        )
+        with self._lock:
+            self._results[event_id] = result
+        
+        logger.info(
+            f"Clustered {len(matrix)} faces of event {event_id} into "
+            f"{result.cluster_count} clusters ({method}) in {seconds:.2f}s"
+        )
+        return result
+    
+    def match(self, event_id: str, target: np.ndarray, threshold: float) -> Optional[dict]:
+        """
+        Match a compact target encoding against an event via its clusters.
+        
+        Compares against the centroids first, then expands only candidate
+        clusters and any faces appended since clustering. A (k, 128) target
+        expands the clusters that can hold a match for any of its encodings.
+        
+        Returns:
+            Dict with rows, distances and faces_compared, or None when the event
+            has no valid clustering (callers then fall back to a full scan)
+        """
+        index = event_indexes.get(event_id)
+        clusters = self._results.get(event_id)
+        if index is None or clusters is None:
+            return None
+        
+        with index.lock:
+            if not clusters.is_valid_for(index):
+                return None
+            
+            # Smallest (centroid distance - radius) over the target encodings
+            slack = _centroid_codec.min_distances(
+                clusters.centroids,
+                encoding_codec.to_float(np.atleast_2d(target)),
+                norms=clusters.centroid_norms
+            ) - clusters.radii
+            candidates = np.flatnonzero(slack <= threshold)
+            
+            rows = np.concatenate(
+                [clusters.members(c) for c in candidates]
+                + [np.arange(clusters.face_count, len(index))]
+            ).astype(np.intp)
+            hit_rows, distances = index.search(target, threshold, rows=rows)
+        
+        return {
+            "rows": hit_rows,
+            "distances": distances,
+            "faces_compared": len(rows) + clusters.cluster_count
+        }
+    
+    def _threshold_graph(self, vectors: np.ndarray, threshold: float) -> sparse.csr_matrix:
+        """Symmetric adjacency matrix of all face pairs closer than the threshold."""
+        n = len(vectors)
+        norms = np.einsum("ij,ij->i", vectors, vectors)
+        limit = np.float32(threshold * threshold)
+        block = np.empty((self.block_size, self.block_size), dtype=vectors.dtype)
+        sources, targets = [], []
+        
+        for i0 in range(0, n, self.block_size):
+            i1 = min(i0 + self.block_size, n)
+            for j0 in range(i0, n, self.block_size):
+                j1 = min(j0 + self.block_size, n)
+                # Squared distances |a|^2 + |b|^2 - 2 a.b, built in place in a reused
+                # buffer and compared against threshold^2 (no sqrt needed)
+                squared = block[:i1 - i0, :j1 - j0]
+                np.matmul(vectors[i0:i1], vectors[j0:j1].T, out=squared)
+                squared *= -2
+                squared += norms[i0:i1, None]
+                squared += norms[None, j0:j1]
+                rows, cols = np.nonzero(squared <= limit)
+                if i0 == j0:
+                    upper = rows < cols
+                    rows, cols = rows[upper], cols[upper]
+                sources.append(rows + i0)
+                targets.append(cols + j0)
+        
+        sources = np.concatenate(sources) if sources else np.empty(0, dtype=np.intp)
+        targets = np.concatenate(targets) if targets else np.empty(0, dtype=np.intp)
+        ones = np.ones(2 * len(sources), dtype=np.float32)
+        return sparse.csr_matrix(
+            (ones, (np.concatenate([sources, targets]), np.concatenate([targets, sources]))),
+            shape=(n, n)
+        )
+    
+    def _chinese_whispers(self, adjacency: sparse.csr_matrix) -> np.ndarray:
+        """
+        Vectorized Chinese whispers: each node adopts the most common label among
+        its neighbours. A random half of the nodes updates per round so that
+        neighbouring nodes do not flip back and forth in lockstep.
+        """
+        n = adjacency.shape[0]
+        labels = np.arange(n)
+        has_neighbours = np.diff(adjacency.indptr) > 0
+        rng = np.random.default_rng(0)
+        
+        for _ in range(self.iterations):
+            one_hot = sparse.csr_matrix((np.ones(n, dtype=np.float32), (np.arange(n), labels)), shape=(n, n))
+            votes = (adjacency @ one_hot).tocoo()
+            
+            # Highest-voted label per row: sort by (row, -votes) and take each row's first entry
+            order = np.lexsort((-votes.data, votes.row))
+            rows = votes.row[order]
+            first = np.concatenate([[True], rows[1:] != rows[:-1]]) if len(rows) else np.empty(0, dtype=bool)
+            best = labels.copy()
+            best[rows[first]] = votes.col[order][first]
+            
+            if np.array_equal(best[has_neighbours], labels[has_neighbours]):
+                break
+            update = has_neighbours & (rng.random(n) < 0.5)
+            labels = np.where(update, best, labels)
+        
+        return labels
+    
+    @staticmethod
+    def _relabel_by_size(labels: np.ndarray) -> np.ndarray:
+        """Renumber clusters 0..k-1, largest first."""
+        _, inverse, counts = np.unique(labels, return_inverse=True, return_counts=True)
+        rank = np.empty_like(counts)
+        rank[np.argsort(-counts, kind="stable")] = np.arange(len(counts))
+        return rank[inverse]
+    
+    @staticmethod
+    def _centroids(vectors: np.ndarray, labels: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Per-cluster mean encodings and radii (max member distance to the centroid)."""
+        count = int(labels.max()) + 1
+        membership = sparse.csr_matrix(
+            (np.ones(len(labels), dtype=np.float32), (labels, np.arange(len(labels)))),
+            shape=(count, len(labels))
+        )
+        sizes = np.asarray(membership.sum(axis=1)).ravel()
+        centroids = (membership @ vectors) / sizes[:, None]
+        centroids = centroids.astype(np.float32)
+        
+        member_distances = np.linalg.norm(vectors - centroids[labels], axis=1)
+        radii = np.zeros(count, dtype=np.float32)
+        np.maximum.at(radii, labels, member_distances)
+        return centroids, radii
+
+
+# Singleton instance
+face_clusterer = FaceClusterer(
+    threshold=settings.cluster_threshold,
+    method=settings.cluster_method
+)
+event_indexes.on_release(face_clusterer.drop)
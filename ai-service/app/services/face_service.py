@@ -3,10 +3,13 @@ Face detection and matching service for Snapory.
 Uses face_recognition library for face detection and encoding.
 """
 
+import asyncio
 import base64
 import logging
+import threading
+import time
 from io import BytesIO
-from typing import Optional, List, Tuple
+from typing import Optional, List, Tuple, Union
 
 import numpy as np
 from PIL import Image
@@ -15,22 +18,74 @@ import ipaddress
 import socket
 from urllib.parse import urlparse
 
+from app.config import settings
+from app.services.encodings import EncodingInput, encoding_codec
+from app.services.face_chips import align_faces, encode_chips
+from app.services.memory_profiler import memory_profiler
+from app.services.single_flight import normalize_url, single_flight
+from app.services.synthetic_engine import synthetic_engine
+from app.services.tiled_detector import tiled_detector
+from app.services.video_processor import video_processor
+
 logger = logging.getLogger(__name__)
 
-# Try to import face_recognition, fall back to mock if not available
-try:
-    import face_recognition
-    FACE_RECOGNITION_AVAILABLE = True
-    logger.info("face_recognition library loaded successfully")
-except ImportError:
-    FACE_RECOGNITION_AVAILABLE = False
-    logger.warning("face_recognition not available, using mock implementation")
+# face_recognition loads the dlib detector, shape predictor and ResNet model
+# when it is imported, which takes seconds. It is imported on first use (or
+# explicitly by FaceService.warm_up) rather than at module import time.
+face_recognition = None
+FACE_RECOGNITION_AVAILABLE: Optional[bool] = None
+_load_lock = threading.Lock()
+
+# "dlib" runs face_recognition; "synthetic" fakes detection and encoding for load tests
+FACE_ENGINES = ("dlib", "synthetic")
+
+
+class DownloadTooLarge(Exception):
+    """Raised when a download exceeds its size limit (announced or while streaming)."""
+
+
+def load_face_recognition() -> bool:
+    """
+    Import face_recognition (and its dlib models) once per process.
+    
+    Returns:
+        True if the library is available, False if the synthetic engine is used
+    """
+    global face_recognition, FACE_RECOGNITION_AVAILABLE
+    
+    if FACE_RECOGNITION_AVAILABLE is not None:
+        return FACE_RECOGNITION_AVAILABLE
+    
+    with _load_lock:
+        if FACE_RECOGNITION_AVAILABLE is None:
+            started = time.perf_counter()
+            try:
+                import face_recognition as _face_recognition
+                face_recognition = _face_recognition
+                FACE_RECOGNITION_AVAILABLE = True
+                logger.info(
+                    f"face_recognition library loaded in {time.perf_counter() - started:.2f}s"
+                )
+            except ImportError:
+                FACE_RECOGNITION_AVAILABLE = False
+                logger.warning("face_recognition not available, using the synthetic face engine")
+    
+    return FACE_RECOGNITION_AVAILABLE
+
+
+if not settings.lazy_model_loading:
+    load_face_recognition()
 
 
 class FaceService:
     """Service for face detection and matching operations."""
     
-    def __init__(self, match_threshold: float = 0.6):
+    def __init__(
+        self,
+        match_threshold: float = 0.6,
+        engine: str = "dlib",
+        allowed_networks: Optional[List[str]] = None
+    ):
         """
         Initialize FaceService.
         
@@ -41,31 +96,84 @@ class FaceService:
                 and catch more matches but increase false positives. The default of 0.6 provides
                 a good balance for most use cases. This threshold is compared against the Euclidean
                 distance between face encoding vectors (128-dimensional).
+            engine: "dlib" (face_recognition) or "synthetic" (deterministic fake
+                detections for load tests, see synthetic_engine)
+            allowed_networks: Private networks (CIDR) that image URLs may resolve
+                to despite the SSRF checks; for load tests with a local image server
         """
+        if engine not in FACE_ENGINES:
+            raise ValueError(f"Unsupported face engine '{engine}'. Supported: {', '.join(FACE_ENGINES)}")
         self.match_threshold = match_threshold
-        self.is_available = FACE_RECOGNITION_AVAILABLE
+        self.engine = engine
+        self.allowed_networks = [ipaddress.ip_network(network) for network in allowed_networks or []]
+        if self.allowed_networks:
+            logger.warning(
+                f"SSRF test mode: image URLs may point to {', '.join(map(str, self.allowed_networks))}"
+            )
+        self.is_warm = False
+        self.warmup_seconds: Optional[float] = None
+        self._warmup_lock = threading.Lock()
+    
+    @property
+    def is_available(self) -> bool:
+        """Whether the real face_recognition backend is usable (loads it on first access)."""
+        return load_face_recognition()
+    
+    @property
+    def is_synthetic(self) -> bool:
+        """Whether detections come from the synthetic engine (configured, not a fallback)."""
+        return self.engine == "synthetic"
     
-    def detect_faces(self, image_data: bytes) -> dict:
+    def warm_up(self) -> float:
+        """
+        Load the face models and run a dummy inference so the first real request
+        does not pay model-load and first-call latency.
+        
+        Safe to call more than once; only the first call does any work. When called
+        in a pre-fork master process, the loaded models are shared copy-on-write
+        with the forked workers.
+        
+        Returns:
+            Seconds spent warming up
+        """
+        with self._warmup_lock:
+            if self.is_warm:
+                return self.warmup_seconds or 0.0
+            
+            started = time.perf_counter()
+            if not self.is_synthetic and load_face_recognition():
+                # A blank image runs the HOG detector; passing a known location
+                # forces the shape predictor and ResNet encoder to run as well.
+                dummy = np.zeros((96, 96, 3), dtype=np.uint8)
+                face_recognition.face_locations(dummy, model="hog")
+                face_recognition.face_encodings(dummy, [(16, 80, 80, 16)])
+            
+            self.warmup_seconds = time.perf_counter() - started
+            self.is_warm = True
+            logger.info(f"Face service warmed up in {self.warmup_seconds:.2f}s")
+            return self.warmup_seconds
+    
+    def detect_faces(self, image_data: Union[bytes, Image.Image]) -> dict:
         """
         Detect faces in an image and return their encodings.
         
         Args:
-            image_data: Raw image bytes
+            image_data: Raw image bytes, or an image already decoded by the upload layer
             
         Returns:
             Dictionary with face count and base64-encoded face encodings
         """
         try:
             # Load image
-            image = Image.open(BytesIO(image_data))
+            image = image_data if isinstance(image_data, Image.Image) else Image.open(BytesIO(image_data))
             image_array = np.array(image)
             
-            if not FACE_RECOGNITION_AVAILABLE:
-                # Return mock data when face_recognition not available
-                return self._mock_detect_faces(image)
+            if self.is_synthetic or not self.is_available:
+                # Synthetic faces when configured, or when face_recognition is not available
+                return self._synthetic_detect_faces(image_array)
             
             # Detect face locations
-            face_locations = face_recognition.face_locations(image_array, model="hog")
+            face_locations = self._locate_faces(image_array)
             
             if not face_locations:
                 return {
@@ -101,12 +209,18 @@ class FaceService:
             logger.error(f"Error detecting faces: {e}")
             raise
     
-    def encode_selfie(self, image_data: bytes) -> Optional[str]:
+    def _locate_faces(self, image: np.ndarray) -> list:
+        """HOG face locations; images above the tiling threshold are detected in overlapping tiles."""
+        if tiled_detector.should_tile(image):
+            return tiled_detector.detect(image, face_recognition.face_locations)
+        return face_recognition.face_locations(image, model="hog")
+    
+    def encode_selfie(self, image_data: Union[bytes, Image.Image]) -> Optional[str]:
         """
         Detect and encode the primary face in a selfie image.
         
         Args:
-            image_data: Raw image bytes of selfie
+            image_data: Raw image bytes of selfie, or the decoded image
             
         Returns:
             Base64-encoded face encoding, or None if no face detected
@@ -125,7 +239,7 @@ class FaceService:
             logger.error(f"Error encoding selfie: {e}")
             raise
     
-    def match_faces(
+    def match_base64_encodings(
         self, 
         selfie_encoding: str, 
         photo_encodings: list[str]
@@ -141,39 +255,29 @@ class FaceService:
             List of match results with confidence scores
         """
         try:
-            if not FACE_RECOGNITION_AVAILABLE:
-                return self._mock_match_faces(len(photo_encodings))
-            
-            # Decode selfie encoding
-            selfie_vector = np.frombuffer(
-                base64.b64decode(selfie_encoding), 
-                dtype=np.float64
+            # Decode into the compact dtype and compare against all faces at once
+            selfie_vector = encoding_codec.decode_base64(selfie_encoding)
+            photo_matrix = encoding_codec.to_compact(
+                [encoding_codec.decode_base64(e) for e in photo_encodings]
             )
             
+            # Face distances (lower = more similar)
+            distances = encoding_codec.distances(photo_matrix, selfie_vector)
+            
             matches = []
-            for i, photo_encoding in enumerate(photo_encodings):
-                # Decode photo face encoding
-                photo_vector = np.frombuffer(
-                    base64.b64decode(photo_encoding),
-                    dtype=np.float64
-                )
-                
-                # Calculate face distance (lower = more similar)
-                distance = np.linalg.norm(selfie_vector - photo_vector)
-                
+            for i in np.flatnonzero(distances <= self.match_threshold):
+                distance = float(distances[i])
                 # Convert distance to confidence (0-1, higher = more confident).
                 # We use 1 / (1 + distance) to keep confidence in (0, 1] and
                 # monotonically decreasing as distance increases, independent
                 # of the chosen match threshold.
-                confidence = 1.0 / (1.0 + float(distance))
-                
-                if distance <= self.match_threshold:
-                    matches.append({
-                        "index": i,
-                        "distance": float(distance),
-                        "confidence": float(confidence),
-                        "is_match": True
-                    })
+                confidence = 1.0 / (1.0 + distance)
+                matches.append({
+                    "index": int(i),
+                    "distance": distance,
+                    "confidence": confidence,
+                    "is_match": True
+                })
             
             # Sort by confidence (highest first)
             matches.sort(key=lambda x: x["confidence"], reverse=True)
@@ -208,7 +312,7 @@ class FaceService:
                 continue
             
             # Check each face in the photo
-            matches = self.match_faces(selfie_encoding, photo_encodings)
+            matches = self.match_base64_encodings(selfie_encoding, photo_encodings)
             
             if matches:
                 # Get the best match for this photo
@@ -225,46 +329,34 @@ class FaceService:
         
         return matching_photos
     
-    def _mock_detect_faces(self, image: Image.Image) -> dict:
+    def _synthetic_detect_faces(self, image_array: np.ndarray) -> dict:
         """
-        Mock face detection when face_recognition is not available.
+        Detect faces with the synthetic engine, in the format of detect_faces().
         
         Args:
-            image: PIL Image object
+            image_array: Decoded image
             
         Returns:
-            Mock face detection result with random faces for testing
+            Face count, base64-encoded float64 encodings and pixel locations,
+            identical for identical image content
         """
-        import random
-        
-        # Multiplier for creating unique seeds from image dimensions
-        SEED_MULTIPLIER = 1000
-        
-        # Use image dimensions for deterministic seeding
-        seed = (image.width * SEED_MULTIPLIER) + image.height
-        random.seed(seed)
-        
-        face_count = random.randint(0, 3)
-        
-        encodings = [
-            base64.b64encode(np.random.rand(128).astype(np.float64).tobytes()).decode('utf-8')
-            for _ in range(face_count)
-        ]
-        
-        locations = [
-            {"top": 100, "right": 200, "bottom": 200, "left": 100}
-            for _ in range(face_count)
-        ]
-        
+        faces = synthetic_engine.detect(image_array)
         return {
-            "face_count": face_count,
-            "encodings": encodings,
-            "locations": locations
+            "face_count": len(faces),
+            "encodings": [
+                base64.b64encode(face["encoding"].astype(np.float64).tobytes()).decode('utf-8')
+                for face in faces
+            ],
+            "locations": [
+                dict(zip(("top", "right", "bottom", "left"), face["location"]))
+                for face in faces
+            ]
         }
     
     def _is_ip_private(self, ip: str) -> bool:
         """
-        Check whether the given IP address is in a private, loopback, link-local or multicast range.
+        Check whether the given IP address is in a private, loopback, link-local or multicast range
+        (and not in one of the allowed test networks).
         """
         try:
             ip_obj = ipaddress.ip_address(ip)
@@ -273,7 +365,7 @@ class FaceService:
                 or ip_obj.is_loopback
                 or ip_obj.is_link_local
                 or ip_obj.is_multicast
-            )
+            ) and not any(ip_obj in network for network in self.allowed_networks)
         except ValueError:
             # If the IP is not valid, treat it as unsafe.
             return True
@@ -330,29 +422,6 @@ class FaceService:
         """
         return self._resolve_and_validate_url(url) is not None
     
-    def _mock_match_faces(self, count: int) -> list[dict]:
-        """
-        Mock face matching when face_recognition is not available.
-        
-        Args:
-            count: Number of photo encodings to match against
-            
-        Returns:
-            Mock match results for testing
-        """
-        import random
-        
-        matches = []
-        for i in range(count):
-            if random.random() > 0.7:  # 30% match rate
-                matches.append({
-                    "index": i,
-                    "distance": random.uniform(0.3, 0.5),
-                    "confidence": random.uniform(0.6, 0.95),
-                    "is_match": True
-                })
-        return matches
-    
     def _create_safe_http_client(self) -> httpx.AsyncClient:
         """
         Create an HTTPX AsyncClient configured to reduce SSRF risk.
@@ -364,64 +433,160 @@ class FaceService:
     
     async def download_image(self, image_url: str) -> Optional[np.ndarray]:
         """Download image from URL and convert to numpy array for PR #9 backend integration."""
+        image_data = await self.download_image_bytes(image_url)
+        if image_data is None:
+            return None
         try:
-            # Resolve and validate URL to mitigate SSRF risks
-            resolved = self._resolve_and_validate_url(image_url)
-            if not resolved:
-                logger.error(f"Rejected image download from disallowed URL: {image_url}")
-                return None
+            # Decode off the event loop so other requests keep being served
+            return await asyncio.to_thread(self._decode_rgb_array, image_data)
+        except Exception as e:
+            logger.error(f"Failed to decode image: {e}")
+            return None
+    
+    async def download_image_bytes(self, image_url: str) -> Optional[bytes]:
+        """Download the encoded image from a validated URL, without decoding it."""
+        try:
+            return await self._download(image_url)
+        except Exception as e:
+            logger.error(f"Failed to download image: {e}")
+            return None
+    
+    async def _download(self, url: str, max_bytes: Optional[int] = None) -> Optional[bytes]:
+        """
+        Download a validated URL as a stream, optionally capped in size.
+        
+        Returns:
+            The body, or None for disallowed URLs and redirects
+        
+        Raises:
+            DownloadTooLarge: If Content-Length or the bytes received exceed max_bytes
+                (the transfer is aborted without buffering the rest)
+            httpx.HTTPError: On HTTP and transport errors
+        """
+        # Resolve and validate URL to mitigate SSRF risks
+        resolved = self._resolve_and_validate_url(url)
+        if not resolved:
+            logger.error(f"Rejected download from disallowed URL: {url}")
+            return None
 
-            parsed, ip = resolved
+        parsed, ip = resolved
 
-            # Build URL that connects directly to the validated IP while preserving the original path/query.
-            netloc = ip
-            safe_url = parsed._replace(netloc=netloc).geturl()
+        # Build URL that connects directly to the validated IP while preserving the original port/path/query.
+        host = f"[{ip}]" if ":" in ip else ip
+        netloc = f"{host}:{parsed.port}" if parsed.port else host
+        safe_url = parsed._replace(netloc=netloc).geturl()
 
-            headers = {
-                "Host": parsed.hostname
-            }
+        headers = {
+            "Host": f"{parsed.hostname}:{parsed.port}" if parsed.port else parsed.hostname
+        }
 
-            async with self._create_safe_http_client() as client:
-                response = await client.get(safe_url, headers=headers, timeout=30.0)
-            
-            # Do not follow redirects to unknown/unsafe locations
-            if 300 <= response.status_code < 400:
-                logger.error(f"Rejected image download due to redirect response from URL: {image_url}")
-                return None
-            
-            response.raise_for_status()
-            
-            image = Image.open(BytesIO(response.content))
-            
-            # Convert to RGB if necessary
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            return np.array(image)
-        except Exception as e:
-            logger.error(f"Failed to download image: {e}")
-            return None
+        async with self._create_safe_http_client() as client:
+            async with client.stream("GET", safe_url, headers=headers, timeout=30.0) as response:
+                # Do not follow redirects to unknown/unsafe locations
+                if 300 <= response.status_code < 400:
+                    logger.error(f"Rejected download due to redirect response from URL: {url}")
+                    return None
+                
+                response.raise_for_status()
+                
+                length = response.headers.get("Content-Length", "")
+                if max_bytes is not None and length.isdigit() and int(length) > max_bytes:
+                    raise DownloadTooLarge(f"Content-Length {length} exceeds the {max_bytes} byte limit")
+                
+                chunks, received = [], 0
+                async for chunk in response.aiter_bytes():
+                    received += len(chunk)
+                    # Also covers missing or wrong Content-Length and compressed bodies
+                    if max_bytes is not None and received > max_bytes:
+                        raise DownloadTooLarge(f"Download exceeds the {max_bytes} byte limit")
+                    chunks.append(chunk)
+                return b"".join(chunks)
     
-    async def detect_faces_from_url(self, image_url: str) -> dict:
+    @staticmethod
+    def _decode_rgb_array(image_data: bytes) -> np.ndarray:
+        image = Image.open(BytesIO(image_data))
+        
+        # Convert to RGB if necessary
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        
+        return np.array(image)
+    
+    async def detect_faces_from_url(self, image_url: str, keep_image: bool = False, store_chips: bool = False) -> dict:
         """
         Detect all faces in an image from URL and return their encodings (for PR #9).
         
+        Concurrent calls for the same URL (e.g. worker retries) share one download
+        and detection.
+        
+        Args:
+            image_url: URL of the photo
+            keep_image: Also return the decoded RGB array as "image" (even when
+                face_recognition is unavailable), so derivatives can be produced
+                without downloading and decoding the photo again
+            store_chips: Also return the aligned face chips and their landmarks as
+                "chips" and "landmarks" (dlib engine only), for the chip store
+        
         Returns:
-            dict with face_count, faces (list of face data with encodings and bounding boxes)
+            dict with face_count, faces (list of face data with encodings and bounding boxes).
+            Encodings are NumPy arrays; the API layer serializes them directly.
         """
-        image = await self.download_image(image_url)
+        return await single_flight.run(
+            "detect_faces_url",
+            (normalize_url(image_url), keep_image, store_chips),
+            lambda: self._detect_faces_from_url(image_url, keep_image, store_chips)
+        )
+    
+    async def _detect_faces_from_url(self, image_url: str, keep_image: bool, store_chips: bool = False) -> dict:
+        if not self.is_synthetic and not self.is_available and not keep_image:
+            return {"face_count": 0, "faces": [], "error": "face_recognition not available"}
+        
+        started = time.perf_counter()
+        with memory_profiler.stage("download"):
+            image = await self.download_image(image_url)
+        timings = {"download_ms": (time.perf_counter() - started) * 1000}
         if image is None:
-            return {"face_count": 0, "faces": [], "error": "Failed to load image"}
+            return {"face_count": 0, "faces": [], "error": "Failed to load image", "timings": timings}
+        
+        if self.is_synthetic:
+            result = await self._synthetic_detect_in_array(image, timings)
+        elif self.is_available:
+            result = await self._detect_in_array(image, timings, store_chips)
+        else:
+            result = {"face_count": 0, "faces": [], "error": "face_recognition not available"}
+        result["timings"] = timings
+        if keep_image:
+            result["image"] = image
+        return result
+    
+    async def _detect_in_array(self, image: np.ndarray, timings: dict, store_chips: bool = False) -> dict:
+        """
+        Detect and encode the faces of a decoded RGB image, recording stage timings.
         
+        With store_chips, the faces are aligned first and encoded from the
+        aligned chips (the same chips face_encodings extracts internally), which
+        are returned with their landmarks as "chips" and "landmarks".
+        """
         try:
-            # Detect face locations
-            face_locations = face_recognition.face_locations(image)
+            # Detect face locations (CPU-bound dlib work runs in a worker thread)
+            started = time.perf_counter()
+            with memory_profiler.stage("detect"):
+                face_locations = await asyncio.to_thread(self._locate_faces, image)
+            timings["detect_ms"] = (time.perf_counter() - started) * 1000
             
             if not face_locations:
                 return {"face_count": 0, "faces": []}
             
             # Get face encodings
-            face_encodings = face_recognition.face_encodings(image, face_locations)
+            started = time.perf_counter()
+            chips = landmarks = None
+            with memory_profiler.stage("encode"):
+                if store_chips:
+                    chips, landmarks = await asyncio.to_thread(align_faces, image, face_locations)
+                    face_encodings = await asyncio.to_thread(encode_chips, chips)
+                else:
+                    face_encodings = await asyncio.to_thread(face_recognition.face_encodings, image, face_locations)
+            timings["encode_ms"] = (time.perf_counter() - started) * 1000
             
             # Get image dimensions for percentage-based bounding boxes
             height, width = image.shape[:2]
@@ -432,7 +597,7 @@ class FaceService:
                 
                 faces.append({
                     "index": i,
-                    "encoding": encoding.tolist(),
+                    "encoding": encoding,
                     "bounding_box": {
                         "top": top / height,
                         "right": right / width,
@@ -441,29 +606,133 @@ class FaceService:
                     }
                 })
             
-            return {
+            result = {
                 "face_count": len(faces),
                 "faces": faces
             }
+            if store_chips:
+                result["chips"] = chips
+                result["landmarks"] = landmarks
+            return result
         except Exception as e:
             logger.error(f"Face detection failed: {e}")
             return {"face_count": 0, "faces": [], "error": str(e)}
     
+    async def _synthetic_detect_in_array(self, image: np.ndarray, timings: dict) -> dict:
+        """Synthetic counterpart of _detect_in_array (detection and encoding are one stage)."""
+        started = time.perf_counter()
+        with memory_profiler.stage("detect"):
+            detected = await asyncio.to_thread(synthetic_engine.detect, image)
+        timings["detect_ms"] = (time.perf_counter() - started) * 1000
+        
+        height, width = image.shape[:2]
+        faces = []
+        for i, face in enumerate(detected):
+            top, right, bottom, left = face["location"]
+            faces.append({
+                "index": i,
+                "encoding": face["encoding"],
+                "bounding_box": {
+                    "top": top / height,
+                    "right": right / width,
+                    "bottom": bottom / height,
+                    "left": left / width
+                }
+            })
+        return {"face_count": len(faces), "faces": faces}
+    
+    async def detect_faces_in_video_from_url(self, video_url: str) -> dict:
+        """
+        Face tracks of a video clip from URL, one encoding per track.
+        
+        Faces are detected on adaptively sampled keyframes only and tracked in
+        between (see video_processor). Concurrent calls for the same URL share
+        one computation.
+        
+        Returns:
+            dict with track_count, faces (one per track, with time span), video
+            (frame counts) and timings; or an error
+        """
+        return await single_flight.run(
+            "detect_faces_video_url",
+            normalize_url(video_url),
+            lambda: self._detect_faces_in_video_from_url(video_url)
+        )
+    
+    async def _detect_faces_in_video_from_url(self, video_url: str) -> dict:
+        if not video_processor.is_available:
+            return {"track_count": 0, "faces": [], "error": "Video support not available (PyAV missing)"}
+        if not self.is_synthetic and not self.is_available:
+            return {"track_count": 0, "faces": [], "error": "face_recognition not available"}
+        
+        started = time.perf_counter()
+        try:
+            # Capped while streaming, so an oversized clip is never buffered whole
+            video_data = await self._download(video_url, max_bytes=settings.video_max_size_mb * 1024 * 1024)
+        except DownloadTooLarge as e:
+            logger.error(f"Rejected video {video_url}: {e}")
+            timings = {"download_ms": (time.perf_counter() - started) * 1000}
+            return {"track_count": 0, "faces": [], "error": "Video too large", "timings": timings}
+        except Exception as e:
+            logger.error(f"Failed to download video: {e}")
+            video_data = None
+        timings = {"download_ms": (time.perf_counter() - started) * 1000}
+        if video_data is None:
+            return {"track_count": 0, "faces": [], "error": "Failed to load video", "timings": timings}
+        
+        if self.is_synthetic:
+            def detect(image):
+                return [(face["location"], face["encoding"]) for face in synthetic_engine.detect(image)]
+            encode = None
+        else:
+            def detect(image):
+                return [(location, None) for location in self._locate_faces(image)]
+            encode = face_recognition.face_encodings
+        
+        started = time.perf_counter()
+        try:
+            result = await asyncio.to_thread(video_processor.process, video_data, detect, encode)
+        except Exception as e:
+            logger.error(f"Video face detection failed: {e}")
+            result = {"track_count": 0, "faces": [], "error": str(e)}
+        timings["process_ms"] = (time.perf_counter() - started) * 1000
+        result["timings"] = timings
+        return result
+    
     async def encode_selfie_from_url(self, image_url: str) -> dict:
         """
         Encode a single face from a selfie image URL (for PR #9).
-        Expects exactly one face in the image.
+        Expects exactly one face in the image. Concurrent calls for the same URL
+        (e.g. a double-tapped selfie button) share one computation.
         
         Returns:
-            dict with encoding (list of floats) or error
+            dict with encoding (NumPy array) or error
         """
+        return await single_flight.run(
+            "encode_selfie_url",
+            normalize_url(image_url),
+            lambda: self._encode_selfie_from_url(image_url)
+        )
+    
+    async def _encode_selfie_from_url(self, image_url: str) -> dict:
+        if not self.is_synthetic and not self.is_available:
+            return {"face_detected": False, "error": "face_recognition not available"}
+        
         image = await self.download_image(image_url)
         if image is None:
             return {"face_detected": False, "error": "Failed to load image"}
         
+        if self.is_synthetic:
+            faces = await asyncio.to_thread(synthetic_engine.detect, image)
+            if not faces:
+                return {"face_detected": False, "error": "No face detected"}
+            # Largest face, as for real selfies
+            largest = max(faces, key=lambda face: (face["location"][2] - face["location"][0]) * (face["location"][1] - face["location"][3]))
+            return {"face_detected": True, "encoding": largest["encoding"]}
+        
         try:
-            # Detect faces
-            face_locations = face_recognition.face_locations(image)
+            # Detect faces (CPU-bound dlib work runs in a worker thread)
+            face_locations = await asyncio.to_thread(self._locate_faces, image)
             
             if not face_locations:
                 return {"face_detected": False, "error": "No face detected"}
@@ -475,53 +744,61 @@ class FaceService:
                 face_locations = [largest_face]
             
             # Encode the face
-            encoding = face_recognition.face_encodings(image, face_locations)[0]
+            encoding = (await asyncio.to_thread(face_recognition.face_encodings, image, face_locations))[0]
             
             return {
                 "face_detected": True,
-                "encoding": encoding.tolist()
+                "encoding": encoding
             }
         except Exception as e:
             logger.error(f"Selfie encoding failed: {e}")
             return {"face_detected": False, "error": str(e)}
     
-    def match_faces(self, target_encoding: List[float], photo_faces: List[dict]) -> List[dict]:
+    def match_faces(
+        self,
+        target_encoding: EncodingInput,
+        photo_faces: List[dict],
+        fusion: str = "min"
+    ) -> List[dict]:
         """
         Match a target face encoding against a list of photo faces (for PR #9).
         
         Args:
-            target_encoding: The face encoding to match
+            target_encoding: The face encoding to match, or several reference
+                encodings of the same person
             photo_faces: List of dicts with photo_id, face_id, and encoding
+            fusion: How several references are combined ("min" or "centroid")
             
         Returns:
             List of matches with photo_id, face_id, distance, and confidence
         """
-        if not FACE_RECOGNITION_AVAILABLE:
+        if not photo_faces:
             return []
         
-        target_array = np.array(target_encoding)
-        matches = []
+        # Convert at the API boundary and match natively in the compact dtype
+        queries = encoding_codec.fuse(encoding_codec.to_compact(target_encoding), fusion)
+        face_matrix = encoding_codec.to_compact([pf["encoding"] for pf in photo_faces])
         
-        for photo_face in photo_faces:
-            face_array = np.array(photo_face["encoding"])
-            
-            # Calculate Euclidean distance
-            distance = np.linalg.norm(target_array - face_array)
-            
-            # Only include if below threshold
-            if distance <= self.match_threshold:
-                confidence = max(0, 1 - (distance / self.match_threshold))
-                matches.append({
-                    "photo_id": photo_face["photo_id"],
-                    "face_id": photo_face["face_id"],
-                    "distance": float(distance),
-                    "confidence": float(confidence)
-                })
+        # Euclidean distances to every face (closest reference) in one vectorized pass
+        distances = encoding_codec.min_distances(face_matrix, queries)
+        
+        # Matches sorted by distance (best matches first), converted to Python
+        # floats in bulk rather than per match
+        hits = np.flatnonzero(distances <= self.match_threshold)
+        hits = hits[np.argsort(distances[hits], kind="stable")]
+        hit_distances = distances[hits].astype(np.float64)
+        confidences = np.maximum(0, 1 - hit_distances / self.match_threshold)
         
-        # Sort by distance (best matches first)
-        matches.sort(key=lambda x: x["distance"])
-        return matches
+        return [
+            {
+                "photo_id": photo_faces[i]["photo_id"],
+                "face_id": photo_faces[i]["face_id"],
+                "distance": distance,
+                "confidence": confidence
+            }
+            for i, distance, confidence in zip(hits.tolist(), hit_distances.tolist(), confidences.tolist())
+        ]
 
 
 # Singleton instance
-face_service = FaceService()
+face_service = FaceService(engine=settings.face_engine, allowed_networks=settings.ssrf_allowed_networks)
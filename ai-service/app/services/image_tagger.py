@@ -0,0 +1,283 @@
+"""
+Image statistics and gallery tags from a reduced copy of a photo.
+
+Exposure, brightness, colour, sharpness and day/night tags do not need full
+resolution: every statistic is computed on a copy whose longest side is about
+analysis_size pixels. Encoded JPEGs are decoded directly at that scale
+(reduce-on-decode via draft); images already decoded are box-reduced first. All
+statistics then come from one set of vectorized NumPy passes over the small
+array, so tagging costs a few milliseconds whatever the source resolution:
+
+- luminance histogram, mean (brightness) and spread (contrast), and the
+  fractions of clipped shadows and highlights (exposure)
+- saturation and Hasler-Suesstrunk colourfulness
+- variance of the Laplacian (sharpness); on a reduced copy this detects blur
+  visible at gallery scale (missed focus, motion blur), not pixel-level softness
+- brightness of the top third against the whole frame (day/night)
+- a k-means palette of the dominant colours, fitted on a pixel subsample
+"""
+
+import logging
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# ITU-R BT.601 luma weights
+LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+HISTOGRAM_BINS = 32
+
+# Hue bin upper bounds (degrees) and names, for saturated palette colours
+HUE_NAMES = [
+    (15, "red"), (45, "orange"), (70, "yellow"), (160, "green"),
+    (200, "cyan"), (260, "blue"), (290, "purple"), (335, "pink"), (360, "red")
+]
+
+
+def colour_name(rgb: np.ndarray) -> str:
+    """Basic colour name of an RGB colour (components 0-1)."""
+    high, low = float(rgb.max()), float(rgb.min())
+    saturation = (high - low) / high if high > 0 else 0.0
+    if high < 0.2:
+        return "black"
+    if saturation < 0.2:
+        return "white" if high > 0.85 else "gray"
+    if high < 0.5 and rgb[0] >= rgb[1] > rgb[2]:
+        return "brown"
+    red, green, blue = rgb
+    delta = high - low
+    if high == red:
+        hue = 60 * (((green - blue) / delta) % 6)
+    elif high == green:
+        hue = 60 * ((blue - red) / delta + 2)
+    else:
+        hue = 60 * ((red - green) / delta + 4)
+    return next(name for bound, name in HUE_NAMES if hue < bound)
+
+
+class ImageTagger:
+    """Computes image statistics and tags on a reduced copy of a photo."""
+    
+    def __init__(
+        self,
+        analysis_size: int = 512,
+        palette_colors: int = 5,
+        palette_samples: int = 4096,
+        palette_iterations: int = 10,
+        blur_threshold: float = 60.0
+    ):
+        """
+        Initialize ImageTagger.
+        
+        Args:
+            analysis_size: Longest side of the reduced copy the statistics are computed on
+            palette_colors: Colours (k-means clusters) in the palette
+            palette_samples: Pixels sampled for fitting the palette
+            palette_iterations: k-means iterations
+            blur_threshold: Laplacian variance (0-255 luma) below which a photo is tagged blurry
+        """
+        if analysis_size < 32:
+            raise ValueError("The tagging analysis size must be at least 32 px")
+        self.analysis_size = analysis_size
+        self.palette_colors = palette_colors
+        self.palette_samples = palette_samples
+        self.palette_iterations = palette_iterations
+        self.blur_threshold = blur_threshold
+        self._lock = threading.Lock()
+        
+        self.images = 0
+        self.seconds = 0.0
+    
+    def reduce(self, image: Image.Image) -> np.ndarray:
+        """(h, w, 3) float32 RGB array (0-1) of the image, longest side about analysis_size."""
+        scale = self.analysis_size / max(image.size)
+        if scale < 1:
+            # No effect once the image is loaded; a lazily opened JPEG decodes at 1/2-1/8 scale
+            image.draft("RGB", (int(image.width * scale), int(image.height * scale)))
+            factor = int(max(image.size) / self.analysis_size)
+            if factor > 1:
+                # reduce() rejects palette, bilevel and 32-bit integer images
+                if image.mode not in ("L", "RGB"):
+                    image = image.convert("RGB")
+                image = image.reduce(factor)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        return np.asarray(image, dtype=np.float32) / 255
+    
+    def analyze(self, image: Image.Image) -> tuple[dict, list[str]]:
+        """
+        Statistics and tags of an image.
+        
+        A lazily opened image (Image.open on the encoded bytes) is decoded at
+        reduced scale; read its size and mode before calling this.
+        
+        Returns:
+            (statistics, tags)
+        """
+        started = time.perf_counter()
+        rgb = self.reduce(image)
+        pixels = rgb.reshape(-1, 3)
+        luma = rgb @ LUMA_WEIGHTS
+        
+        histogram = np.bincount(
+            np.minimum((luma * HISTOGRAM_BINS).astype(np.int32), HISTOGRAM_BINS - 1).ravel(),
+            minlength=HISTOGRAM_BINS
+        ) / luma.size
+        brightness = float(luma.mean())
+        contrast = float(luma.std())
+        shadows = float(histogram[:2].sum())
+        highlights = float(histogram[-2:].sum())
+        
+        # Element-wise over the channels: reducing along a 3-wide axis is an order slower
+        red, green, blue = pixels[:, 0], pixels[:, 1], pixels[:, 2]
+        high = np.maximum(np.maximum(red, green), blue)
+        low = np.minimum(np.minimum(red, green), blue)
+        saturation = float(np.mean(np.where(high > 0, (high - low) / np.maximum(high, 1e-6), 0)))
+        rg = red - green
+        yb = (red + green) / 2 - blue
+        colourfulness = float(
+            255 * (np.hypot(rg.std(), yb.std()) + 0.3 * np.hypot(rg.mean(), yb.mean()))
+        )
+        
+        # 4-neighbour Laplacian over the interior, in 0-255 luma units
+        scaled = luma * 255
+        laplacian = (
+            4 * scaled[1:-1, 1:-1]
+            - scaled[:-2, 1:-1] - scaled[2:, 1:-1] - scaled[1:-1, :-2] - scaled[1:-1, 2:]
+        )
+        sharpness = float(laplacian.var())
+        
+        top_brightness = float(luma[:max(1, luma.shape[0] // 3)].mean())
+        palette = self._palette(pixels)
+        
+        statistics = {
+            "brightness": brightness,
+            "contrast": contrast,
+            "clipped_shadows": shadows,
+            "clipped_highlights": highlights,
+            "saturation": saturation,
+            "colorfulness": colourfulness,
+            "sharpness": sharpness,
+            "top_brightness": top_brightness,
+            "histogram": histogram.round(4).tolist(),
+            "palette": palette,
+            "analysis_size": [rgb.shape[1], rgb.shape[0]]
+        }
+        tags = self._tags(statistics)
+        
+        elapsed = time.perf_counter() - started
+        statistics["analysis_ms"] = elapsed * 1000
+        with self._lock:
+            self.images += 1
+            self.seconds += elapsed
+        return statistics, tags
+    
+    def stats(self) -> dict:
+        return {
+            "analysis_size": self.analysis_size,
+            "palette_colors": self.palette_colors,
+            "images": self.images,
+            "avg_ms": 1000 * self.seconds / self.images if self.images else 0.0
+        }
+    
+    def _palette(self, pixels: np.ndarray) -> list[dict]:
+        """Dominant colours by k-means on a pixel subsample, largest share first."""
+        # Seeded per image, so a photo always gets the same palette
+        rng = np.random.default_rng(len(pixels))
+        if len(pixels) > self.palette_samples:
+            pixels = pixels[rng.choice(len(pixels), self.palette_samples, replace=False)]
+        k = min(self.palette_colors, len(pixels))
+        
+        # Squared distances as |p|^2 - 2 p.c + |c|^2, one matrix product per pass
+        norms = np.einsum("ij,ij->i", pixels, pixels)
+        
+        def distances(centres: np.ndarray) -> np.ndarray:
+            return np.maximum(norms[:, None] - 2 * pixels @ centres.T + np.einsum("ij,ij->i", centres, centres), 0)
+        
+        def assign(centres: np.ndarray) -> np.ndarray:
+            return distances(centres).argmin(axis=1)
+        
+        # k-means++ initialisation
+        centres = pixels[rng.integers(len(pixels))][None, :]
+        closest = distances(centres)[:, 0].astype(np.float64)
+        for _ in range(1, k):
+            if closest.sum() == 0:
+                break
+            centres = np.vstack([centres, pixels[rng.choice(len(pixels), p=closest / closest.sum())]])
+            closest = np.minimum(closest, distances(centres[-1:])[:, 0])
+        
+        for _ in range(self.palette_iterations):
+            labels = assign(centres)
+            counts = np.bincount(labels, minlength=len(centres))
+            sums = np.stack([np.bincount(labels, weights=pixels[:, c], minlength=len(centres)) for c in range(3)], axis=1)
+            occupied = counts > 0
+            updated = centres.copy()
+            updated[occupied] = sums[occupied] / counts[occupied, None]
+            if np.allclose(updated, centres, atol=1e-4):
+                break
+            centres = updated
+        counts = np.bincount(assign(centres), minlength=len(centres))
+        
+        order = np.argsort(-counts)
+        return [
+            {
+                "hex": "#{:02x}{:02x}{:02x}".format(*np.round(centres[i] * 255).astype(int)),
+                "name": colour_name(centres[i]),
+                "share": float(counts[i] / len(pixels))
+            }
+            for i in order
+            if counts[i] > 0
+        ]
+    
+    def _tags(self, statistics: dict) -> list[str]:
+        tags = []
+        brightness = statistics["brightness"]
+        
+        if statistics["clipped_highlights"] > 0.25 or brightness > 0.75:
+            tags.append("overexposed")
+        elif statistics["clipped_shadows"] > 0.4 or brightness < 0.2:
+            tags.append("underexposed")
+        else:
+            tags.append("well-exposed")
+        
+        if brightness < 0.35:
+            tags.append("dark")
+        elif brightness > 0.65:
+            tags.append("bright")
+        if statistics["contrast"] < 0.1:
+            tags.append("low-contrast")
+        
+        if statistics["colorfulness"] < 10:
+            tags.append("monochrome")
+        elif statistics["colorfulness"] > 60:
+            tags.append("vibrant")
+        
+        tags.append("blurry" if statistics["sharpness"] < self.blur_threshold else "sharp")
+        
+        # Night: a dark frame with a dark top (sky or ceiling); day: a bright top
+        if brightness < 0.25 and statistics["top_brightness"] < 0.25:
+            tags.append("night")
+        elif statistics["top_brightness"] > 0.45:
+            tags.append("day")
+        
+        seen = set()
+        for colour in statistics["palette"]:
+            if colour["share"] >= 0.15 and colour["name"] not in seen:
+                seen.add(colour["name"])
+                tags.append(f"dominant-{colour['name']}")
+        return tags
+
+
+# Singleton instance
+image_tagger = ImageTagger(
+    analysis_size=settings.tagging_analysis_size,
+    palette_colors=settings.tagging_palette_colors,
+    palette_samples=settings.tagging_palette_samples,
+    blur_threshold=settings.tagging_blur_threshold
+)
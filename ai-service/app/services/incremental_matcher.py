@@ -0,0 +1,378 @@
+"""
+Incremental guest matching for Snapory.
+
+Guests register their selfie encoding for an event once. Each time new faces
+are detected for that event, only the new faces are compared against every
+registered guest in a single vectorized step, so the per-upload cost is
+O(new faces x guests) instead of a full rescan per guest. New matches are
+published as deltas on a Redis pub/sub channel and kept in a bounded
+in-process log that clients can poll.
+
+Like the event indexes, guests and deltas live in this process's memory (see
+EVENT_STATE_ENABLED): the delta log is released when the event's index is
+evicted, and the guests as well when it is dropped.
+
+A guest profile can hold several reference encodings (extra selfies or
+confirmed matches). They are fused into query encodings (min-over-references
+or centroid) and evaluated in the same batched pass as all other guests.
+"""
+
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+import numpy as np
+
+from app.config import settings
+from app.services.encodings import ENCODING_DIM, FUSION_MODES, EncodingInput, encoding_codec
+from app.services.event_index import EventFaceIndex, event_indexes
+from app.services.redis_service import redis_service
+
+logger = logging.getLogger(__name__)
+
+MATCH_CHANNEL = "snapory:event:{event_id}:matches"
+
+
+class EventGuests:
+    """
+    Registered guest profiles of one event.
+    
+    The fused query encodings of all guests are stacked into one matrix, grouped
+    by guest: the queries of guest i are rows offsets[i]:offsets[i + 1].
+    """
+    
+    def __init__(self, fusion: str = "min", max_references: int = 10):
+        self.fusion = fusion
+        self.max_references = max_references
+        self.guest_ids: list[str] = []
+        self.references: dict[str, np.ndarray] = {}
+        self.matrix = np.empty((0, ENCODING_DIM), dtype=encoding_codec.dtype)
+        self.offsets = np.zeros(1, dtype=np.intp)
+    
+    def register(self, guest_id: str, references: np.ndarray):
+        """Register a guest, or replace all references of a registered guest."""
+        if guest_id not in self.references:
+            self.guest_ids.append(guest_id)
+        self.references[guest_id] = references[-self.max_references:]
+        self._restack()
+    
+    def add_references(self, guest_id: str, references: np.ndarray):
+        """Append references to a profile, keeping the most recent max_references."""
+        combined = np.vstack([self.references[guest_id], references])
+        self.references[guest_id] = combined[-self.max_references:]
+        self._restack()
+    
+    def unregister(self, guest_id: str) -> bool:
+        if guest_id not in self.references:
+            return False
+        self.guest_ids.remove(guest_id)
+        del self.references[guest_id]
+        self._restack()
+        return True
+    
+    def queries(self, guest_id: str) -> np.ndarray:
+        """Fused query encodings of one guest."""
+        return encoding_codec.fuse(self.references[guest_id], self.fusion)
+    
+    def _restack(self):
+        # Profiles change rarely compared to face ingests, so rebuild eagerly
+        queries = [self.queries(g) for g in self.guest_ids]
+        if queries:
+            self.matrix = np.vstack(queries)
+        else:
+            self.matrix = np.empty((0, ENCODING_DIM), dtype=encoding_codec.dtype)
+        self.offsets = np.concatenate([[0], np.cumsum([len(q) for q in queries])]).astype(np.intp)
+
+
+class IndexRows:
+    """Copy of some rows of an event index, matched after the index lock is released."""
+    
+    def __init__(self, encodings: np.ndarray, norms: np.ndarray, face_ids: list[str], photo_ids: list[str]):
+        self.encodings = encodings
+        self.norms = norms
+        self.face_ids = face_ids
+        self.photo_ids = photo_ids
+    
+    def __len__(self) -> int:
+        return len(self.face_ids)
+    
+    @classmethod
+    def copy(cls, index: EventFaceIndex, rows: np.ndarray) -> "IndexRows":
+        """Copy rows of an index. Caller holds index.lock."""
+        return cls(
+            index.matrix[rows],
+            index.norms[rows],
+            [index.face_ids[row] for row in rows.tolist()],
+            [index.photo_ids[row] for row in rows.tolist()]
+        )
+
+
+class IncrementalMatcher:
+    """Matches newly ingested faces against all registered guests of an event."""
+    
+    def __init__(
+        self,
+        match_threshold: float = 0.6,
+        delta_retention: int = 10000,
+        fusion: str = "min",
+        max_references: int = 10
+    ):
+        """
+        Initialize IncrementalMatcher.
+        
+        Args:
+            match_threshold: Distance threshold for a face to count as a match
+            delta_retention: Number of match deltas kept per event for polling
+            fusion: How a guest's references are combined ("min" or "centroid")
+            max_references: Maximum reference encodings kept per guest
+        """
+        if fusion not in FUSION_MODES:
+            raise ValueError(f"Unsupported fusion mode '{fusion}'. Supported: {', '.join(FUSION_MODES)}")
+        self.match_threshold = match_threshold
+        self.delta_retention = delta_retention
+        self.fusion = fusion
+        self.max_references = max_references
+        self._guests: dict[str, EventGuests] = {}
+        self._deltas: dict[str, deque] = {}
+        self._sequence: dict[str, int] = {}
+        self._lock = threading.Lock()
+    
+    def register_guest(self, event_id: str, guest_id: str, encodings: EncodingInput) -> list[dict]:
+        """
+        Register (or replace) a guest's reference encodings for an event.
+        
+        Args:
+            encodings: One encoding or several (e.g. from multiple selfies)
+        
+        Returns:
+            Matches against the faces already indexed for the event, so the
+            guest only needs one full scan; later photos arrive as deltas.
+        
+        Raises:
+            ValueError: If no encoding is given
+        """
+        references = encoding_codec.to_compact(encodings)
+        if len(references) == 0:
+            raise ValueError("At least one reference encoding is required")
+        with self._lock:
+            guests = self._event_guests(event_id)
+            guests.register(guest_id, references)
+            queries = guests.queries(guest_id)
+        return self._search(event_id, queries)
+    
+    def add_references(
+        self,
+        event_id: str,
+        guest_id: str,
+        encodings: EncodingInput = (),
+        face_ids: list[str] = ()
+    ) -> list[dict] | None:
+        """
+        Add reference encodings to a registered guest's profile.
+        
+        Args:
+            encodings: Encodings of additional selfies
+            face_ids: Indexed faces confirmed by the guest as themselves
+        
+        Returns:
+            All matches of the updated profile (one batched pass over the
+            event), or None if the guest is not registered
+        
+        Raises:
+            ValueError: If no reference could be resolved
+        """
+        references = encoding_codec.to_compact(encodings)
+        index = event_indexes.get(event_id)
+        if face_ids and index is not None:
+            references = np.vstack([references, index.get_encodings(list(face_ids))])
+        if len(references) == 0:
+            raise ValueError("No reference encodings or known face ids given")
+        
+        with self._lock:
+            guests = self._guests.get(event_id)
+            if guests is None or guest_id not in guests.references:
+                return None
+            guests.add_references(guest_id, references)
+            queries = guests.queries(guest_id)
+        return self._search(event_id, queries)
+    
+    def guest_references(self, event_id: str, guest_id: str) -> np.ndarray | None:
+        """Fused query encodings of a registered guest, or None if not registered."""
+        with self._lock:
+            guests = self._guests.get(event_id)
+            if guests is None or guest_id not in guests.references:
+                return None
+            return guests.queries(guest_id)
+    
+    def reference_count(self, event_id: str, guest_id: str) -> int:
+        guests = self._guests.get(event_id)
+        references = guests.references.get(guest_id) if guests else None
+        return len(references) if references is not None else 0
+    
+    def unregister_guest(self, event_id: str, guest_id: str) -> bool:
+        with self._lock:
+            guests = self._guests.get(event_id)
+            return guests is not None and guests.unregister(guest_id)
+    
+    def release_event(self, event_id: str):
+        """
+        Forget the match delta log of an evicted event.
+        
+        Guests stay registered, so faces ingested once the index is loaded back
+        are still matched; the sequence keeps counting for pollers.
+        """
+        with self._lock:
+            self._deltas.pop(event_id, None)
+    
+    def drop_event(self, event_id: str):
+        """Forget the guests and match deltas of an event whose index was dropped."""
+        with self._lock:
+            self._guests.pop(event_id, None)
+            self._deltas.pop(event_id, None)
+            self._sequence.pop(event_id, None)
+    
+    def guest_count(self, event_id: str) -> int:
+        guests = self._guests.get(event_id)
+        return len(guests.guest_ids) if guests else 0
+    
+    def ingest_faces(self, event_id: str, faces: list[dict]) -> list[dict]:
+        """
+        Add newly detected faces to the event index and match them against all guests.
+        
+        Args:
+            faces: List of dicts with photo_id, face_id and encoding
+        
+        Returns:
+            New match deltas (also published and appended to the poll log)
+        """
+        def add(index: EventFaceIndex) -> IndexRows:
+            start, end = index.add_faces(faces)
+            return IndexRows.copy(index, np.arange(start, end, dtype=np.intp))
+        
+        # The new rows are copied under the lock of the add: a concurrent removal
+        # would otherwise shift other faces into the row range
+        _, rows = event_indexes.update(event_id, add)
+        return self._match_rows(event_id, rows)
+    
+    def replace_faces(self, event_id: str, faces: list[dict]) -> list[dict]:
+        """
+        Replace the encodings of indexed faces (e.g. after re-encoding) and match
+        them against all guests, as if they had just been ingested.
+        
+        Args:
+            faces: List of dicts with photo_id, face_id and encoding
+        
+        Returns:
+            Match deltas of the replaced faces (also published and appended to the poll log)
+        """
+        _, rows = event_indexes.update(event_id, lambda index: IndexRows.copy(index, index.replace_encodings(faces)))
+        return self._match_rows(event_id, rows)
+    
+    def get_deltas(self, event_id: str, since: int = 0, guest_id: str | None = None) -> tuple[list[dict], int]:
+        """
+        Return match deltas with a sequence number greater than `since`.
+        
+        Returns:
+            Tuple of (deltas, latest sequence number to pass as `since` next time)
+        """
+        with self._lock:
+            log = list(self._deltas.get(event_id, ()))
+            latest = self._sequence.get(event_id, 0)
+        
+        deltas = [
+            d for d in log
+            if d["sequence"] > since and (guest_id is None or d["guest_id"] == guest_id)
+        ]
+        return deltas, latest
+    
+    def _event_guests(self, event_id: str) -> EventGuests:
+        """Guests of an event, created on first use. Caller holds the lock."""
+        guests = self._guests.get(event_id)
+        if guests is None:
+            guests = EventGuests(self.fusion, self.max_references)
+            self._guests[event_id] = guests
+        return guests
+    
+    def _match_rows(self, event_id: str, rows: IndexRows) -> list[dict]:
+        """Match copied index rows against all guests of the event and emit the deltas."""
+        if len(rows) == 0:
+            return []
+        
+        with self._lock:
+            guests = self._guests.get(event_id)
+            if guests is None or not guests.guest_ids:
+                return []
+            guest_ids = list(guests.guest_ids)
+            guest_matrix = guests.matrix
+            offsets = guests.offsets
+        
+        # (faces x guest queries) distances in one matrix product, reduced
+        # to the closest query of each guest (min-over-references)
+        distances = encoding_codec.pairwise_distances(rows.encodings, guest_matrix, a_norms=rows.norms)
+        if len(guest_matrix) > len(guest_ids):
+            distances = np.minimum.reduceat(distances, offsets[:-1], axis=1)
+        face_rows, guest_cols = np.nonzero(distances <= self.match_threshold)
+        deltas = [
+            {
+                "guest_id": guest_ids[col],
+                **self._match(rows.photo_ids[row], rows.face_ids[row], float(distances[row, col]))
+            }
+            for row, col in zip(face_rows, guest_cols)
+        ]
+        
+        if deltas:
+            self._emit(event_id, deltas)
+            logger.info(
+                f"Event {event_id}: {len(rows)} new face(s) x {len(guest_ids)} guest(s) "
+                f"-> {len(deltas)} new match(es)"
+            )
+        return deltas
+    
+    def _search(self, event_id: str, queries: np.ndarray) -> list[dict]:
+        """Full match of a guest's queries against the faces indexed for the event."""
+        index = event_indexes.get(event_id)
+        if index is None or len(index) == 0:
+            return []
+        
+        with index.lock:
+            rows, distances = index.search(queries, self.match_threshold)
+            return [
+                self._match(index.photo_ids[row], index.face_ids[row], float(d))
+                for row, d in zip(rows.tolist(), distances)
+            ]
+    
+    def _match(self, photo_id: str, face_id: str, distance: float) -> dict:
+        return {
+            "photo_id": photo_id,
+            "face_id": face_id,
+            "distance": distance,
+            "confidence": float(max(0, 1 - (distance / self.match_threshold)))
+        }
+    
+    def _emit(self, event_id: str, deltas: list[dict]):
+        detected_at = datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            log = self._deltas.setdefault(event_id, deque(maxlen=self.delta_retention))
+            sequence = self._sequence.get(event_id, 0)
+            for delta in deltas:
+                sequence += 1
+                delta["sequence"] = sequence
+                delta["detected_at"] = detected_at
+                log.append(delta)
+            self._sequence[event_id] = sequence
+        
+        redis_service.publish(
+            MATCH_CHANNEL.format(event_id=event_id),
+            {"event_id": event_id, "matches": deltas}
+        )
+
+
+# Singleton instance
+incremental_matcher = IncrementalMatcher(
+    delta_retention=settings.match_delta_retention,
+    fusion=settings.guest_fusion,
+    max_references=settings.max_guest_references
+)
+event_indexes.on_release(incremental_matcher.release_event)
+event_indexes.on_drop(incremental_matcher.drop_event)
@@ -0,0 +1,412 @@
+"""
+Fair, priority-aware scheduling of event photo ingestion.
+
+With a single FIFO, a photographer uploading thousands of photos to one event
+holds up every other event, and events whose guests are waiting for their
+photos get no precedence. Here each event has its own Redis queue, and events
+are served by weighted fair queueing (start-time fair queueing):
+
+- Every event with pending photos carries a virtual time tag in a sorted set.
+  The event with the smallest tag is served next, and its tag advances by
+  1 / weight per photo, so over any busy period each event receives photos in
+  proportion to its weight, however many it has queued.
+- An event joining (or returning to) the schedule starts at the current
+  virtual time: idle periods do not build up credit.
+- Weights are 1, or a boost while guests of the event are active (any guest
+  call within ingest_guest_session_ttl) or while it is in live mode.
+
+Enqueue and dequeue are Lua scripts, so several service processes can share
+the queues. Dispatch takes a batch admission slot per photo; queue waits are
+recorded per event (in this process) for the stats endpoints.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Optional
+
+import numpy as np
+
+from app.config import settings
+from app.services.admission import admission_controller, AdmissionRejected, BATCH
+from app.services.redis_service import redis_service
+
+logger = logging.getLogger(__name__)
+
+QUEUE_KEY = "snapory:ingest:queue:{event_id}"
+ACTIVE_KEY = "snapory:ingest:active"
+VIRTUAL_TIME_KEY = "snapory:ingest:vtime"
+GUEST_SESSION_KEY = "snapory:ingest:guests:{event_id}"
+LIVE_KEY = "snapory:ingest:live:{event_id}"
+
+# Events whose queue waits are tracked, and waits kept per event
+MAX_TRACKED_EVENTS = 1000
+WAIT_WINDOW = 256
+
+# KEYS: event queue, active set, virtual time; ARGV: event id, job (or
+# "front" as ARGV[3] to put a job back at the head of its queue)
+_ENQUEUE_SCRIPT = """
+if ARGV[3] == 'front' then
+    redis.call('LPUSH', KEYS[1], ARGV[2])
+else
+    redis.call('RPUSH', KEYS[1], ARGV[2])
+end
+if not redis.call('ZSCORE', KEYS[2], ARGV[1]) then
+    redis.call('ZADD', KEYS[2], redis.call('GET', KEYS[3]) or '0', ARGV[1])
+end
+return redis.call('LLEN', KEYS[1])
+"""
+
+# KEYS: active set, virtual time; ARGV: queue, guest session and live key
+# prefixes, base, guest and live weights
+_DEQUEUE_SCRIPT = """
+while true do
+    local head = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    if #head == 0 then
+        return false
+    end
+    local event_id, tag = head[1], tonumber(head[2])
+    local queue = ARGV[1] .. event_id
+    local job = redis.call('LPOP', queue)
+    if job then
+        local weight = tonumber(ARGV[4])
+        if redis.call('EXISTS', ARGV[2] .. event_id) == 1 then
+            weight = math.max(weight, tonumber(ARGV[5]))
+        end
+        if redis.call('EXISTS', ARGV[3] .. event_id) == 1 then
+            weight = math.max(weight, tonumber(ARGV[6]))
+        end
+        redis.call('SET', KEYS[2], tostring(tag))
+        if redis.call('LLEN', queue) > 0 then
+            redis.call('ZADD', KEYS[1], tostring(tag + 1 / weight), event_id)
+        else
+            redis.call('ZREM', KEYS[1], event_id)
+        end
+        return {event_id, job, tostring(weight)}
+    end
+    redis.call('ZREM', KEYS[1], event_id)
+end
+"""
+
+
+def _key_prefix(template: str) -> str:
+    return template.format(event_id="")
+
+
+class EventWaits:
+    """Queue waits of one event's dispatched photos."""
+    
+    def __init__(self):
+        self.dispatched = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.recent: deque[float] = deque(maxlen=WAIT_WINDOW)
+        self.last_weight = 1.0
+    
+    def record(self, wait: float, weight: float):
+        self.dispatched += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.recent.append(wait)
+        self.last_weight = weight
+    
+    def stats(self) -> dict:
+        recent = np.array(self.recent) * 1000 if self.recent else np.zeros(1)
+        return {
+            "dispatched": self.dispatched,
+            "wait_avg_ms": 1000 * self.total_wait / self.dispatched if self.dispatched else 0.0,
+            "wait_p50_ms": float(np.percentile(recent, 50)),
+            "wait_p95_ms": float(np.percentile(recent, 95)),
+            "wait_max_ms": 1000 * self.max_wait,
+            "last_weight": self.last_weight
+        }
+
+
+class IngestScheduler:
+    """Per-event photo queues in Redis, dispatched to detection by weighted fair queueing."""
+    
+    def __init__(
+        self,
+        enabled: bool = False,
+        workers: int = 2,
+        poll_interval: float = 0.5,
+        guest_weight: float = 4.0,
+        live_weight: float = 8.0,
+        guest_session_ttl: int = 300,
+        live_ttl: int = 43200
+    ):
+        """
+        Initialize IngestScheduler.
+        
+        Args:
+            enabled: Dispatch queued photos from this process
+            workers: Photos dispatched concurrently by this process
+            poll_interval: Seconds between polls while all queues are empty
+            guest_weight: Share of an event with active guests, relative to 1
+            live_weight: Share of an event in live mode, relative to 1
+            guest_session_ttl: Seconds an event counts as having active guests after a guest call
+            live_ttl: Seconds live mode lasts unless renewed or ended
+        """
+        if guest_weight < 1 or live_weight < 1:
+            raise ValueError("Ingest priority weights must be at least 1")
+        self.enabled = enabled
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.guest_weight = guest_weight
+        self.live_weight = live_weight
+        self.guest_session_ttl = guest_session_ttl
+        self.live_ttl = live_ttl
+        self._enqueue = None
+        self._dequeue = None
+        self._tasks: list[asyncio.Task] = []
+        self._guest_touched: dict[str, float] = {}
+        self._waits: OrderedDict[str, EventWaits] = OrderedDict()
+        
+        self.enqueued = 0
+        self.dispatched = 0
+        self.requeued = 0
+        self.failed = 0
+    
+    @staticmethod
+    def queue_key(event_id: str) -> str:
+        return QUEUE_KEY.format(event_id=event_id)
+    
+    def enqueue(self, job: dict) -> Optional[int]:
+        """
+        Queue a photo job (with event_id) behind the other photos of its event.
+        
+        Returns:
+            The event's queue depth, or None if Redis is unavailable
+        """
+        job = dict(job, enqueued_at=time.time())
+        depth = self._run_enqueue(job, front=False)
+        if depth is not None:
+            self.enqueued += 1
+        return depth
+    
+    def dequeue(self) -> Optional[tuple[dict, float]]:
+        """
+        Take the next photo job by weighted fair queueing.
+        
+        Returns:
+            (job, weight of its event), or None if all queues are empty or Redis is unavailable
+        """
+        client = redis_service.get_binary_client()
+        if client is None:
+            return None
+        if self._dequeue is None:
+            self._dequeue = client.register_script(_DEQUEUE_SCRIPT)
+        try:
+            reply = self._dequeue(
+                keys=[ACTIVE_KEY, VIRTUAL_TIME_KEY],
+                args=[
+                    _key_prefix(QUEUE_KEY),
+                    _key_prefix(GUEST_SESSION_KEY),
+                    _key_prefix(LIVE_KEY),
+                    1.0,
+                    self.guest_weight,
+                    self.live_weight
+                ]
+            )
+        except Exception as e:
+            logger.error(f"Error dequeuing ingest job: {e}")
+            return None
+        if not reply:
+            return None
+        _, job, weight = reply
+        return json.loads(job), float(weight)
+    
+    def set_live(self, event_id: str, live: bool, ttl: Optional[int] = None) -> bool:
+        """Start (or renew) or end an event's live mode. Returns False if Redis is unavailable."""
+        client = redis_service.get_binary_client()
+        if client is None:
+            return False
+        key = LIVE_KEY.format(event_id=event_id)
+        try:
+            if live:
+                client.set(key, b"1", ex=ttl or self.live_ttl)
+            else:
+                client.delete(key)
+            return True
+        except Exception as e:
+            logger.error(f"Error updating live mode of event {event_id}: {e}")
+            return False
+    
+    async def note_guest_activity(self, event_id: str):
+        """Mark an event as having active guests (written at most every quarter TTL per process)."""
+        now = time.monotonic()
+        if now - self._guest_touched.get(event_id, float("-inf")) < self.guest_session_ttl / 4:
+            return
+        self._guest_touched[event_id] = now
+        if len(self._guest_touched) > MAX_TRACKED_EVENTS:
+            self._guest_touched.pop(next(iter(self._guest_touched)))
+        await asyncio.to_thread(self._touch_guest_session, event_id)
+    
+    def event_stats(self, event_id: str) -> Optional[dict]:
+        """Queue depth, current share and queue waits of one event, or None if Redis is unavailable."""
+        client = redis_service.get_binary_client()
+        if client is None:
+            return None
+        try:
+            pipe = client.pipeline(transaction=False)
+            pipe.llen(self.queue_key(event_id))
+            pipe.zscore(ACTIVE_KEY, event_id)
+            pipe.exists(GUEST_SESSION_KEY.format(event_id=event_id))
+            pipe.exists(LIVE_KEY.format(event_id=event_id))
+            depth, tag, guests_active, live = pipe.execute()
+        except Exception as e:
+            logger.error(f"Error reading ingest queue of event {event_id}: {e}")
+            return None
+        waits = self._waits.get(event_id)
+        return {
+            "event_id": event_id,
+            "queued": depth,
+            "virtual_time": tag,
+            "guests_active": bool(guests_active),
+            "live": bool(live),
+            "weight": self._weight(bool(guests_active), bool(live)),
+            **(waits.stats() if waits else EventWaits().stats())
+        }
+    
+    def start(self, process: Callable[[dict], Awaitable[None]]):
+        """Start dispatching queued photos to process(job) (must be called from the event loop)."""
+        if not self.enabled or self._tasks:
+            return
+        self._tasks = [asyncio.ensure_future(self._dispatch(process)) for _ in range(self.workers)]
+        logger.info(f"Started {self.workers} ingest dispatcher(s)")
+    
+    async def close(self):
+        """Stop dispatching; photos taken but not finished are put back at the head of their queues."""
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    
+    def stats(self) -> dict:
+        stats = {
+            "enabled": self.enabled,
+            "workers": self.workers,
+            "dispatching": len(self._tasks),
+            "guest_weight": self.guest_weight,
+            "live_weight": self.live_weight,
+            "enqueued": self.enqueued,
+            "dispatched": self.dispatched,
+            "requeued": self.requeued,
+            "failed": self.failed,
+            "events": {event_id: waits.stats() for event_id, waits in self._waits.items()},
+            "queued_events": None
+        }
+        client = redis_service.get_binary_client()
+        if client is not None:
+            try:
+                stats["queued_events"] = client.zcard(ACTIVE_KEY)
+            except Exception as e:
+                logger.error(f"Error reading ingest schedule: {e}")
+        return stats
+    
+    def _touch_guest_session(self, event_id: str):
+        client = redis_service.get_binary_client()
+        if client is None:
+            return
+        try:
+            client.set(GUEST_SESSION_KEY.format(event_id=event_id), b"1", ex=self.guest_session_ttl)
+        except Exception as e:
+            logger.error(f"Error recording guest activity of event {event_id}: {e}")
+    
+    def _weight(self, guests_active: bool, live: bool) -> float:
+        weight = 1.0
+        if guests_active:
+            weight = max(weight, self.guest_weight)
+        if live:
+            weight = max(weight, self.live_weight)
+        return weight
+    
+    def _run_enqueue(self, job: dict, front: bool) -> Optional[int]:
+        client = redis_service.get_binary_client()
+        if client is None:
+            return None
+        if self._enqueue is None:
+            self._enqueue = client.register_script(_ENQUEUE_SCRIPT)
+        event_id = job["event_id"]
+        try:
+            return self._enqueue(
+                keys=[self.queue_key(event_id), ACTIVE_KEY, VIRTUAL_TIME_KEY],
+                args=[event_id, json.dumps(job), "front" if front else "back"]
+            )
+        except Exception as e:
+            logger.error(f"Error queueing photo {job.get('photo_id')} of event {event_id}: {e}")
+            return None
+    
+    def _record_wait(self, job: dict, weight: float):
+        event_id = job["event_id"]
+        waits = self._waits.get(event_id)
+        if waits is None:
+            waits = self._waits[event_id] = EventWaits()
+            if len(self._waits) > MAX_TRACKED_EVENTS:
+                self._waits.popitem(last=False)
+        else:
+            self._waits.move_to_end(event_id)
+        waits.record(max(0.0, time.time() - job["enqueued_at"]), weight)
+    
+    async def _take(self) -> Optional[tuple[dict, float]]:
+        """Dequeue in a thread; if the dispatcher is cancelled meanwhile, the job it pops is put back."""
+        dequeue = asyncio.ensure_future(asyncio.to_thread(self.dequeue))
+        try:
+            return await asyncio.shield(dequeue)
+        except asyncio.CancelledError:
+            # The Lua script may already have popped a job: wait for it and return it to its queue
+            taken = await dequeue
+            if taken is not None:
+                await self._put_back(taken[0])
+            raise
+    
+    async def _put_back(self, job: dict):
+        """Return a taken job to the head of its queue, finishing even if the caller is cancelled."""
+        await asyncio.shield(asyncio.to_thread(self._run_enqueue, job, True))
+    
+    async def _dispatch(self, process: Callable[[dict], Awaitable[None]]):
+        while True:
+            taken = await self._take()
+            if taken is None:
+                await asyncio.sleep(self.poll_interval)
+                continue
+            job, weight = taken
+            try:
+                started = await admission_controller.acquire(BATCH)
+            except AdmissionRejected as e:
+                # Overloaded by direct detection calls: put the photo back first in line
+                await self._put_back(job)
+                self.requeued += 1
+                await asyncio.sleep(e.retry_after)
+                continue
+            except asyncio.CancelledError:
+                await self._put_back(job)
+                raise
+            
+            self._record_wait(job, weight)
+            self.dispatched += 1
+            try:
+                await process(job)
+            except asyncio.CancelledError:
+                # Shutting down mid-photo: leave it first in line for the next process
+                await self._put_back(job)
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Ingest of photo {job.get('photo_id')} of event {job['event_id']} failed: {e}")
+            finally:
+                admission_controller.release(BATCH, started)
+
+
+# Singleton instance
+ingest_scheduler = IngestScheduler(
+    enabled=settings.ingest_scheduler_enabled,
+    workers=settings.ingest_workers,
+    poll_interval=settings.ingest_poll_interval,
+    guest_weight=settings.ingest_guest_weight,
+    live_weight=settings.ingest_live_weight,
+    guest_session_ttl=settings.ingest_guest_session_ttl,
+    live_ttl=settings.ingest_live_ttl
+)
@@ -0,0 +1,176 @@
+"""
+Match result cache for Snapory's event matching.
+
+Guests reload their gallery repeatedly, re-running the same (event, encoding)
+match although no photos have arrived. Results are cached under the event id,
+the index content key (fingerprint and epoch, which change whenever faces are
+added, removed or re-encoded) and a hash of the compact target encoding, so any
+change to the event's faces invalidates its entries automatically.
+
+An in-process LRU answers repeat lookups in O(1). An optional Redis tier shares
+results between workers; because the fingerprint is derived from the face ids
+and the epoch travels with the index snapshot, rather than being per-process
+counters, workers holding the same faces agree on keys.
+"""
+
+import hashlib
+import logging
+import struct
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from app.config import settings
+from app.services.event_index import event_indexes
+from app.services.redis_service import redis_service
+
+logger = logging.getLogger(__name__)
+
+REDIS_KEY = "snapory:match-cache:{event_id}:{fingerprint:016x}.{epoch}:{digest}"
+
+
+class MatchCache:
+    """LRU cache of event match results with optional Redis storage."""
+    
+    def __init__(self, max_entries: int = 10000, use_redis: bool = False, ttl_seconds: int = 3600):
+        """
+        Initialize MatchCache.
+        
+        Args:
+            max_entries: Maximum number of results kept in process
+            use_redis: Also store results in Redis, shared between workers
+            ttl_seconds: Expiry of the Redis entries
+        """
+        self.max_entries = max_entries
+        self.use_redis = use_redis
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[tuple, dict] = OrderedDict()
+        # event_id -> (content key, keys cached for it); entries of an older
+        # content key are dropped as soon as the event's faces change
+        self._events: dict[str, tuple[tuple[int, int], set]] = {}
+        self._lock = threading.Lock()
+        
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.invalidations = 0
+    
+    @staticmethod
+    def encoding_digest(target: np.ndarray, threshold: float) -> str:
+        """Stable hash of a compact target encoding and the match threshold."""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(str(target.dtype).encode())
+        digest.update(np.ascontiguousarray(target).tobytes())
+        digest.update(struct.pack("<d", threshold))
+        return digest.hexdigest()
+    
+    def get(self, event_id: str, content_key: tuple[int, int], digest: str) -> Optional[dict]:
+        """
+        Look up a cached match result.
+        
+        Args:
+            content_key: EventFaceIndex.content_key of the event's index
+        
+        Returns:
+            The cached result, or None on a miss
+        """
+        key = (event_id, content_key, digest)
+        with self._lock:
+            self._check_content_key(event_id, content_key)
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return result
+        
+        if self.use_redis:
+            result = redis_service.get_json(self._redis_key(event_id, content_key, digest))
+            if result is not None:
+                with self._lock:
+                    self.redis_hits += 1
+                    self._check_content_key(event_id, content_key)
+                    self._store(key)
+                    self._entries[key] = result
+                return result
+        
+        with self._lock:
+            self.misses += 1
+        return None
+    
+    def put(self, event_id: str, content_key: tuple[int, int], digest: str, result: dict):
+        """Cache a match result for the given index content key."""
+        key = (event_id, content_key, digest)
+        with self._lock:
+            self._check_content_key(event_id, content_key)
+            self._store(key)
+            self._entries[key] = result
+            self.stores += 1
+        
+        if self.use_redis:
+            redis_service.set_json(self._redis_key(event_id, content_key, digest), result, self.ttl_seconds)
+    
+    def invalidate_event(self, event_id: str) -> int:
+        """Drop all in-process entries of an event. Returns the number dropped."""
+        with self._lock:
+            _, keys = self._events.pop(event_id, (None, set()))
+            for key in keys:
+                self._entries.pop(key, None)
+            self.invalidations += len(keys)
+            return len(keys)
+    
+    def stats(self) -> dict:
+        lookups = self.hits + self.redis_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "events": len(self._events),
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.redis_hits) / lookups if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "redis_enabled": self.use_redis
+        }
+    
+    @staticmethod
+    def _redis_key(event_id: str, content_key: tuple[int, int], digest: str) -> str:
+        fingerprint, epoch = content_key
+        return REDIS_KEY.format(event_id=event_id, fingerprint=fingerprint, epoch=epoch, digest=digest)
+    
+    def _check_content_key(self, event_id: str, content_key: tuple[int, int]):
+        """Drop an event's entries once its faces changed. Caller holds the lock."""
+        current = self._events.get(event_id)
+        if current is not None and current[0] != content_key:
+            for key in current[1]:
+                self._entries.pop(key, None)
+            self.invalidations += len(current[1])
+            current = None
+        if current is None:
+            self._events[event_id] = (content_key, set())
+    
+    def _store(self, key: tuple):
+        """Register a key about to be inserted and evict beyond capacity. Caller holds the lock."""
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+        self._events[key[0]][1].add(key)
+        while len(self._entries) >= self.max_entries:
+            old_key, _ = self._entries.popitem(last=False)
+            self._events[old_key[0]][1].discard(old_key)
+            self.evictions += 1
+
+
+# Singleton instance
+match_cache = MatchCache(
+    max_entries=settings.match_cache_size,
+    use_redis=settings.match_cache_redis,
+    ttl_seconds=settings.match_cache_ttl
+)
+# Entries of evicted events stay reachable through Redis, keyed by the snapshot's content key
+event_indexes.on_release(match_cache.invalidate_event)
@@ -0,0 +1,298 @@
+"""
+Sampled per-request memory profiling.
+
+Containers are sized by their peak memory, and the peak is set by a few
+requests at a time (full upload buffering, image decode, array copies, dlib
+buffers). To attribute it, a sample of requests is measured with tracemalloc:
+
+- Peak traced allocation during the request, above the traced memory at its
+  start, and the change in resident set size (RSS). dlib's C++ buffers are not
+  traced by tracemalloc but show up in RSS; when a request raises the
+  process's RSS high-water mark, the rise is attributed to it.
+- Per-stage deltas inside the detection pipeline (download, detect, encode,
+  derivatives, ...): memory retained by the stage and its peak above the
+  stage's start.
+
+Only one request is measured at a time, so peaks are not mixed between sampled
+requests; concurrent unsampled requests still allocate meanwhile, which makes
+a sampled peak an upper bound. Tracing costs CPU and memory of its own (about
+a third more time on allocation-heavy code), hence the sampling.
+"""
+
+import contextvars
+import logging
+import os
+import resource
+import threading
+import time
+import tracemalloc
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Optional
+
+import numpy as np
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Sampled requests kept for the admin endpoint
+RECENT_SAMPLES = 50
+# Peaks kept per route and stage for percentiles
+PEAK_WINDOW = 256
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+_current_sample: contextvars.ContextVar[Optional["RequestSample"]] = contextvars.ContextVar(
+    "memory_sample", default=None
+)
+
+
+def current_rss() -> Optional[int]:
+    """Resident set size of this process in bytes (None where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def peak_rss() -> int:
+    """High-water mark of this process's resident set size in bytes."""
+    # ru_maxrss is in kilobytes on Linux (bytes on macOS)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class RequestSample:
+    """Memory measurements of one sampled request."""
+    
+    def __init__(self, route: str):
+        self.route = route
+        self.started = time.time()
+        self.base, _ = tracemalloc.get_traced_memory()
+        self.peak = 0
+        self.rss_start = current_rss()
+        self.rss_peak_start = peak_rss()
+        self.stages: dict[str, dict] = {}
+        tracemalloc.reset_peak()
+    
+    def fold_peak(self):
+        """Take the traced peak since the last reset into the request peak, and reset it."""
+        _, peak = tracemalloc.get_traced_memory()
+        self.peak = max(self.peak, peak - self.base)
+        tracemalloc.reset_peak()
+
+
+class MemoryProfiler:
+    """Samples requests under tracemalloc and aggregates their peaks per route and stage."""
+    
+    def __init__(self, enabled: bool = False, sample_rate: float = 0.05, traceback_frames: int = 1):
+        """
+        Initialize MemoryProfiler.
+        
+        Args:
+            enabled: Trace allocations and sample requests
+            sample_rate: Fraction of requests measured
+            traceback_frames: Frames stored per traced allocation (more = finer
+                top-allocator tracebacks, more overhead)
+        """
+        if not 0 <= sample_rate <= 1:
+            raise ValueError("Memory profiling sample rate must be between 0 and 1")
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.traceback_frames = traceback_frames
+        self._rng = np.random.default_rng()
+        self._lock = threading.Lock()
+        self._active: Optional[RequestSample] = None
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+        
+        self.requests = 0
+        self.sampled = 0
+        self.skipped_busy = 0
+        self._routes = defaultdict(lambda: {"count": 0, "peaks": deque(maxlen=PEAK_WINDOW), "max": 0, "rss_raised": 0})
+        self._stages = defaultdict(lambda: {"count": 0, "retained": 0, "peaks": deque(maxlen=PEAK_WINDOW), "max": 0})
+        self._recent: deque[dict] = deque(maxlen=RECENT_SAMPLES)
+    
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+    
+    def start(self):
+        """Start tracing allocations (at startup, so early allocations are attributed too)."""
+        if self.enabled and not tracemalloc.is_tracing():
+            tracemalloc.start(self.traceback_frames)
+            logger.info(f"Memory profiling: tracing allocations, sampling {self.sample_rate:.0%} of requests")
+    
+    def begin_request(self, route: str) -> Optional[RequestSample]:
+        """Start measuring a request if it is sampled (and no other request is being measured)."""
+        if not self.enabled or not tracemalloc.is_tracing():
+            return None
+        with self._lock:
+            self.requests += 1
+            if self._rng.random() >= self.sample_rate:
+                return None
+            if self._active is not None:
+                self.skipped_busy += 1
+                return None
+            sample = self._active = RequestSample(route)
+        _current_sample.set(sample)
+        return sample
+    
+    def end_request(self, sample: RequestSample, route: Optional[str] = None):
+        """Finish a sampled request and record its peaks (route: the matched route template, if known)."""
+        sample.fold_peak()
+        rss_end = current_rss()
+        rss_raised = max(0, peak_rss() - sample.rss_peak_start)
+        record = {
+            "route": route or sample.route,
+            "started_at": sample.started,
+            "seconds": time.time() - sample.started,
+            "traced_peak_bytes": sample.peak,
+            "rss_delta_bytes": rss_end - sample.rss_start if rss_end is not None and sample.rss_start is not None else None,
+            "rss_peak_raised_bytes": rss_raised,
+            "stages": sample.stages
+        }
+        with self._lock:
+            self._active = None
+            self.sampled += 1
+            stats = self._routes[record["route"]]
+            stats["count"] += 1
+            stats["peaks"].append(sample.peak)
+            stats["max"] = max(stats["max"], sample.peak)
+            stats["rss_raised"] += rss_raised
+            self._recent.append(record)
+    
+    @contextmanager
+    def stage(self, name: str):
+        """Measure a pipeline stage of the sampled request in this context (no-op otherwise)."""
+        sample = _current_sample.get()
+        if sample is None or sample is not self._active:
+            yield
+            return
+        sample.fold_peak()
+        start, _ = tracemalloc.get_traced_memory()
+        try:
+            yield
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            sample.fold_peak()
+            retained, stage_peak = current - start, max(0, peak - start)
+            sample.stages[name] = {"retained_bytes": retained, "peak_bytes": stage_peak}
+            with self._lock:
+                stats = self._stages[name]
+                stats["count"] += 1
+                stats["retained"] += retained
+                stats["peaks"].append(stage_peak)
+                stats["max"] = max(stats["max"], stage_peak)
+    
+    def top_allocators(self, limit: int = 20, group_by: str = "lineno", compare: bool = False) -> dict:
+        """
+        Largest live allocations by source location, from a heap snapshot.
+        
+        Args:
+            limit: Number of entries
+            group_by: "lineno", "filename" or "traceback"
+            compare: Report the growth since the baseline snapshot instead
+        """
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("Allocation tracing is not running")
+        if compare and self._baseline is None:
+            raise RuntimeError("No baseline snapshot taken")
+        snapshot = self._filtered(tracemalloc.take_snapshot())
+        if compare:
+            statistics = snapshot.compare_to(self._baseline, group_by)
+            entries = [
+                {
+                    "location": self._format_trace(stat.traceback, group_by),
+                    "size_bytes": stat.size,
+                    "size_diff_bytes": stat.size_diff,
+                    "count": stat.count,
+                    "count_diff": stat.count_diff
+                }
+                for stat in statistics[:limit]
+            ]
+        else:
+            statistics = snapshot.statistics(group_by)
+            entries = [
+                {
+                    "location": self._format_trace(stat.traceback, group_by),
+                    "size_bytes": stat.size,
+                    "count": stat.count
+                }
+                for stat in statistics[:limit]
+            ]
+        return {
+            "group_by": group_by,
+            "compared_to_baseline": compare,
+            "traced_bytes": sum(stat.size for stat in snapshot.statistics("filename")),
+            "top": entries
+        }
+    
+    def take_baseline(self) -> int:
+        """Store a heap snapshot to compare later snapshots to. Returns its traced bytes."""
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("Allocation tracing is not running")
+        self._baseline = self._filtered(tracemalloc.take_snapshot())
+        return sum(stat.size for stat in self._baseline.statistics("filename"))
+    
+    def stats(self) -> dict:
+        traced, traced_peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+        with self._lock:
+            routes = {route: self._peak_stats(stats) for route, stats in self._routes.items()}
+            for route, stats in self._routes.items():
+                routes[route]["rss_peak_raised_bytes"] = stats["rss_raised"]
+            stages = {
+                name: {
+                    **self._peak_stats(stats),
+                    "retained_avg_bytes": stats["retained"] / stats["count"] if stats["count"] else 0.0
+                }
+                for name, stats in self._stages.items()
+            }
+            recent = list(self._recent)
+        return {
+            "enabled": self.enabled,
+            "tracing": tracemalloc.is_tracing(),
+            "sample_rate": self.sample_rate,
+            "requests": self.requests,
+            "sampled": self.sampled,
+            "skipped_busy": self.skipped_busy,
+            "traced_bytes": traced,
+            "rss_bytes": current_rss(),
+            "rss_peak_bytes": peak_rss(),
+            "routes": routes,
+            "stages": stages,
+            "recent": recent
+        }
+    
+    @staticmethod
+    def _peak_stats(stats: dict) -> dict:
+        peaks = np.array(stats["peaks"]) if stats["peaks"] else np.zeros(1)
+        return {
+            "count": stats["count"],
+            "peak_p50_bytes": float(np.percentile(peaks, 50)),
+            "peak_p95_bytes": float(np.percentile(peaks, 95)),
+            "peak_max_bytes": stats["max"]
+        }
+    
+    @staticmethod
+    def _filtered(snapshot: tracemalloc.Snapshot) -> tracemalloc.Snapshot:
+        # The profiler's own bookkeeping and import machinery are not of interest
+        return snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>")
+        ))
+    
+    @staticmethod
+    def _format_trace(traceback: tracemalloc.Traceback, group_by: str) -> str:
+        if group_by == "filename":
+            return traceback[0].filename
+        return " <- ".join(f"{frame.filename}:{frame.lineno}" for frame in traceback)
+
+
+# Singleton instance
+memory_profiler = MemoryProfiler(
+    enabled=settings.memory_profiling_enabled,
+    sample_rate=settings.memory_profiling_sample_rate,
+    traceback_frames=settings.memory_profiling_frames
+)
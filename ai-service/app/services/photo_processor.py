@@ -1,21 +1,80 @@
 from PIL import Image
 from io import BytesIO
+from typing import Optional, Union
 import logging
+import re
+
+import numpy as np
+
+from app.config import settings
+from app.services.derivative_store import create_derivative_store
+from app.services.image_tagger import ImageTagger, image_tagger
 
 logger = logging.getLogger(__name__)
 
+# Derivative format -> (Pillow format, content type, file extension)
+DERIVATIVE_FORMATS = {
+    "webp": ("WEBP", "image/webp", "webp"),
+    "jpeg": ("JPEG", "image/jpeg", "jpg"),
+    "png": ("PNG", "image/png", "png")
+}
+
+# Event and photo ids become storage key segments
+_SAFE_ID = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+
 class PhotoProcessor:
-    def __init__(self):
-        pass
+    def __init__(
+        self,
+        derivative_sizes: Optional[list[int]] = None,
+        derivative_format: str = "webp",
+        derivative_quality: int = 80,
+        face_crop_size: int = 160,
+        face_crop_margin: float = 0.3,
+        store_backend: str = "local",
+        tagger: Optional[ImageTagger] = None
+    ):
+        """
+        Initialize PhotoProcessor.
+        
+        Args:
+            derivative_sizes: Thumbnail sizes as the longest side in pixels
+            derivative_format: "webp" or "jpeg"
+            derivative_quality: Encoder quality (1-100)
+            face_crop_size: Side of the square face crops in pixels
+            face_crop_margin: Context around a face box, as a fraction of its size
+            store_backend: Derivative store, "local" or "s3" (created on first use)
+            tagger: Image statistics and tagging engine (default: the configured one)
+        """
+        if derivative_format not in DERIVATIVE_FORMATS:
+            raise ValueError(
+                f"Unsupported derivative format '{derivative_format}'. "
+                f"Supported: {', '.join(DERIVATIVE_FORMATS)}"
+            )
+        self.derivative_sizes = sorted(derivative_sizes or [320, 1024, 2048], reverse=True)
+        self.derivative_format = derivative_format
+        self.derivative_quality = derivative_quality
+        self.face_crop_size = face_crop_size
+        self.face_crop_margin = face_crop_margin
+        self.store_backend = store_backend
+        self.tagger = tagger or image_tagger
+        self._store = None
     
-    def analyze_photo(self, image_data: bytes) -> dict:
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = create_derivative_store(self.store_backend)
+        return self._store
+    
+    def analyze_photo(self, image_data: Union[bytes, Image.Image]) -> dict:
         """
-        Analyze photo and extract metadata.
-        This is a placeholder for actual AI processing.
+        Analyze photo and extract metadata, image statistics and tags.
+        Accepts raw image bytes or an image already decoded by the upload layer;
+        bytes are only decoded at the reduced scale the statistics need.
         """
         try:
-            image = Image.open(BytesIO(image_data))
+            image = image_data if isinstance(image_data, Image.Image) else Image.open(BytesIO(image_data))
             
+            # Read before analysis: a lazily opened JPEG is decoded at reduced size
             metadata = {
                 "width": image.width,
                 "height": image.height,
@@ -23,17 +82,135 @@ class PhotoProcessor:
                 "mode": image.mode,
                 "tags": self._generate_tags(image)
             }
+            statistics, tags = self.tagger.analyze(image)
+            metadata["tags"].extend(tags)
+            metadata["statistics"] = statistics
             
-            logger.info(f"Photo analyzed: {metadata}")
+            logger.info(f"Photo analyzed: {image.format} {metadata['width']}x{metadata['height']}, tags {metadata['tags']}")
             return metadata
         except Exception as e:
             logger.error(f"Error analyzing photo: {e}")
             raise
     
+    def generate_derivatives(
+        self,
+        image_data: Union[bytes, Image.Image, np.ndarray],
+        photo_id: str,
+        event_id: Optional[str] = None,
+        faces: Optional[list[dict]] = None
+    ) -> dict:
+        """
+        Write thumbnails and face crops of a photo to the derivative store.
+        
+        An image already decoded for face detection (RGB array or PIL image) is
+        reused as is; every size is produced from the previous one with an
+        integer box reduce before the final resample. Encoded bytes are opened
+        with reduce-on-decode, so a JPEG is only decoded at the scale of the
+        largest derivative.
+        
+        Args:
+            image_data: Decoded image or encoded image bytes
+            photo_id: Photo id (storage key segment)
+            event_id: Optional event id (storage key segment)
+            faces: Detected faces with fractional bounding_box entries
+        
+        Returns:
+            dict with thumbnails ({size: location}) and faces ([{index, location}])
+        """
+        prefix = self.derivative_prefix(photo_id, event_id)
+        if isinstance(image_data, np.ndarray):
+            image = Image.fromarray(image_data)
+        elif isinstance(image_data, Image.Image):
+            image = image_data
+        else:
+            image = self._open_reduced(image_data, self.derivative_sizes[0])
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        
+        _, _, extension = DERIVATIVE_FORMATS[self.derivative_format]
+        thumbnails = {}
+        thumbnail = image
+        for size in self.derivative_sizes:
+            thumbnail = self._fit(thumbnail, size)
+            thumbnails[str(size)] = self._put(f"{prefix}/{size}.{extension}", thumbnail)
+        
+        crops = [
+            {
+                "index": face["index"],
+                "location": self._put(
+                    f"{prefix}/faces/{face['index']}.{extension}",
+                    self._face_crop(image, face["bounding_box"])
+                )
+            }
+            for face in faces or []
+        ]
+        
+        return {"thumbnails": thumbnails, "faces": crops}
+    
+    @staticmethod
+    def derivative_prefix(photo_id: str, event_id: Optional[str] = None) -> str:
+        """Storage key prefix of a photo's derivatives. Rejects ids unsafe as key segments."""
+        for value in (photo_id, event_id):
+            if value is not None and not _SAFE_ID.match(value):
+                raise ValueError(f"Invalid id for derivative storage: '{value}'")
+        if event_id is None:
+            return f"photos/{photo_id}"
+        return f"events/{event_id}/photos/{photo_id}"
+    
+    @staticmethod
+    def event_prefix(event_id: str) -> str:
+        """Storage key prefix below which all photos of an event keep their derivatives."""
+        if not _SAFE_ID.match(event_id):
+            raise ValueError(f"Invalid id for derivative storage: '{event_id}'")
+        return f"events/{event_id}/photos"
+    
+    @staticmethod
+    def _open_reduced(image_data: bytes, max_side: int) -> Image.Image:
+        """Open encoded bytes, letting the JPEG decoder downscale towards max_side."""
+        image = Image.open(BytesIO(image_data))
+        scale = max_side / max(image.size)
+        if scale < 1:
+            # draft() picks the largest DCT scale (1/2, 1/4, 1/8) still >= the requested size
+            image.draft("RGB", (int(image.width * scale), int(image.height * scale)))
+        return image
+    
+    @staticmethod
+    def _fit(image: Image.Image, max_side: int) -> Image.Image:
+        """Downscale so the longest side is at most max_side (never upscales)."""
+        scale = max_side / max(image.size)
+        if scale >= 1:
+            return image
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        # reducing_gap: box-reduce by an integer factor first, then resample the rest
+        return image.resize(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+    
+    def _face_crop(self, image: Image.Image, box: dict) -> Image.Image:
+        """Square crop around a face box with margin, resized to face_crop_size."""
+        width, height = image.size
+        top, bottom = box["top"] * height, box["bottom"] * height
+        left, right = box["left"] * width, box["right"] * width
+        side = max(bottom - top, right - left) * (1 + 2 * self.face_crop_margin)
+        side = min(side, width, height)
+        center_x, center_y = (left + right) / 2, (top + bottom) / 2
+        x0 = min(max(0, center_x - side / 2), width - side)
+        y0 = min(max(0, center_y - side / 2), height - side)
+        return image.resize(
+            (self.face_crop_size, self.face_crop_size),
+            Image.Resampling.LANCZOS,
+            box=(x0, y0, x0 + side, y0 + side),
+            reducing_gap=2.0
+        )
+    
+    def _put(self, key: str, image: Image.Image) -> str:
+        pillow_format, content_type, _ = DERIVATIVE_FORMATS[self.derivative_format]
+        buffer = BytesIO()
+        image.save(buffer, format=pillow_format, quality=self.derivative_quality)
+        return self.store.put(key, buffer.getvalue(), content_type)
+    
     def _generate_tags(self, image: Image.Image) -> list[str]:
         """
-        Generate tags based on image analysis.
-        This is a simple placeholder - in production, you'd use ML models.
+        Tags from the image header: orientation, colour mode and resolution.
+        Content tags (exposure, colour, sharpness, day/night) come from the tagger.
         """
         tags = []
         
@@ -60,4 +237,11 @@ class PhotoProcessor:
         
         return tags
 
-photo_processor = PhotoProcessor()
+photo_processor = PhotoProcessor(
+    derivative_sizes=settings.derivative_sizes,
+    derivative_format=settings.derivative_format,
+    derivative_quality=settings.derivative_quality,
+    face_crop_size=settings.face_crop_size,
+    face_crop_margin=settings.face_crop_margin,
+    store_backend=settings.derivative_store
+)
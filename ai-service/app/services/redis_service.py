@@ -1,3 +1,6 @@
+import json
+import time
+from typing import Optional
 import redis
 from app.config import settings
 import logging
@@ -6,25 +9,55 @@ logger = logging.getLogger(__name__)
 
 class RedisService:
     def __init__(self):
+        # The connection is opened lazily (or by the app lifespan) so importing
+        # this module never blocks or fails when Redis is briefly unavailable.
         self.client = None
-        self.connect()
+        # Second client without response decoding, for binary payloads (streams)
+        self.binary_client = None
+        self._last_connect_attempt = 0.0
     
-    def connect(self):
+    def connect(self) -> bool:
+        self._last_connect_attempt = time.monotonic()
         try:
-            self.client = redis.Redis(
+            client = redis.Redis(
                 host=settings.redis_host,
                 port=settings.redis_port,
                 db=settings.redis_db,
-                decode_responses=True
+                decode_responses=True,
+                socket_connect_timeout=settings.redis_connect_timeout
             )
-            self.client.ping()
+            client.ping()
+            self.client = client
             logger.info("Connected to Redis successfully")
+            return True
         except Exception as e:
             logger.error(f"Failed to connect to Redis: {e}")
             self.client = None
+            return False
+    
+    def _ensure_client(self) -> bool:
+        """Connect on first use, retrying at most once per reconnect interval."""
+        if self.client is not None:
+            return True
+        if time.monotonic() - self._last_connect_attempt < settings.redis_reconnect_interval:
+            return False
+        return self.connect()
+    
+    def get_binary_client(self) -> Optional[redis.Redis]:
+        """Client that returns raw bytes, or None if Redis is unavailable."""
+        if not self._ensure_client():
+            return None
+        if self.binary_client is None:
+            self.binary_client = redis.Redis(
+                host=settings.redis_host,
+                port=settings.redis_port,
+                db=settings.redis_db,
+                socket_connect_timeout=settings.redis_connect_timeout
+            )
+        return self.binary_client
     
     def is_connected(self) -> bool:
-        if self.client is None:
+        if not self._ensure_client():
             return False
         try:
             self.client.ping()
@@ -46,11 +79,43 @@ class RedisService:
         try:
             job_json = self.client.lpop("snapory:photo-processing-queue")
             if job_json:
-                import json
                 return json.loads(job_json)
             return None
         except Exception as e:
             logger.error(f"Error dequeuing job: {e}")
             return None
+    
+    def publish(self, channel: str, message: dict) -> bool:
+        """Publish a JSON message on a pub/sub channel. Returns False if Redis is unavailable."""
+        if not self._ensure_client():
+            return False
+        try:
+            self.client.publish(channel, json.dumps(message))
+            return True
+        except Exception as e:
+            logger.error(f"Error publishing to {channel}: {e}")
+            return False
+    
+    def get_json(self, key: str):
+        """Read a JSON value. Returns None if missing or Redis is unavailable."""
+        if not self._ensure_client():
+            return None
+        try:
+            value = self.client.get(key)
+            return json.loads(value) if value is not None else None
+        except Exception as e:
+            logger.error(f"Error reading {key}: {e}")
+            return None
+    
+    def set_json(self, key: str, value, ttl_seconds: int) -> bool:
+        """Store a JSON value with an expiry. Returns False if Redis is unavailable."""
+        if not self._ensure_client():
+            return False
+        try:
+            self.client.set(key, json.dumps(value), ex=ttl_seconds)
+            return True
+        except Exception as e:
+            logger.error(f"Error writing {key}: {e}")
+            return False
 
 redis_service = RedisService()
@@ -0,0 +1,280 @@
+"""
+Bulk re-encoding of an event's faces from their stored chips.
+
+After a change of encoding model or parameters (e.g. num_jitters), every
+encoding of an event has to be recomputed. Instead of downloading and
+re-detecting the photos, a re-encode job reads the aligned chips written at
+detection time (see face_chips) and encodes them again:
+
+1. The chip manifests of the event are listed in the derivative store and
+   split into batches of photos.
+2. Batches are encoded in parallel by a pool of worker processes, each one
+   decoding the chip grids of its photos and encoding all their chips in one
+   batched encoder call (the service process only fetches the objects).
+3. The new encodings replace the old ones in place in the event index (same
+   face ids, "{photo_id}:{index}"), are matched against the event's guests like
+   fresh faces, invalidate the event's cached match results and, when result
+   streaming is enabled, are published
+   to the event's detection stream like fresh detections, so the backend can
+   update its stored encodings.
+
+Jobs run in the background; their progress is kept in memory for polling.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone
+from typing import Optional
+
+import numpy as np
+
+from app.config import settings
+from app.services.face_chips import FaceChipStore, encode_chips, face_chip_store
+from app.services.incremental_matcher import incremental_matcher
+from app.services.match_cache import match_cache
+from app.services.result_stream import result_stream
+
+logger = logging.getLogger(__name__)
+
+# Finished jobs kept for polling (oldest are forgotten first)
+MAX_FINISHED_JOBS = 100
+
+
+def _encode_batch(items: list[tuple[dict, bytes]], num_jitters: int) -> list[np.ndarray]:
+    """Worker: (faces, 128) encodings of each photo's chip grid, encoded in one call."""
+    chips_per_photo = [FaceChipStore.load_chips(manifest, grid_data) for manifest, grid_data in items]
+    encodings = encode_chips([chip for chips in chips_per_photo for chip in chips], num_jitters)
+    bounds = np.cumsum([0] + [len(chips) for chips in chips_per_photo])
+    return [encodings[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+class ReencodeJob:
+    """Progress of one event's re-encoding."""
+    
+    def __init__(self, event_id: str, num_jitters: int):
+        self.job_id = uuid.uuid4().hex
+        self.event_id = event_id
+        self.num_jitters = num_jitters
+        self.status = "pending"
+        self.error: Optional[str] = None
+        self.created_at = datetime.now(timezone.utc)
+        self.finished_at: Optional[datetime] = None
+        
+        self.photos_total = 0
+        self.photos_done = 0
+        self.photos_failed = 0
+        self.faces = 0
+        self.seconds = 0.0
+    
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed")
+    
+    def as_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "event_id": self.event_id,
+            "num_jitters": self.num_jitters,
+            "status": self.status,
+            "error": self.error,
+            "photos_total": self.photos_total,
+            "photos_done": self.photos_done,
+            "photos_failed": self.photos_failed,
+            "faces": self.faces,
+            "seconds": self.seconds,
+            "created_at": self.created_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None
+        }
+
+
+class Reencoder:
+    """Runs re-encode jobs over the stored face chips of events."""
+    
+    def __init__(self, chip_store: FaceChipStore, workers: int = 2, batch_size: int = 64):
+        """
+        Initialize Reencoder.
+        
+        Args:
+            chip_store: Store the chips were written to at detection time
+            workers: Worker processes encoding batches (0 encodes in a thread of the service)
+            batch_size: Photos per batch handed to a worker
+        """
+        if batch_size < 1:
+            raise ValueError("Re-encode batch size must be at least 1")
+        self.chip_store = chip_store
+        self.workers = workers
+        self.batch_size = batch_size
+        self._jobs: dict[str, ReencodeJob] = {}
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        
+        self.jobs_completed = 0
+        self.jobs_failed = 0
+        self.faces = 0
+    
+    def start(self, event_id: str, num_jitters: int = 1) -> ReencodeJob:
+        """Start re-encoding an event in the background (must be called from the event loop)."""
+        job = ReencodeJob(event_id, num_jitters)
+        self._jobs[job.job_id] = job
+        self._forget_finished()
+        task = asyncio.ensure_future(self._run(job))
+        self._tasks[job.job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job.job_id, None))
+        return job
+    
+    def get(self, job_id: str) -> Optional[ReencodeJob]:
+        return self._jobs.get(job_id)
+    
+    def close(self):
+        """Stop the worker processes."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+    
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "batch_size": self.batch_size,
+            "running": self._executor is not None,
+            "jobs_running": len(self._tasks),
+            "jobs_completed": self.jobs_completed,
+            "jobs_failed": self.jobs_failed,
+            "faces": self.faces
+        }
+    
+    async def _run(self, job: ReencodeJob):
+        started = time.perf_counter()
+        job.status = "running"
+        try:
+            keys = await asyncio.to_thread(self.chip_store.manifest_keys, job.event_id)
+            job.photos_total = len(keys)
+            batches = [keys[i:i + self.batch_size] for i in range(0, len(keys), self.batch_size)]
+            
+            # Keep every worker busy, with one batch per worker loading meanwhile
+            semaphore = asyncio.Semaphore(max(1, self.workers) * 2)
+            
+            async def run_batch(batch: list[str]):
+                async with semaphore:
+                    await self._run_batch(job, batch)
+            
+            await asyncio.gather(*(run_batch(batch) for batch in batches))
+            job.status = "completed"
+            self.jobs_completed += 1
+        except Exception as e:
+            logger.error(f"Re-encoding of event {job.event_id} failed: {e}")
+            job.status = "failed"
+            job.error = str(e)
+            self.jobs_failed += 1
+        finally:
+            job.seconds = time.perf_counter() - started
+            job.finished_at = datetime.now(timezone.utc)
+        logger.info(
+            f"Re-encode job {job.job_id} {job.status}: {job.faces} face(s) of "
+            f"{job.photos_done}/{job.photos_total} photo(s) of event {job.event_id} in {job.seconds:.1f}s"
+        )
+    
+    async def _run_batch(self, job: ReencodeJob, keys: list[str]):
+        items = await asyncio.to_thread(self._load_batch, job, keys)
+        if not items:
+            return
+        started = time.perf_counter()
+        encodings = None
+        if self.workers > 0:
+            executor = self._get_executor()
+            try:
+                encodings = await asyncio.wrap_future(executor.submit(_encode_batch, items, job.num_jitters))
+            except BrokenProcessPool as e:
+                # A worker died (e.g. out of memory); restart the pool for the next batch
+                logger.error(f"Re-encode worker pool failed, encoding in process: {e}")
+                self._reset_executor(executor)
+        if encodings is None:
+            encodings = await asyncio.to_thread(_encode_batch, items, job.num_jitters)
+        timings = {"reencode_ms": (time.perf_counter() - started) * 1000}
+        await asyncio.to_thread(self._apply_batch, job, items, encodings, timings)
+    
+    def _load_batch(self, job: ReencodeJob, keys: list[str]) -> list[tuple[dict, bytes]]:
+        """Manifests and chip grids of a batch; unreadable photos are counted as failed."""
+        items = []
+        for key in keys:
+            try:
+                manifest = self.chip_store.load_manifest(key)
+                items.append((manifest, self.chip_store.store.get(manifest["grid"])))
+            except Exception as e:
+                logger.error(f"Cannot read face chips {key}: {e}")
+                job.photos_failed += 1
+        return items
+    
+    def _apply_batch(
+        self,
+        job: ReencodeJob,
+        items: list[tuple[dict, bytes]],
+        encodings: list[np.ndarray],
+        timings: dict
+    ):
+        """Replace the faces of a batch in the event index and publish the new encodings."""
+        faces = []
+        for (manifest, _), photo_encodings in zip(items, encodings):
+            photo_id = manifest["photo_id"]
+            photo_faces = [
+                {
+                    "index": face["index"],
+                    "encoding": encoding,
+                    "bounding_box": face["bounding_box"]
+                }
+                for face, encoding in zip(manifest["faces"], photo_encodings)
+            ]
+            faces.extend(
+                {"photo_id": photo_id, "face_id": f"{photo_id}:{face['index']}", "encoding": face["encoding"]}
+                for face in photo_faces
+            )
+            if result_stream.enabled:
+                result_stream.publish(job.event_id, photo_id, {
+                    "face_count": len(photo_faces),
+                    "faces": photo_faces,
+                    "timings": timings
+                })
+        
+        # In place, so matches running meanwhile never see the photos' faces missing
+        incremental_matcher.replace_faces(job.event_id, faces)
+        match_cache.invalidate_event(job.event_id)
+        job.photos_done += len(items)
+        job.faces += len(faces)
+        self.faces += len(faces)
+    
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+    
+    def _reset_executor(self, executor: ProcessPoolExecutor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+    
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn, as for sharded matching: the service process runs threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+                logger.info(f"Started {self.workers} re-encode worker process(es)")
+            return self._executor
+
+
+# Singleton instance
+reencoder = Reencoder(
+    chip_store=face_chip_store,
+    workers=settings.reencode_workers,
+    batch_size=settings.reencode_batch_size
+)
@@ -0,0 +1,128 @@
+"""
+Detection result stream for Snapory.
+
+Instead of holding an HTTP connection open for every photo and polling its
+database for the outcome, the backend worker can submit photos fire-and-forget
+and read the detection results from a Redis Stream per event, in batches, with
+XREADGROUP (several workers share a consumer group, each entry is delivered to
+one of them and acknowledged with XACK).
+
+Each stream entry carries the photo's faces in binary form:
+
+- encodings: face_count x 128 little-endian float32 (512 bytes per face)
+- boxes: face_count x 4 little-endian float32 (top, right, bottom, left as
+  fractions of the image size)
+- timings: JSON object of stage durations in milliseconds
+- derivatives: JSON object of thumbnail and face crop locations, when generated
+
+Streams are capped (approximately) at result_stream_maxlen entries per event.
+"""
+
+import json
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Optional
+
+import numpy as np
+
+from app.config import settings
+from app.services.encodings import ENCODING_DIM
+from app.services.redis_service import redis_service
+
+logger = logging.getLogger(__name__)
+
+STREAM_KEY = "snapory:detections:{event_id}"
+
+ENCODING_WIRE_DTYPE = np.dtype("<f4")
+BOX_FIELDS = ("top", "right", "bottom", "left")
+
+
+def encode_entry(event_id: str, photo_id: str, result: dict) -> dict[str, bytes]:
+    """Build the stream entry fields of one photo's detection result."""
+    faces = result.get("faces", [])
+    encodings = np.empty((len(faces), ENCODING_DIM), dtype=ENCODING_WIRE_DTYPE)
+    boxes = np.empty((len(faces), len(BOX_FIELDS)), dtype=ENCODING_WIRE_DTYPE)
+    for row, face in enumerate(faces):
+        encodings[row] = face["encoding"]
+        boxes[row] = [face["bounding_box"][field] for field in BOX_FIELDS]
+    
+    return {
+        "event_id": event_id.encode(),
+        "photo_id": photo_id.encode(),
+        "face_count": str(len(faces)).encode(),
+        "encodings": encodings.tobytes(),
+        "boxes": boxes.tobytes(),
+        "encoding_dtype": ENCODING_WIRE_DTYPE.str.encode(),
+        "timings": json.dumps(result.get("timings", {})).encode(),
+        "error": (result.get("error") or "").encode(),
+        "derivatives": json.dumps(result.get("derivatives")).encode(),
+        "detected_at": datetime.now(timezone.utc).isoformat().encode()
+    }
+
+
+class ResultStream:
+    """Publishes detection results to per-event Redis Streams."""
+    
+    def __init__(self, enabled: bool = False, maxlen: int = 10000):
+        """
+        Initialize ResultStream.
+        
+        Args:
+            enabled: Publish detection results of event photos
+            maxlen: Approximate maximum number of entries kept per event stream
+        """
+        self.enabled = enabled
+        self.maxlen = maxlen
+        self._lock = threading.Lock()
+        
+        self.published = 0
+        self.failures = 0
+        self.bytes_published = 0
+    
+    @staticmethod
+    def stream_key(event_id: str) -> str:
+        return STREAM_KEY.format(event_id=event_id)
+    
+    def publish(self, event_id: str, photo_id: str, result: dict) -> Optional[str]:
+        """
+        Append a photo's detection result to the event's stream.
+        
+        Returns:
+            The stream entry id, or None if Redis is unavailable
+        """
+        fields = encode_entry(event_id, photo_id, result)
+        client = redis_service.get_binary_client()
+        if client is None:
+            with self._lock:
+                self.failures += 1
+            logger.error(f"Redis unavailable, dropped detection result of photo {photo_id}")
+            return None
+        try:
+            entry_id = client.xadd(self.stream_key(event_id), fields, maxlen=self.maxlen, approximate=True)
+        except Exception as e:
+            with self._lock:
+                self.failures += 1
+            logger.error(f"Error publishing detection result of photo {photo_id}: {e}")
+            return None
+        
+        with self._lock:
+            self.published += 1
+            self.bytes_published += sum(len(value) for value in fields.values())
+        return entry_id.decode()
+    
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "maxlen": self.maxlen,
+            "published": self.published,
+            "failures": self.failures,
+            "bytes_published": self.bytes_published
+        }
+
+
+# Singleton instance
+result_stream = ResultStream(
+    enabled=settings.result_stream_enabled,
+    maxlen=settings.result_stream_maxlen
+)
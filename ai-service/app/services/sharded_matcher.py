@@ -0,0 +1,333 @@
+"""
+Sharded event matching across local worker processes.
+
+A single process scanning a giant event is limited to one core and its share
+of memory bandwidth. For events above a size threshold, the encodings are
+published once into POSIX shared memory and the scan fans out over a pool of
+worker processes, each searching a contiguous row range of the same segment
+(no per-query copies). Each shard returns its hits under the threshold
+(optionally only its top k) and the parent merges them by distance.
+
+The shared snapshot grows like the index buffer: appended faces are copied
+incrementally, and only a removal (row compaction) or re-encoding (both bump
+the index epoch) rewrites it. Searches hold the index lock only while syncing
+the snapshot, not while the shards run: a snapshot that must be rewritten or
+grown while searches are reading it is replaced by a new segment, and the old
+one is released by its last reader. Snapshots are released when the event's
+index is evicted or dropped.
+"""
+
+import logging
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Optional
+
+import numpy as np
+
+from app.config import settings
+from app.services.blas import THREADPOOLCTL_AVAILABLE, limit_blas_threads
+from app.services.encodings import ENCODING_DIM, encoding_codec
+from app.services.event_index import EventFaceIndex, event_indexes
+
+logger = logging.getLogger(__name__)
+
+# Segments a worker keeps attached; older ones belong to replaced snapshots
+_MAX_ATTACHED = 8
+
+_attached: OrderedDict[str, tuple[shared_memory.SharedMemory, np.ndarray]] = OrderedDict()
+
+
+def _attach(name: str, capacity: int, dtype: str) -> np.ndarray:
+    """Map a snapshot segment in a worker process, reusing earlier attachments."""
+    entry = _attached.get(name)
+    if entry is None:
+        # Spawned workers share the parent's resource tracker, so attaching does
+        # not hand ownership over: the parent alone unlinks the segment
+        segment = shared_memory.SharedMemory(name=name)
+        matrix = np.ndarray((capacity, ENCODING_DIM), dtype=dtype, buffer=segment.buf)
+        entry = _attached[name] = (segment, matrix)
+        while len(_attached) > _MAX_ATTACHED:
+            _, (old_segment, _) = _attached.popitem(last=False)
+            old_segment.close()
+    else:
+        _attached.move_to_end(name)
+    return entry[1]
+
+
+def _init_worker():
+    """Worker: one BLAS thread, since the pool already spans the cores."""
+    if THREADPOOLCTL_AVAILABLE:
+        limit_blas_threads(1)
+
+
+def _search_shard(
+    name: str,
+    capacity: int,
+    dtype: str,
+    start: int,
+    end: int,
+    queries: np.ndarray,
+    threshold: float,
+    top_k: Optional[int]
+) -> tuple[np.ndarray, np.ndarray]:
+    """Worker: hits of rows [start, end) within the threshold, as (rows, distances)."""
+    matrix = _attach(name, capacity, dtype)[start:end]
+    distances = encoding_codec.min_distances(matrix, queries)
+    hits = np.flatnonzero(distances <= threshold)
+    if top_k is not None and len(hits) > top_k:
+        hits = hits[np.argpartition(distances[hits], top_k - 1)[:top_k]]
+    return hits + start, distances[hits]
+
+
+class _Snapshot:
+    """Copy of one event's encodings in a shared memory segment."""
+    
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.segment = shared_memory.SharedMemory(
+            create=True, size=max(1, capacity * encoding_codec.bytes_per_face)
+        )
+        self.matrix = np.ndarray((capacity, ENCODING_DIM), dtype=encoding_codec.dtype, buffer=self.segment.buf)
+        self.size = 0
+        self.version = -1
+        self.epoch = -1
+        # Searches reading the segment, and whether it was replaced or dropped;
+        # guarded by the matcher's lock
+        self.readers = 0
+        self.retired = False
+    
+    @property
+    def name(self) -> str:
+        return self.segment.name
+    
+    def release(self):
+        self.matrix = None
+        self.segment.close()
+        self.segment.unlink()
+
+
+class ShardedMatcher:
+    """Fans event scans out over worker processes sharing the event's encodings."""
+    
+    def __init__(self, workers: int = 0, min_faces: int = 250000):
+        """
+        Initialize ShardedMatcher.
+        
+        Args:
+            workers: Number of worker processes (0 disables sharded matching)
+            min_faces: Events with fewer faces are scanned in process
+        """
+        self.workers = workers
+        self.min_faces = min_faces
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._snapshots: dict[str, _Snapshot] = {}
+        self._lock = threading.Lock()
+    
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+    
+    def should_shard(self, index: EventFaceIndex) -> bool:
+        return self.enabled and len(index) >= self.min_faces
+    
+    def search(
+        self,
+        index: EventFaceIndex,
+        queries: np.ndarray,
+        threshold: float,
+        top_k: Optional[int] = None
+    ) -> dict:
+        """
+        Search an event index across the worker processes.
+        
+        Args:
+            index: Event face index
+            queries: (128,) or (k, 128) compact query encodings
+            threshold: Maximum Euclidean distance for a match
+            top_k: Only return the k closest matches
+        
+        Returns:
+            Dict with rows and distances of the matching faces, closest first
+            (like EventFaceIndex.search()), their face_ids and photo_ids,
+            faces_compared and the index content_key, all as of the snapshot
+            searched (the index may change while the shards run)
+        """
+        queries = np.atleast_2d(queries)
+        with index.lock:
+            if index.evicted:
+                # Its snapshot was released; do not publish a new one
+                return self._search_in_process(index, queries, threshold, top_k)
+            snapshot = self._sync_snapshot(index)
+            size = snapshot.size
+            face_ids, photo_ids = index.face_ids, index.photo_ids
+            content_key = index.content_key
+        
+        try:
+            executor = self._get_executor()
+            bounds = np.linspace(0, size, min(self.workers, max(1, size)) + 1).astype(int)
+            try:
+                futures = [
+                    executor.submit(
+                        _search_shard, snapshot.name, snapshot.capacity, encoding_codec.dtype_name,
+                        int(start), int(end), queries, threshold, top_k
+                    )
+                    for start, end in zip(bounds[:-1], bounds[1:])
+                ]
+                # Without the index lock: appended rows land beyond size, and a
+                # rewrite goes to a new segment while this search holds the snapshot
+                results = [f.result() for f in futures]
+            except BrokenProcessPool as e:
+                # A worker died; restart the pool on the next query and answer this one in process
+                logger.error(f"Sharded matching worker pool failed, scanning in process: {e}")
+                self._reset_executor(executor)
+                return self._search_in_process(index, queries, threshold, top_k)
+        finally:
+            self._unpin(snapshot)
+        
+        rows = np.concatenate([r for r, _ in results])
+        distances = np.concatenate([d for _, d in results])
+        order = np.argsort(distances, kind="stable")
+        if top_k is not None:
+            order = order[:top_k]
+        # The id lists are replaced (not modified) when rows shift, so they
+        # still describe the snapshot's rows
+        return self._result(rows[order], distances[order], face_ids, photo_ids, size, content_key)
+    
+    def drop(self, event_id: str):
+        """Release the shared snapshot of an event (once no search is reading it)."""
+        with self._lock:
+            snapshot = self._snapshots.pop(event_id, None)
+            if snapshot is None:
+                return
+            snapshot.retired = True
+            release = snapshot.readers == 0
+        if release:
+            snapshot.release()
+    
+    def close(self):
+        """Stop the worker processes and release all shared memory."""
+        with self._lock:
+            snapshots = list(self._snapshots.values())
+            self._snapshots.clear()
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+        for snapshot in snapshots:
+            snapshot.release()
+    
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "min_faces": self.min_faces,
+            "running": self._executor is not None,
+            "events": {
+                event_id: {"faces": s.size, "capacity": s.capacity, "bytes": s.segment.size, "readers": s.readers}
+                for event_id, s in self._snapshots.items()
+            }
+        }
+    
+    def _sync_snapshot(self, index: EventFaceIndex) -> _Snapshot:
+        """
+        Bring the event's shared snapshot up to date and hold it for a search
+        (release it with _unpin()). Caller holds index.lock.
+        """
+        with self._lock:
+            snapshot = self._snapshots.get(index.event_id)
+            if snapshot is not None:
+                snapshot.readers += 1
+        if snapshot is not None and snapshot.version == index.version:
+            return snapshot
+        
+        size = len(index)
+        rewrite = snapshot is not None and snapshot.epoch != index.epoch
+        if snapshot is None or size > snapshot.capacity or (rewrite and snapshot.readers > 1):
+            # Reallocate with headroom so later appends are copied incrementally;
+            # searches still reading the old segment keep it until they finish
+            replacement = _Snapshot(max(size, 2 * (snapshot.capacity if snapshot else 0), 1024))
+            replacement.readers = 1
+            with self._lock:
+                self._snapshots[index.event_id] = replacement
+            if snapshot is not None:
+                self._unpin(snapshot, retire=True)
+            snapshot = replacement
+        elif rewrite:
+            # Rows shifted or were re-encoded, and no other search is reading:
+            # rewrite in place
+            snapshot.size = 0
+        
+        snapshot.matrix[snapshot.size:size] = index.matrix[snapshot.size:size]
+        snapshot.epoch = index.epoch
+        snapshot.size = size
+        snapshot.version = index.version
+        return snapshot
+    
+    def _unpin(self, snapshot: _Snapshot, retire: bool = False):
+        """End a search's hold on a snapshot; retired snapshots are released by their last reader."""
+        with self._lock:
+            snapshot.readers -= 1
+            snapshot.retired = snapshot.retired or retire
+            release = snapshot.retired and snapshot.readers == 0
+        if release:
+            snapshot.release()
+    
+    def _search_in_process(
+        self,
+        index: EventFaceIndex,
+        queries: np.ndarray,
+        threshold: float,
+        top_k: Optional[int]
+    ) -> dict:
+        with index.lock:
+            rows, distances = index.search(queries, threshold)
+            return self._result(
+                rows[:top_k], distances[:top_k], index.face_ids, index.photo_ids, len(index), index.content_key
+            )
+    
+    @staticmethod
+    def _result(
+        rows: np.ndarray,
+        distances: np.ndarray,
+        face_ids: list[str],
+        photo_ids: list[str],
+        faces_compared: int,
+        content_key: tuple[int, int]
+    ) -> dict:
+        return {
+            "rows": rows,
+            "distances": distances,
+            "face_ids": [face_ids[row] for row in rows.tolist()],
+            "photo_ids": [photo_ids[row] for row in rows.tolist()],
+            "faces_compared": faces_compared,
+            "content_key": content_key
+        }
+    
+    def _reset_executor(self, executor: ProcessPoolExecutor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+    
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn: forking a process that runs threads (the event loop's
+                # thread pool, Redis clients) is unsafe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker
+                )
+                logger.info(f"Started {self.workers} sharded matching worker process(es)")
+            return self._executor
+
+
+# Singleton instance
+sharded_matcher = ShardedMatcher(
+    workers=settings.sharded_match_workers,
+    min_faces=settings.sharded_match_min_faces
+)
+event_indexes.on_release(sharded_matcher.drop)
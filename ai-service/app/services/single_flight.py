@@ -0,0 +1,131 @@
+"""
+Single-flight coalescing of concurrent identical requests.
+
+The backend worker retries detection on timeouts and guests double-tap the
+selfie button, so the same image is often detected several times at once.
+Calls are keyed by operation and by a normalised URL (or a hash of uploaded
+content): the first call runs the computation, and identical calls arriving
+while it is in flight wait for it and receive the same result instead of
+running dlib again. Nothing is cached once the computation finishes.
+
+Each caller receives its own shallow copy of a dict result (nested dicts such
+as timings are copied too), so callers may add or pop keys freely. Arrays and
+face lists are shared and must not be modified in place.
+"""
+
+import asyncio
+import hashlib
+import logging
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Hashable
+from urllib.parse import urlsplit, urlunsplit
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(url: str) -> str:
+    """
+    Canonical form of an image URL for coalescing.
+    
+    Lowercases the scheme and host, drops default ports and the fragment, and
+    keeps the path and query as they are (query order matters to signed URLs).
+    Unparseable URLs are returned unchanged.
+    """
+    try:
+        parts = urlsplit(url.strip())
+        scheme = parts.scheme.lower()
+        host = (parts.hostname or "").lower()
+        if ":" in host:
+            host = f"[{host}]"
+        port = parts.port
+    except ValueError:
+        return url
+    netloc = host if port is None or DEFAULT_PORTS.get(scheme) == port else f"{host}:{port}"
+    if parts.username is not None:
+        userinfo = parts.username if parts.password is None else f"{parts.username}:{parts.password}"
+        netloc = f"{userinfo}@{netloc}"
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, ""))
+
+
+def content_key(data: bytes) -> str:
+    """Hash of uploaded image bytes, for coalescing identical uploads."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _detach(result: Any) -> Any:
+    """Per-caller copy of a shared result (see module docstring)."""
+    if not isinstance(result, dict):
+        return result
+    return {key: dict(value) if isinstance(value, dict) else value for key, value in result.items()}
+
+
+class SingleFlight:
+    """Shares one in-flight computation between concurrent callers with the same key."""
+    
+    def __init__(self, enabled: bool = True):
+        """
+        Initialize SingleFlight.
+        
+        Args:
+            enabled: Coalesce identical calls (disabled, every call runs its computation)
+        """
+        self.enabled = enabled
+        self._in_flight: dict[Hashable, asyncio.Task] = {}
+        
+        # Per operation: computations run, and calls that joined one already running
+        self.executions: dict[str, int] = defaultdict(int)
+        self.coalesced: dict[str, int] = defaultdict(int)
+    
+    async def run(self, operation: str, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run compute(), or join an identical computation already in flight.
+        
+        Args:
+            operation: Name of the operation (part of the key, and of the counters)
+            key: Identity of the call within the operation (e.g. a normalised URL)
+            compute: Starts the computation; only called by the first caller
+        
+        Returns:
+            The computation's result (an exception is raised to every caller)
+        """
+        if not self.enabled:
+            self.executions[operation] += 1
+            return await compute()
+        
+        flight_key = (operation, key)
+        task = self._in_flight.get(flight_key)
+        if task is None:
+            task = asyncio.ensure_future(compute())
+            self._in_flight[flight_key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(flight_key, None))
+            self.executions[operation] += 1
+        else:
+            self.coalesced[operation] += 1
+            logger.info(f"Coalesced {operation} call with the one in flight")
+        
+        # Shielded: a caller that disconnects does not cancel the others' computation
+        return _detach(await asyncio.shield(task))
+    
+    def stats(self) -> dict:
+        operations = sorted(set(self.executions) | set(self.coalesced))
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._in_flight),
+            "operations": {
+                operation: {
+                    "executions": self.executions[operation],
+                    "coalesced": self.coalesced[operation]
+                }
+                for operation in operations
+            },
+            "executions": sum(self.executions.values()),
+            "coalesced": sum(self.coalesced.values())
+        }
+
+
+# Singleton instance
+single_flight = SingleFlight(enabled=settings.single_flight_enabled)
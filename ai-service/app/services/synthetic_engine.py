@@ -0,0 +1,173 @@
+"""
+Deterministic synthetic face engine for load testing without dlib.
+
+Stands in for HOG detection and the ResNet encoder with the same outputs:
+face locations and 128-d float64 encodings. Everything is derived from a hash
+of the image pixels, so the same photo always yields the same faces, in every
+process and on every run:
+
+- Faces per image are drawn uniformly from [min_faces, max_faces].
+- Each face belongs to an identity from a fixed pool (seeded by `seed`). Identity
+  popularity follows a Zipf law with exponent identity_skew: 0 spreads faces
+  evenly over the pool, larger values make a few people appear in many photos
+  (more overlap between photos, more matches per guest).
+- Encodings are the identity centre plus per-face noise, with same-person
+  distances around 0.4 and different-person distances around 1.1, so the
+  0.6 threshold separates them much like real encodings.
+- Detector latency is simulated per image and per megapixel, either sleeping
+  or keeping a core busy (closer to dlib under CPU saturation).
+
+Matching needs no stand-in: it runs on the encodings through the normal codec.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+
+import numpy as np
+
+from app.config import settings
+from app.services.encodings import ENCODING_DIM
+
+logger = logging.getLogger(__name__)
+
+# Per-dimension spread of identity centres and of faces around them (as dlib)
+IDENTITY_SPREAD = 0.07
+FACE_NOISE = 0.025
+
+# Hash every n-th pixel row and column: cheap on large photos, still content-based
+_HASH_STRIDE = 7
+
+
+class SyntheticFaceEngine:
+    """Content-seeded fake face detector and encoder with a fixed identity pool."""
+    
+    def __init__(
+        self,
+        identities: int = 1000,
+        identity_skew: float = 1.0,
+        min_faces: int = 0,
+        max_faces: int = 3,
+        latency_ms: float = 0.0,
+        latency_ms_per_mp: float = 0.0,
+        busy_latency: bool = False,
+        seed: int = 0
+    ):
+        """
+        Initialize SyntheticFaceEngine.
+        
+        Args:
+            identities: Size of the identity pool (smaller = more overlap between photos)
+            identity_skew: Zipf exponent of identity popularity (0 = uniform)
+            min_faces: Minimum faces per image
+            max_faces: Maximum faces per image
+            latency_ms: Simulated detection latency per image
+            latency_ms_per_mp: Additional simulated latency per megapixel
+            busy_latency: Spin instead of sleeping, occupying a core like dlib
+            seed: Seed of the identity pool
+        """
+        if identities < 1:
+            raise ValueError("The synthetic identity pool needs at least one identity")
+        if not 0 <= min_faces <= max_faces:
+            raise ValueError("Synthetic faces per image must satisfy 0 <= min_faces <= max_faces")
+        self.identity_count = identities
+        self.identity_skew = identity_skew
+        self.min_faces = min_faces
+        self.max_faces = max_faces
+        self.latency_ms = latency_ms
+        self.latency_ms_per_mp = latency_ms_per_mp
+        self.busy_latency = busy_latency
+        self.seed = seed
+        
+        self.centres = np.random.default_rng(seed).normal(0.0, IDENTITY_SPREAD, size=(identities, ENCODING_DIM))
+        weights = 1.0 / np.arange(1, identities + 1) ** identity_skew
+        self.popularity = weights / weights.sum()
+        self._lock = threading.Lock()
+        
+        self.images = 0
+        self.faces = 0
+        self.simulated_seconds = 0.0
+    
+    @staticmethod
+    def content_seed(image: np.ndarray) -> int:
+        """Stable 64-bit seed from the image size and a strided sample of its pixels."""
+        digest = hashlib.blake2b(digest_size=8)
+        digest.update(str(image.shape).encode())
+        digest.update(np.ascontiguousarray(image[::_HASH_STRIDE, ::_HASH_STRIDE]).tobytes())
+        return int.from_bytes(digest.digest(), "little")
+    
+    def detect(self, image: np.ndarray) -> list[dict]:
+        """
+        Detect and encode the synthetic faces of an RGB image.
+        
+        Returns:
+            List of dicts with identity, location (top, right, bottom, left in
+            pixels, as face_recognition) and encoding ((128,) float64)
+        """
+        started = time.perf_counter()
+        height, width = image.shape[:2]
+        rng = np.random.default_rng(self.content_seed(image))
+        
+        count = int(rng.integers(self.min_faces, self.max_faces + 1))
+        identities = rng.choice(self.identity_count, size=count, p=self.popularity)
+        scale = FACE_NOISE * rng.uniform(0.75, 1.25, size=(count, 1))
+        encodings = self.centres[identities] + rng.normal(0.0, 1.0, size=(count, ENCODING_DIM)) * scale
+        
+        # Square boxes of 5-20% of the shorter side anywhere in the image
+        sides = np.maximum(1, (rng.uniform(0.05, 0.2, size=count) * min(height, width)).astype(int))
+        tops = (rng.random(count) * (height - sides)).astype(int)
+        lefts = (rng.random(count) * (width - sides)).astype(int)
+        
+        faces = [
+            {
+                "identity": int(identities[i]),
+                "location": (int(tops[i]), int(lefts[i] + sides[i]), int(tops[i] + sides[i]), int(lefts[i])),
+                "encoding": encodings[i]
+            }
+            for i in range(count)
+        ]
+        
+        self._simulate_latency(started, height * width / 1e6)
+        with self._lock:
+            self.images += 1
+            self.faces += count
+            self.simulated_seconds += time.perf_counter() - started
+        return faces
+    
+    def stats(self) -> dict:
+        return {
+            "identities": self.identity_count,
+            "identity_skew": self.identity_skew,
+            "faces_per_image": [self.min_faces, self.max_faces],
+            "latency_ms": self.latency_ms,
+            "latency_ms_per_mp": self.latency_ms_per_mp,
+            "busy_latency": self.busy_latency,
+            "seed": self.seed,
+            "images": self.images,
+            "faces": self.faces,
+            "avg_ms": 1000 * self.simulated_seconds / self.images if self.images else 0.0
+        }
+    
+    def _simulate_latency(self, started: float, megapixels: float):
+        deadline = started + (self.latency_ms + self.latency_ms_per_mp * megapixels) / 1000
+        if self.busy_latency:
+            while time.perf_counter() < deadline:
+                pass
+        else:
+            remaining = deadline - time.perf_counter()
+            if remaining > 0:
+                time.sleep(remaining)
+
+
+# Singleton instance
+synthetic_engine = SyntheticFaceEngine(
+    identities=settings.synthetic_identities,
+    identity_skew=settings.synthetic_identity_skew,
+    min_faces=settings.synthetic_min_faces,
+    max_faces=settings.synthetic_max_faces,
+    latency_ms=settings.synthetic_latency_ms,
+    latency_ms_per_mp=settings.synthetic_latency_ms_per_mp,
+    busy_latency=settings.synthetic_busy_latency,
+    seed=settings.synthetic_seed
+)
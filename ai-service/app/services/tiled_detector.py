@@ -0,0 +1,263 @@
+"""
+Tiled face detection for very large and panoramic images.
+
+The HOG detector upsamples the whole image before scanning, so a 50MP group
+panorama costs minutes and gigabytes, while downscaling it first loses the
+small faces in the back rows. Above a pixel threshold the image is instead
+split into overlapping tiles at full resolution:
+
+1. The decoded image is published once into POSIX shared memory, and the tiles
+   are detected in parallel by a pool of worker processes (each maps its tile
+   from the segment, no per-tile copies through pickling).
+2. Tile boxes are shifted back to image coordinates and merged with
+   non-maximum suppression. A face cut by a tile border also appears whole in
+   the neighbouring tile (the overlap exceeds the face size), so partial boxes
+   mostly contained in a larger one are suppressed as well.
+3. Encodings are computed by the caller from the original pixels.
+"""
+
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Callable, Optional
+
+import numpy as np
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Face locations in face_recognition order: (top, right, bottom, left)
+Location = tuple[int, int, int, int]
+
+
+def plan_tiles(height: int, width: int, tile_size: int, overlap: int) -> list[tuple[int, int, int, int]]:
+    """
+    Overlapping tiles covering an image, as (top, left, bottom, right).
+    
+    Tiles are tile_size square (smaller only if the image is) and consecutive
+    tiles overlap by at least `overlap` pixels; the last tile of each row and
+    column is aligned to the image border instead of being cut short.
+    """
+    def starts(length: int) -> list[int]:
+        if length <= tile_size:
+            return [0]
+        step = tile_size - overlap
+        positions = list(range(0, length - tile_size, step))
+        return positions + [length - tile_size]
+    
+    return [
+        (top, left, min(top + tile_size, height), min(left + tile_size, width))
+        for top in starts(height)
+        for left in starts(width)
+    ]
+
+
+def non_max_suppression(
+    locations: list[Location],
+    iou_threshold: float = 0.4,
+    containment_threshold: float = 0.8
+) -> list[Location]:
+    """
+    Merge duplicate face boxes, largest first.
+    
+    A box is dropped when its IoU with a kept box exceeds iou_threshold, or when
+    a kept box covers more than containment_threshold of its area (a face cut
+    by a tile border next to the same face detected whole).
+    """
+    if not locations:
+        return []
+    boxes = np.asarray(locations, dtype=np.float64)
+    top, right, bottom, left = boxes.T
+    areas = (bottom - top) * (right - left)
+    order = np.argsort(-areas, kind="stable")
+    suppressed = np.zeros(len(boxes), dtype=bool)
+    kept = []
+    
+    for i in order:
+        if suppressed[i]:
+            continue
+        kept.append(locations[i])
+        heights = np.clip(np.minimum(bottom[i], bottom) - np.maximum(top[i], top), 0, None)
+        widths = np.clip(np.minimum(right[i], right) - np.maximum(left[i], left), 0, None)
+        intersection = heights * widths
+        iou = intersection / (areas[i] + areas - intersection)
+        contained = intersection / np.maximum(np.minimum(areas[i], areas), 1)
+        suppressed |= (iou > iou_threshold) | (contained > containment_threshold)
+    return kept
+
+
+def _detect_tile(name: str, shape: tuple, bounds: tuple[int, int, int, int], upsample: int) -> list[Location]:
+    """Worker: face locations in one tile of the shared image, in image coordinates."""
+    import face_recognition
+    
+    top, left, bottom, right = bounds
+    # Spawned workers share the parent's resource tracker; the parent unlinks the segment
+    segment = shared_memory.SharedMemory(name=name)
+    try:
+        image = np.ndarray(shape, dtype=np.uint8, buffer=segment.buf)
+        # Always a copy: the segment is unmapped before detection runs
+        tile = image[top:bottom, left:right].copy()
+        del image
+    finally:
+        segment.close()
+    locations = face_recognition.face_locations(tile, number_of_times_to_upsample=upsample)
+    return [(t + top, r + left, b + top, l + left) for t, r, b, l in locations]
+
+
+class TiledDetector:
+    """Splits large images into overlapping tiles detected across worker processes."""
+    
+    def __init__(
+        self,
+        min_pixels: int = 12000000,
+        tile_size: int = 2048,
+        overlap: int = 256,
+        workers: int = 2,
+        iou_threshold: float = 0.4,
+        upsample: int = 1
+    ):
+        """
+        Initialize TiledDetector.
+        
+        Args:
+            min_pixels: Images with at least this many pixels are detected in tiles
+            tile_size: Side of the square tiles in pixels
+            overlap: Overlap between neighbouring tiles; should exceed the largest face
+            workers: Worker processes detecting tiles (0 detects the tiles in process)
+            iou_threshold: IoU above which boxes from different tiles are merged
+            upsample: HOG upsampling per tile, as face_recognition's number_of_times_to_upsample
+        """
+        if overlap >= tile_size:
+            raise ValueError("Tile overlap must be smaller than the tile size")
+        self.min_pixels = min_pixels
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.workers = workers
+        self.iou_threshold = iou_threshold
+        self.upsample = upsample
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        
+        self.images = 0
+        self.tiles = 0
+        self.raw_faces = 0
+        self.faces = 0
+        self.seconds = 0.0
+    
+    def should_tile(self, image: np.ndarray) -> bool:
+        return self.min_pixels > 0 and image.shape[0] * image.shape[1] >= self.min_pixels
+    
+    def detect(self, image: np.ndarray, locate: Callable[..., list]) -> list[Location]:
+        """
+        Detect the faces of a large RGB image tile by tile.
+        
+        Args:
+            image: (h, w, 3) uint8 RGB image
+            locate: In-process detector (face_recognition.face_locations), used
+                without worker processes or when the pool fails
+        
+        Returns:
+            Merged face locations (top, right, bottom, left) in image coordinates
+        """
+        started = time.perf_counter()
+        tiles = plan_tiles(image.shape[0], image.shape[1], self.tile_size, self.overlap)
+        
+        raw = None
+        if self.workers > 0:
+            raw = self._detect_in_pool(image, tiles)
+        if raw is None:
+            raw = []
+            for top, left, bottom, right in tiles:
+                tile = np.ascontiguousarray(image[top:bottom, left:right])
+                raw.extend(
+                    (t + top, r + left, b + top, l + left)
+                    for t, r, b, l in locate(tile, number_of_times_to_upsample=self.upsample)
+                )
+        
+        locations = non_max_suppression(raw, self.iou_threshold)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.images += 1
+            self.tiles += len(tiles)
+            self.raw_faces += len(raw)
+            self.faces += len(locations)
+            self.seconds += elapsed
+        logger.info(
+            f"Tiled detection: {image.shape[1]}x{image.shape[0]} in {len(tiles)} tiles, "
+            f"{len(locations)} face(s) ({len(raw)} before merging) in {elapsed:.2f}s"
+        )
+        return locations
+    
+    def close(self):
+        """Stop the worker processes."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+    
+    def stats(self) -> dict:
+        return {
+            "min_pixels": self.min_pixels,
+            "tile_size": self.tile_size,
+            "overlap": self.overlap,
+            "workers": self.workers,
+            "running": self._executor is not None,
+            "images": self.images,
+            "tiles": self.tiles,
+            "faces_before_merging": self.raw_faces,
+            "faces": self.faces,
+            "avg_seconds": self.seconds / self.images if self.images else 0.0
+        }
+    
+    def _detect_in_pool(self, image: np.ndarray, tiles: list) -> Optional[list[Location]]:
+        """Detect all tiles across the worker processes. Returns None if the pool failed."""
+        segment = shared_memory.SharedMemory(create=True, size=max(1, image.nbytes))
+        try:
+            np.ndarray(image.shape, dtype=np.uint8, buffer=segment.buf)[...] = image
+            executor = self._get_executor()
+            futures = [
+                executor.submit(_detect_tile, segment.name, image.shape, bounds, self.upsample)
+                for bounds in tiles
+            ]
+            try:
+                return [location for f in futures for location in f.result()]
+            except BrokenProcessPool as e:
+                # A worker died (e.g. out of memory); restart the pool on the next image
+                logger.error(f"Tiled detection worker pool failed, detecting in process: {e}")
+                self._reset_executor(executor)
+                return None
+        finally:
+            segment.close()
+            segment.unlink()
+    
+    def _reset_executor(self, executor: ProcessPoolExecutor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+    
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn, as for sharded matching: the service process runs threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+                logger.info(f"Started {self.workers} tiled detection worker process(es)")
+            return self._executor
+
+
+# Singleton instance
+tiled_detector = TiledDetector(
+    min_pixels=settings.tiled_detection_min_pixels,
+    tile_size=settings.detection_tile_size,
+    overlap=settings.detection_tile_overlap,
+    workers=settings.tiled_detection_workers,
+    iou_threshold=settings.detection_nms_iou
+)
@@ -0,0 +1,372 @@
+"""
+Face tracks from short video clips (highlight reels).
+
+Running HOG on every frame of a clip costs as much as hundreds of photos, and
+yields hundreds of near-identical encodings per person. Instead:
+
+1. The clip is decoded in streaming fashion with PyAV (an optional
+   dependency), keeping only sample_fps frames per second, each reduced to a
+   tiny grayscale thumbnail for scene-change scoring.
+2. Faces are detected only on keyframes: when the thumbnail differs enough from
+   the last keyframe's (a cut, a pan, people moving in), or when
+   keyframe_interval seconds passed without one.
+3. Detections on consecutive keyframes are linked into tracks by box IoU with
+   the track's box extrapolated at its last velocity; hard cuts end all
+   tracks, and tracks unseen for max_track_gap seconds end.
+4. Each track remembers the crop around its best detection (largest and
+   sharpest face), and is encoded once, from that crop, at the end.
+
+The result is one encoding per track with its time span, so guests are matched
+to clips at the cost of a few detections and one encoding per person.
+"""
+
+import logging
+import threading
+import time
+from io import BytesIO
+from typing import Callable, Optional
+
+import numpy as np
+
+from app.config import settings
+from app.services.tiled_detector import Location
+
+try:
+    import av
+    AV_AVAILABLE = True
+except ImportError:
+    av = None
+    AV_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Size of the grayscale thumbnails compared for scene changes
+THUMBNAIL_SIZE = (64, 36)
+
+# Context kept around the best face of a track for encoding (fraction of the box size)
+CROP_MARGIN = 0.5
+
+
+def box_iou(a: Location, b: Location) -> float:
+    """IoU of two (top, right, bottom, left) boxes."""
+    height = min(a[2], b[2]) - max(a[0], b[0])
+    width = min(a[1], b[1]) - max(a[3], b[3])
+    if height <= 0 or width <= 0:
+        return 0.0
+    intersection = height * width
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    return intersection / (area_a + area_b - intersection)
+
+
+def sharpness(gray: np.ndarray) -> float:
+    """Variance of the Laplacian of a grayscale image (higher = sharper)."""
+    if gray.shape[0] < 3 or gray.shape[1] < 3:
+        return 0.0
+    gray = gray.astype(np.float32)
+    laplacian = (
+        gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:] - 4 * gray[1:-1, 1:-1]
+    )
+    return float(laplacian.var())
+
+
+class FaceTrack:
+    """Detections of one face across keyframes, with the crop of its best detection."""
+    
+    def __init__(self, track_id: int, timestamp: float, location: Location):
+        self.track_id = track_id
+        self.start = timestamp
+        self.end = timestamp
+        self.location = location
+        # Box change per second between the last two detections
+        self.velocity = (0.0, 0.0, 0.0, 0.0)
+        self.detections = 0
+        
+        self.best_quality = -1.0
+        self.best_time = timestamp
+        self.best_box: Optional[dict] = None
+        # Crop of the best frame, the face location within it, and a detector-provided encoding
+        self.best_crop: Optional[np.ndarray] = None
+        self.best_crop_location: Optional[Location] = None
+        self.best_encoding: Optional[np.ndarray] = None
+    
+    def predict(self, timestamp: float) -> Location:
+        """Box expected at a timestamp, moving at the last observed velocity."""
+        elapsed = timestamp - self.end
+        return tuple(int(v + dv * elapsed) for v, dv in zip(self.location, self.velocity))
+    
+    def update(self, timestamp: float, frame: np.ndarray, gray: np.ndarray, location: Location, encoding=None):
+        """Record a detection; keeps the crop if it is the best one so far."""
+        if timestamp > self.end:
+            self.velocity = tuple((new - old) / (timestamp - self.end) for new, old in zip(location, self.location))
+        self.end = timestamp
+        self.location = location
+        self.detections += 1
+        
+        top, right, bottom, left = location
+        quality = (bottom - top) * (right - left) * np.log1p(sharpness(gray[top:bottom, left:right]))
+        if quality <= self.best_quality:
+            return
+        
+        height, width = frame.shape[:2]
+        margin_y = int((bottom - top) * CROP_MARGIN)
+        margin_x = int((right - left) * CROP_MARGIN)
+        crop_top, crop_left = max(0, top - margin_y), max(0, left - margin_x)
+        crop_bottom, crop_right = min(height, bottom + margin_y), min(width, right + margin_x)
+        
+        self.best_quality = quality
+        self.best_time = timestamp
+        self.best_crop = frame[crop_top:crop_bottom, crop_left:crop_right].copy()
+        self.best_crop_location = (top - crop_top, right - crop_left, bottom - crop_top, left - crop_left)
+        self.best_encoding = encoding
+        self.best_box = {
+            "top": top / height,
+            "right": right / width,
+            "bottom": bottom / height,
+            "left": left / width
+        }
+
+
+class VideoProcessor:
+    """Samples clip frames adaptively, tracks faces between keyframes and encodes each track once."""
+    
+    def __init__(
+        self,
+        sample_fps: float = 5.0,
+        scene_threshold: float = 0.08,
+        scene_cut_threshold: float = 0.3,
+        keyframe_interval: float = 1.0,
+        track_iou: float = 0.2,
+        max_track_gap: float = 2.0,
+        min_track_detections: int = 1,
+        detect_width: int = 1280,
+        max_seconds: float = 120.0
+    ):
+        """
+        Initialize VideoProcessor.
+        
+        Args:
+            sample_fps: Frames per second scored for scene changes (the rest are only decoded)
+            scene_threshold: Mean thumbnail difference (0-1) to the last keyframe that triggers detection
+            scene_cut_threshold: Difference treated as a hard cut, ending all tracks
+            keyframe_interval: Maximum seconds between detections
+            track_iou: Minimum box IoU to link a detection to a track
+            max_track_gap: Seconds after which an unseen track ends
+            min_track_detections: Tracks with fewer detections are dropped
+            detect_width: Frames wider than this are downscaled for detection
+            max_seconds: Clips are processed up to this length
+        """
+        if sample_fps <= 0 or keyframe_interval <= 0:
+            raise ValueError("sample_fps and keyframe_interval must be positive")
+        self.sample_fps = sample_fps
+        self.scene_threshold = scene_threshold
+        self.scene_cut_threshold = scene_cut_threshold
+        self.keyframe_interval = keyframe_interval
+        self.track_iou = track_iou
+        self.max_track_gap = max_track_gap
+        self.min_track_detections = min_track_detections
+        self.detect_width = detect_width
+        self.max_seconds = max_seconds
+        self._lock = threading.Lock()
+        
+        self.clips = 0
+        self.frames_decoded = 0
+        self.keyframes = 0
+        self.tracks = 0
+        self.seconds = 0.0
+    
+    @property
+    def is_available(self) -> bool:
+        return AV_AVAILABLE
+    
+    def process(
+        self,
+        video_data: bytes,
+        detect: Callable[[np.ndarray], list],
+        encode: Optional[Callable[[np.ndarray, list[Location]], list]]
+    ) -> dict:
+        """
+        Extract face tracks from an encoded clip.
+        
+        Args:
+            video_data: Encoded video (any container/codec FFmpeg can read)
+            detect: RGB frame -> list of (location, encoding or None) per face
+            encode: (RGB image, locations) -> encodings, for tracks without one
+                (may be None if detect always provides the encodings)
+        
+        Returns:
+            dict with track_count, faces (one per track: index, encoding,
+            bounding_box at the best frame, start_ms, end_ms, best_ms,
+            detections) and video (duration and frame counts)
+        """
+        if not AV_AVAILABLE:
+            raise RuntimeError("Video ingestion requires PyAV (pip install av)")
+        
+        started = time.perf_counter()
+        tracks: list[FaceTrack] = []
+        active: list[FaceTrack] = []
+        decoded = sampled = keyframes = 0
+        last_sample = last_keyframe = -np.inf
+        keyframe_thumbnail = None
+        timestamp = 0.0
+        truncated = False
+        
+        with av.open(BytesIO(video_data)) as container:
+            stream = container.streams.video[0]
+            stream.thread_type = "AUTO"
+            rate = float(stream.average_rate or 25)
+            
+            for frame in container.decode(stream):
+                timestamp = frame.time if frame.time is not None else decoded / rate
+                decoded += 1
+                if timestamp > self.max_seconds:
+                    truncated = True
+                    break
+                if timestamp - last_sample < 1 / self.sample_fps:
+                    continue
+                last_sample = timestamp
+                sampled += 1
+                
+                thumbnail = frame.to_ndarray(
+                    width=THUMBNAIL_SIZE[0], height=THUMBNAIL_SIZE[1], format="gray"
+                ).astype(np.float32)
+                change = (
+                    1.0 if keyframe_thumbnail is None
+                    else float(np.abs(thumbnail - keyframe_thumbnail).mean()) / 255
+                )
+                if change < self.scene_threshold and timestamp - last_keyframe < self.keyframe_interval:
+                    continue
+                
+                if change >= self.scene_cut_threshold:
+                    active = []
+                keyframe_thumbnail, last_keyframe = thumbnail, timestamp
+                keyframes += 1
+                active = self._track(frame, timestamp, active, tracks, detect)
+        
+        results = self._encode_tracks(tracks, encode)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.clips += 1
+            self.frames_decoded += decoded
+            self.keyframes += keyframes
+            self.tracks += len(results)
+            self.seconds += elapsed
+        logger.info(
+            f"Video: {timestamp:.1f}s, {decoded} frames decoded, {keyframes} detected, "
+            f"{len(results)} face track(s) in {elapsed:.2f}s"
+        )
+        return {
+            "track_count": len(results),
+            "faces": results,
+            "video": {
+                "duration_ms": timestamp * 1000,
+                "frames_decoded": decoded,
+                "frames_sampled": sampled,
+                "keyframes": keyframes,
+                "truncated": truncated
+            }
+        }
+    
+    def stats(self) -> dict:
+        return {
+            "available": AV_AVAILABLE,
+            "sample_fps": self.sample_fps,
+            "scene_threshold": self.scene_threshold,
+            "keyframe_interval": self.keyframe_interval,
+            "clips": self.clips,
+            "frames_decoded": self.frames_decoded,
+            "keyframes": self.keyframes,
+            "detected_fraction": self.keyframes / self.frames_decoded if self.frames_decoded else 0.0,
+            "tracks": self.tracks,
+            "avg_seconds": self.seconds / self.clips if self.clips else 0.0
+        }
+    
+    def _track(self, frame, timestamp: float, active: list, tracks: list, detect) -> list[FaceTrack]:
+        """Detect faces in a keyframe and link them to the active tracks. Returns the new active set."""
+        image = frame.to_ndarray(format="rgb24")
+        scale = min(1.0, self.detect_width / image.shape[1])
+        if scale < 1.0:
+            small = frame.to_ndarray(
+                width=int(image.shape[1] * scale), height=int(image.shape[0] * scale), format="rgb24"
+            )
+        else:
+            small = image
+        
+        height, width = image.shape[:2]
+        detections = [
+            (
+                (
+                    max(0, round(top / scale)),
+                    min(width, round(right / scale)),
+                    min(height, round(bottom / scale)),
+                    max(0, round(left / scale))
+                ),
+                encoding
+            )
+            for (top, right, bottom, left), encoding in detect(small)
+        ]
+        gray = frame.to_ndarray(format="gray")
+        
+        # Greedy IoU assignment, best overlaps first
+        pairs = sorted(
+            (
+                (box_iou(track.predict(timestamp), location), t, d)
+                for t, track in enumerate(active)
+                for d, (location, _) in enumerate(detections)
+            ),
+            reverse=True
+        )
+        assigned_tracks, assigned_detections = set(), set()
+        for iou, t, d in pairs:
+            if iou < self.track_iou:
+                break
+            if t in assigned_tracks or d in assigned_detections:
+                continue
+            assigned_tracks.add(t)
+            assigned_detections.add(d)
+            active[t].update(timestamp, image, gray, *detections[d])
+        
+        for d, (location, encoding) in enumerate(detections):
+            if d not in assigned_detections:
+                track = FaceTrack(len(tracks), timestamp, location)
+                track.update(timestamp, image, gray, location, encoding)
+                tracks.append(track)
+                active.append(track)
+        
+        return [track for track in active if timestamp - track.end <= self.max_track_gap]
+    
+    def _encode_tracks(self, tracks: list[FaceTrack], encode) -> list[dict]:
+        """One encoding per track, from its best crop (unless the detector provided one)."""
+        kept = [track for track in tracks if track.detections >= self.min_track_detections]
+        results = []
+        for index, track in enumerate(kept):
+            encoding = track.best_encoding
+            if encoding is None:
+                encodings = encode(track.best_crop, [track.best_crop_location])
+                if not encodings:
+                    continue
+                encoding = encodings[0]
+            results.append({
+                "index": index,
+                "encoding": encoding,
+                "bounding_box": track.best_box,
+                "start_ms": track.start * 1000,
+                "end_ms": track.end * 1000,
+                "best_ms": track.best_time * 1000,
+                "detections": track.detections
+            })
+        return results
+
+
+# Singleton instance
+video_processor = VideoProcessor(
+    sample_fps=settings.video_sample_fps,
+    scene_threshold=settings.video_scene_threshold,
+    scene_cut_threshold=settings.video_scene_cut_threshold,
+    keyframe_interval=settings.video_keyframe_interval,
+    track_iou=settings.video_track_iou,
+    max_track_gap=settings.video_max_track_gap,
+    min_track_detections=settings.video_min_track_detections,
+    detect_width=settings.video_detect_width,
+    max_seconds=settings.video_max_seconds
+)
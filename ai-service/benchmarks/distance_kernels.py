@@ -0,0 +1,87 @@
+"""
+Distance kernel timings by batch shape.
+
+Times the direct kernel (blocked difference + einsum), the BLAS kernel with and
+without cached row norms, and the original full-difference np.linalg.norm scan
+for each combination of event size and number of query encodings, and reports
+the fastest kernel next to the one the "auto" setting selects.
+
+Usage:
+    python -m benchmarks.distance_kernels [--rows 64 256 4096 100000] [--queries 1 4 32]
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+from app.services.blas import blas_thread_info, limit_blas_threads
+from app.services.encodings import EncodingCodec
+from benchmarks.synthetic import make_faces, make_identities
+
+
+def per_call(func, budget: float = 0.2) -> float:
+    """Seconds per call, repeating until the time budget is used."""
+    func()
+    calls, started = 0, time.perf_counter()
+    while True:
+        func()
+        calls += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= budget:
+            return elapsed / calls
+
+
+def legacy(matrix: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    return np.min([np.linalg.norm(matrix - q, axis=1) for q in queries], axis=0)
+
+
+def run(rows: list[int], queries: list[int], dtype: str, threads: int):
+    if threads:
+        limit_blas_threads(threads)
+    codecs = {kernel: EncodingCodec(dtype, kernel=kernel) for kernel in ("direct", "gemm", "auto")}
+    codec = codecs["auto"]
+    centres = make_identities(max(1, max(rows) // 40))
+    
+    print(f"dtype: {dtype}  Cores: {os.cpu_count()}  BLAS: {blas_thread_info() or 'threadpoolctl not installed'}\n")
+    print(f"{'rows':>8} {'queries':>8} {'legacy':>10} {'direct':>10} {'gemm':>10} {'gemm+norms':>11} "
+          f"{'best':>11} {'auto':>7}")
+    
+    for n in rows:
+        encodings, _ = make_faces(centres, 1, seed=n)
+        matrix = codec.to_compact(encodings[np.arange(n) % len(encodings)])
+        norms = codec.squared_norms(matrix)
+        out = np.empty(n, dtype=codec.result_dtype)
+        for k in queries:
+            query_set = codec.to_compact(make_faces(centres[:k], 1, seed=7)[0])
+            timings = {
+                "legacy": per_call(lambda: legacy(codec.to_float(matrix), codec.to_float(query_set))),
+                "direct": per_call(lambda: codecs["direct"].min_distances(matrix, query_set, out=out)),
+                "gemm": per_call(lambda: codecs["gemm"].min_distances(matrix, query_set, out=out)),
+                "gemm+norms": per_call(
+                    lambda: codecs["gemm"].min_distances(matrix, query_set, norms=norms, out=out)
+                )
+            }
+            best = min(timings, key=timings.get)
+            auto = codec.select_kernel(n, k)
+            print(
+                f"{n:>8,} {k:>8} " + " ".join(f"{timings[name] * 1e6:>{width}.0f}" for name, width in
+                (("legacy", 10), ("direct", 10), ("gemm", 10), ("gemm+norms", 11)))
+                + f" {best:>11} {auto:>7}"
+            )
+    print("\nTimes in microseconds per batch; the index passes cached norms, so \"gemm\" runs as gemm+norms.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[16, 64, 256, 1024, 4096, 32768, 200000])
+    parser.add_argument("--queries", type=int, nargs="+", default=[1, 4, 32])
+    parser.add_argument("--dtype", default="float32")
+    parser.add_argument("--threads", type=int, default=0, help="BLAS threads (0 = library default)")
+    args = parser.parse_args()
+    run(args.rows, args.queries, args.dtype, args.threads)
+
+
+if __name__ == "__main__":
+    main()
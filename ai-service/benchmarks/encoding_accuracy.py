@@ -0,0 +1,70 @@
+"""
+Accuracy and memory report for the compact encoding dtypes.
+
+Matches a set of synthetic queries against a synthetic event with the float64
+reference path and with every compact dtype, and reports how many match
+decisions (distance <= threshold) differ, the worst distance error, and how
+many faces fit into 1 GB of RAM.
+
+Usage:
+    python -m benchmarks.encoding_accuracy [--identities 500] [--faces-per-identity 20]
+"""
+
+import argparse
+
+import numpy as np
+
+from app.services.encodings import SUPPORTED_DTYPES, EncodingCodec
+from benchmarks.synthetic import make_faces, make_identities
+
+
+def run(identities: int, faces_per_identity: int, queries: int, threshold: float) -> int:
+    centres = make_identities(identities)
+    faces, _ = make_faces(centres, faces_per_identity)
+    query_set, _ = make_faces(centres[:queries], 1, seed=2)
+    
+    reference = EncodingCodec("float64")
+    ref_matrix = reference.to_compact(faces)
+    ref_distances = [reference.distances(ref_matrix, q) for q in query_set]
+    total = len(faces) * len(query_set)
+    ref_matches = sum(int((d <= threshold).sum()) for d in ref_distances)
+    near = sum(int((np.abs(d - threshold) < 0.01).sum()) for d in ref_distances)
+    
+    print(f"Faces: {len(faces)}  Queries: {len(query_set)}  Decisions: {total}")
+    print(f"Reference matches: {ref_matches}  Pairs within 0.01 of threshold: {near}\n")
+    print(f"{'dtype':<8} {'bytes/face':>10} {'faces/GB':>12} {'flips':>7} {'agreement':>10} {'max |dd|':>10}")
+    
+    float32_flips = 0
+    for dtype in SUPPORTED_DTYPES:
+        codec = EncodingCodec(dtype)
+        matrix = codec.to_compact(faces)
+        flips = 0
+        max_error = 0.0
+        for query, ref in zip(query_set, ref_distances):
+            distances = codec.distances(matrix, codec.to_compact(query)[0])
+            flips += int(((distances <= threshold) != (ref <= threshold)).sum())
+            max_error = max(max_error, float(np.abs(distances.astype(np.float64) - ref).max()))
+        if dtype == "float32":
+            float32_flips = flips
+        faces_per_gb = (1 << 30) // codec.bytes_per_face
+        print(
+            f"{dtype:<8} {codec.bytes_per_face:>10} {faces_per_gb:>12,} {flips:>7} "
+            f"{100.0 * (1 - flips / total):>9.4f}% {max_error:>10.2e}"
+        )
+    
+    # float32 is the default dtype and must not change any match decision.
+    return 1 if float32_flips else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--identities", type=int, default=500)
+    parser.add_argument("--faces-per-identity", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--threshold", type=float, default=0.6)
+    args = parser.parse_args()
+    raise SystemExit(run(args.identities, args.faces_per_identity, args.queries, args.threshold))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Photo analysis and derivatives across image formats and modes.
+
+Most event photos are RGB JPEGs, but uploads also include GIFs (palette),
+scanned bilevel PNGs, 16-bit PNGs, CMYK JPEGs and images with alpha. Each
+combination is encoded at full size (large enough for the reduced-copy paths
+to kick in) and run through PhotoProcessor.analyze_photo and
+generate_derivatives. The check fails (exit status 1) when any of them raises.
+
+Usage:
+    python -m benchmarks.image_modes [--width 2000] [--height 1500]
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+# (mode, format) pairs; the decoded mode can differ (e.g. PNG stores I as I;16)
+CASES = [
+    ("RGB", "JPEG"),
+    ("L", "JPEG"),
+    ("CMYK", "JPEG"),
+    ("P", "GIF"),
+    ("P", "PNG"),
+    ("1", "PNG"),
+    ("I;16", "PNG"),
+    ("LA", "PNG"),
+    ("RGBA", "PNG"),
+    ("RGBA", "WEBP"),
+    ("I", "TIFF"),
+    ("F", "TIFF")
+]
+
+
+def make_image(mode: str, image_format: str, width: int, height: int) -> bytes:
+    """Encoded gradient with noise, converted to the given mode."""
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width]
+    pixels = np.stack([x * 255 // width, y * 255 // height, (x + y) * 127 // (width + height)], axis=-1)
+    pixels = (pixels + rng.integers(0, 24, size=(height, width, 3))).clip(0, 255).astype(np.uint8)
+    image = Image.fromarray(pixels)
+    if mode == "I;16":
+        image = image.convert("L").convert("I;16")
+    elif mode != "RGB":
+        image = image.convert(mode)
+    buffer = BytesIO()
+    image.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def run(width: int, height: int) -> int:
+    from app.services.derivative_store import LocalDerivativeStore
+    from app.services.photo_processor import PhotoProcessor
+
+    failures = []
+    print(f"{'mode':<6} {'format':<6} {'decoded':<8} {'analyze ms':>11} {'derivatives ms':>15}")
+    with tempfile.TemporaryDirectory() as store_dir:
+        processor = PhotoProcessor()
+        processor._store = LocalDerivativeStore(store_dir)
+        for mode, image_format in CASES:
+            data = make_image(mode, image_format, width, height)
+            decoded = Image.open(BytesIO(data)).mode
+            timings = []
+            for name, stage in (
+                ("analyze", lambda: processor.analyze_photo(data)),
+                ("derivatives", lambda: processor.generate_derivatives(data, "photo", "event"))
+            ):
+                started = time.perf_counter()
+                try:
+                    stage()
+                    timings.append(f"{(time.perf_counter() - started) * 1000:.0f}")
+                except Exception as e:
+                    failures.append(f"{mode}/{image_format} {name}: {e}")
+                    timings.append("FAILED")
+            print(f"{mode:<6} {image_format:<6} {decoded:<8} {timings[0]:>11} {timings[1]:>15}")
+
+    if failures:
+        print("\nFailures:\n  " + "\n  ".join(failures))
+        return 1
+    print("\nAll formats and modes analyzed")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--width", type=int, default=2000)
+    parser.add_argument("--height", type=int, default=1500)
+    args = parser.parse_args()
+    sys.exit(run(args.width, args.height))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,466 @@
+"""
+End-to-end load test of the ai-service with local stand-ins.
+
+Replays a traffic profile (bulk /detect-faces-url ingest with concurrent guest
+/encode-selfie-url and /match-faces-structured calls) at increasing offered
+rates and reports completed throughput and p50/p95/p99 latency per endpoint,
+and the rate at which each endpoint saturates.
+
+No dlib, Redis server or image storage is needed:
+- Photos and selfies are synthetic JPEGs served by a local HTTP server. Its
+  address is private, so the service must allow it past the SSRF checks: the
+  in-process target allows 127.0.0.1 itself; start a remote target with
+  SSRF_ALLOWED_NETWORKS covering --image-host.
+- Faces come from the synthetic engine (the in-process target always uses it,
+  a remote one needs FACE_ENGINE=synthetic). The same engine run locally gives
+  the ground truth responses are checked against: face counts, selfie
+  encodings and the photos a guest should match.
+- Redis is fakeredis when it is installed (in-process target), otherwise the
+  configured server.
+
+Arrivals are open-loop (Poisson at the offered rate) and latency is measured
+from the scheduled send time, so a slow service cannot hold back the load that
+measures it. An endpoint is saturated at the first rate where its p99 exceeds
+the profile's SLO, more than 1% of its calls fail or are shed (429), or its
+completed throughput (including the time to drain the requests in flight)
+falls below 95% of the rate it was sent.
+
+The in-process target shares one interpreter (and GIL) between the load
+generator, the image server and the app; use --target against a deployed
+service for release numbers.
+
+Usage:
+    python -m benchmarks.load_test [--profile release] [--rates 2 4 8] [--duration 20]
+    python -m benchmarks.load_test --profile my_profile.json --output report.json
+    python -m benchmarks.load_test --target http://10.0.0.4:8000 --image-host 10.0.0.5
+"""
+
+import argparse
+import asyncio
+import ipaddress
+import json
+import threading
+import time
+from contextlib import AsyncExitStack
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from typing import Callable, Optional
+
+import httpx
+import numpy as np
+import orjson
+from PIL import Image
+
+from benchmarks.memory_regression import make_photo
+
+# Traffic profiles: share of requests per endpoint, p99 latency SLO per
+# endpoint, offered rates (requests/s over all endpoints) and test data
+PROFILES = {
+    # Photo uploads of a running event while guests look for their photos
+    "release": {
+        "mix": {"detect": 0.8, "selfie": 0.05, "match": 0.15},
+        "slo_p99_ms": {"detect": 10000, "selfie": 2000, "match": 1000},
+        "rates": [2, 4, 8, 16, 32],
+        "photo_megapixels": 12,
+        "photos": 24,
+        "selfies": 16,
+        "event_faces": 2000,
+        "event_id": "load-test"
+    },
+    # Bulk import after an event, no guests yet
+    "ingest": {
+        "mix": {"detect": 1.0},
+        "slo_p99_ms": {"detect": 10000},
+        "rates": [1, 2, 4, 8, 16]
+    },
+    # Guests arriving after the photos are in (e.g. the gallery link was shared)
+    "guests": {
+        "mix": {"detect": 0.1, "selfie": 0.3, "match": 0.6},
+        "slo_p99_ms": {"detect": 10000, "selfie": 2000, "match": 1000},
+        "rates": [5, 10, 20, 40, 80]
+    }
+}
+
+ENDPOINTS = {
+    "detect": "/detect-faces-url",
+    "selfie": "/encode-selfie-url",
+    "match": "/match-faces-structured"
+}
+
+SELFIE_MEGAPIXELS = 0.3
+MAX_ERROR_RATE = 0.01
+MIN_COMPLETION = 0.95
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+def load_profile(name: str) -> dict:
+    """Built-in profile by name, or a JSON file with the same keys (defaults from "release")."""
+    if name in PROFILES:
+        profile = PROFILES[name]
+    else:
+        with open(name) as f:
+            profile = json.load(f)
+    profile = {**PROFILES["release"], **profile}
+    unknown = set(profile["mix"]) - set(ENDPOINTS)
+    if unknown:
+        raise SystemExit(f"Unknown endpoints in profile mix: {', '.join(sorted(unknown))}")
+    return profile
+
+
+class ImageServer:
+    """Serves in-memory JPEGs over HTTP from a background thread."""
+    
+    def __init__(self, images: dict[str, bytes], bind: str = "127.0.0.1", host: Optional[str] = None):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                data = images.get(self.path.split("?")[0])
+                if data is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "image/jpeg")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self.server = ThreadingHTTPServer((bind, 0), Handler)
+        self.server.daemon_threads = True
+        self.base_url = f"http://{host or bind}:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+    
+    def __enter__(self):
+        self.thread.start()
+        return self
+    
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TrafficPlan:
+    """Test images, their ground truth and the request bodies of a profile."""
+    
+    def __init__(self, profile: dict, engine, verify: bool = True, seed: int = 0):
+        """
+        Args:
+            profile: Traffic profile
+            engine: SyntheticFaceEngine configured as the service's, without latency
+            verify: Check responses against the ground truth
+        """
+        self.profile = profile
+        self.verify = verify
+        self.image_base_url = ""
+        self.images: dict[str, bytes] = {}
+        self.photo_faces: list[int] = []
+        self.selfie_encodings: list[np.ndarray] = []
+        self.match_bodies: list[bytes] = []
+        self.match_expected: list[set] = []
+        self._sequence = 0
+        
+        for i in range(profile["photos"]):
+            data = make_photo(profile["photo_megapixels"], seed=seed + i)
+            self.images[f"/photos/{i}.jpg"] = data
+            self.photo_faces.append(len(engine.detect(decode(data))))
+        
+        # Selfies with at least one face; the service encodes the largest
+        selfie_identities = []
+        candidate = 0
+        while len(self.selfie_encodings) < profile["selfies"]:
+            data = make_photo(SELFIE_MEGAPIXELS, seed=seed + 100000 + candidate)
+            candidate += 1
+            faces = engine.detect(decode(data))
+            if not faces:
+                continue
+            largest = max(faces, key=lambda face: (face["location"][2] - face["location"][0]) * (face["location"][1] - face["location"][3]))
+            self.images[f"/selfies/{len(self.selfie_encodings)}.jpg"] = data
+            self.selfie_encodings.append(largest["encoding"])
+            selfie_identities.append(largest["identity"])
+        
+        # Event faces the backend sends along with a guest's encoding
+        event_faces, identities = [], []
+        rng = np.random.default_rng(seed)
+        photo = 0
+        while len(event_faces) < profile["event_faces"]:
+            photo += 1
+            for j, face in enumerate(engine.detect(rng.integers(0, 256, size=(8, 8, 3), dtype=np.uint8))):
+                event_faces.append({"photo_id": f"event-photo-{photo}", "face_id": f"event-photo-{photo}:{j}", "encoding": face["encoding"]})
+                identities.append(face["identity"])
+        event_faces = event_faces[:profile["event_faces"]]
+        for encoding, identity in zip(self.selfie_encodings, selfie_identities):
+            self.match_bodies.append(orjson.dumps(
+                {"target_encoding": encoding, "photo_faces": event_faces},
+                option=orjson.OPT_SERIALIZE_NUMPY
+            ))
+            self.match_expected.append({
+                face["face_id"] for face, face_identity in zip(event_faces, identities) if face_identity == identity
+            })
+    
+    def request(self, endpoint: str, rng: np.random.Generator) -> tuple[bytes, Callable[[dict], bool]]:
+        """Body of the next request to an endpoint, and the check of its response."""
+        self._sequence += 1
+        # A query string per request, so identical URLs are not coalesced by the service
+        suffix = f"?request={self._sequence}"
+        if endpoint == "detect":
+            i = int(rng.integers(len(self.photo_faces)))
+            body = {"image_url": f"{self.image_base_url}/photos/{i}.jpg{suffix}"}
+            if self.profile.get("event_id"):
+                body.update(event_id=self.profile["event_id"], photo_id=f"photo-{self._sequence}")
+            return orjson.dumps(body), lambda result: result["face_count"] == self.photo_faces[i]
+        if endpoint == "selfie":
+            i = int(rng.integers(len(self.selfie_encodings)))
+            body = {"image_url": f"{self.image_base_url}/selfies/{i}.jpg{suffix}"}
+            return orjson.dumps(body), lambda result: (
+                result["face_detected"]
+                and np.allclose(result["encoding"], self.selfie_encodings[i], atol=1e-6)
+            )
+        i = int(rng.integers(len(self.match_bodies)))
+        return self.match_bodies[i], lambda result: (
+            {match["face_id"] for match in result["matches"]} == self.match_expected[i]
+        )
+
+
+def decode(data: bytes) -> np.ndarray:
+    """RGB array of a JPEG, decoded as the service decodes downloads."""
+    return np.array(Image.open(BytesIO(data)).convert("RGB"))
+
+
+class EndpointStats:
+    def __init__(self):
+        self.latencies_ms: list[float] = []
+        self.errors = 0
+        self.shed = 0
+        self.dropped = 0
+        self.wrong = 0
+        # Seconds from the start of the step to the endpoint's last response
+        self.finished = 0.0
+    
+    def summary(self, offered: float, duration: float, slo_p99_ms: float) -> dict:
+        """
+        Args:
+            offered: Nominal rate of the endpoint (req/s)
+            duration: Seconds requests were sent for
+            slo_p99_ms: p99 latency objective
+        """
+        seconds = max(duration, self.finished)
+        completed = len(self.latencies_ms)
+        attempts = completed + self.errors + self.shed + self.dropped
+        latencies = np.array(self.latencies_ms) if completed else np.full(1, np.nan)
+        result = {
+            "offered_rps": offered,
+            "sent_rps": attempts / duration,
+            "completed_rps": completed / seconds,
+            "requests": attempts,
+            "errors": self.errors,
+            "shed": self.shed,
+            "dropped": self.dropped,
+            "wrong": self.wrong,
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+            "max_ms": float(latencies.max())
+        }
+        failed = (self.errors + self.shed + self.dropped) / attempts if attempts else 0.0
+        reasons = []
+        if not completed or result["p99_ms"] > slo_p99_ms:
+            reasons.append("p99 over SLO")
+        if failed > MAX_ERROR_RATE:
+            reasons.append(f"{failed:.0%} failed or shed")
+        if result["completed_rps"] < MIN_COMPLETION * result["sent_rps"]:
+            reasons.append("throughput below sent rate")
+        result["saturated"] = reasons
+        return result
+
+
+async def run_step(
+    client: httpx.AsyncClient,
+    plan: TrafficPlan,
+    rate: float,
+    duration: float,
+    max_in_flight: int,
+    seed: int
+) -> dict[str, EndpointStats]:
+    """Offer Poisson arrivals at rate for duration seconds; wait for the last response."""
+    mix = plan.profile["mix"]
+    names = list(mix)
+    weights = np.array([mix[name] for name in names], dtype=float)
+    weights /= weights.sum()
+    rng = np.random.default_rng(seed)
+    stats = {name: EndpointStats() for name in names}
+    loop = asyncio.get_running_loop()
+    in_flight: set[asyncio.Task] = set()
+    
+    async def call(endpoint: str, scheduled: float, body: bytes, check):
+        try:
+            response = await client.post(ENDPOINTS[endpoint], content=body, headers=JSON_HEADERS)
+        except httpx.HTTPError:
+            stats[endpoint].errors += 1
+            return
+        latency_ms = (loop.time() - scheduled) * 1000
+        stats[endpoint].finished = loop.time() - started
+        if response.status_code == 429:
+            stats[endpoint].shed += 1
+        elif response.status_code >= 400:
+            stats[endpoint].errors += 1
+        else:
+            stats[endpoint].latencies_ms.append(latency_ms)
+            if check is not None and not check(response.json()):
+                stats[endpoint].wrong += 1
+    
+    started = scheduled = loop.time()
+    while True:
+        scheduled += rng.exponential(1 / rate)
+        if scheduled - started >= duration:
+            break
+        await asyncio.sleep(max(0.0, scheduled - loop.time()))
+        endpoint = names[rng.choice(len(names), p=weights)]
+        if len(in_flight) >= max_in_flight:
+            stats[endpoint].dropped += 1
+            continue
+        body, check = plan.request(endpoint, rng)
+        task = asyncio.create_task(call(endpoint, scheduled, body, check if plan.verify else None))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+    if in_flight:
+        await asyncio.gather(*in_flight)
+    return stats
+
+
+def use_fake_redis() -> bool:
+    """Point the in-process service at a fakeredis server, if fakeredis is installed."""
+    try:
+        import fakeredis
+    except ImportError:
+        return False
+    from app.services.redis_service import redis_service
+    
+    server = fakeredis.FakeServer()
+    redis_service.client = fakeredis.FakeRedis(server=server, decode_responses=True)
+    redis_service.binary_client = fakeredis.FakeRedis(server=server)
+    return True
+
+
+async def run(args) -> dict:
+    profile = load_profile(args.profile)
+    rates = args.rates or profile["rates"]
+    
+    async with AsyncExitStack() as stack:
+        if args.target:
+            client = await stack.enter_async_context(httpx.AsyncClient(base_url=args.target, timeout=args.timeout))
+            engine_stats = (await client.get("/synthetic-engine/stats")).json()
+            redis = "service's"
+        else:
+            from app.main import app
+            from app.services.face_service import face_service
+            from app.services.synthetic_engine import synthetic_engine
+            
+            face_service.engine = "synthetic"
+            face_service.allowed_networks = [ipaddress.ip_network("127.0.0.1/32")]
+            await stack.enter_async_context(app.router.lifespan_context(app))
+            # After startup, which connects to the configured Redis
+            redis = "fakeredis" if args.redis != "real" and use_fake_redis() else "configured server"
+            client = await stack.enter_async_context(httpx.AsyncClient(
+                transport=httpx.ASGITransport(app=app), base_url="http://ai-service", timeout=args.timeout
+            ))
+            engine_stats = {"engine": face_service.engine, **synthetic_engine.stats()}
+        
+        from app.services.synthetic_engine import SyntheticFaceEngine
+        verify = engine_stats.get("engine") == "synthetic"
+        min_faces, max_faces = engine_stats.get("faces_per_image", (0, 3))
+        # Ground truth: the service's engine configuration, without its simulated latency
+        engine = SyntheticFaceEngine(
+            identities=engine_stats.get("identities", 1000),
+            identity_skew=engine_stats.get("identity_skew", 1.0),
+            min_faces=min_faces,
+            max_faces=max_faces,
+            seed=engine_stats.get("seed", 0)
+        )
+        
+        started = time.perf_counter()
+        plan = TrafficPlan(profile, engine, verify)
+        server = ImageServer(plan.images, bind="0.0.0.0" if args.target else "127.0.0.1", host=args.image_host or "127.0.0.1")
+        plan.image_base_url = server.base_url
+        print(
+            f"Profile {args.profile}: {profile['photos']} photos of {profile['photo_megapixels']} MP, "
+            f"{profile['selfies']} selfies, {profile['event_faces']} event faces per match "
+            f"(prepared in {time.perf_counter() - started:.1f}s)"
+        )
+        print(
+            f"Target: {args.target or 'in-process app'}, Redis: {redis}, images: {server.base_url}, "
+            f"ground truth: {'checked' if verify else 'not checked (engine is not synthetic)'}\n"
+        )
+        
+        steps = []
+        with server:
+            for step, rate in enumerate(rates):
+                stats = await run_step(client, plan, rate, args.duration, args.max_in_flight, seed=step)
+                endpoints = {
+                    name: stats[name].summary(
+                        rate * share / sum(profile["mix"].values()), args.duration, profile["slo_p99_ms"][name]
+                    )
+                    for name, share in profile["mix"].items()
+                }
+                steps.append({"rate": rate, "endpoints": endpoints})
+                print_step(rate, endpoints)
+    
+    saturation = {}
+    for name in profile["mix"]:
+        sustained, saturated_at, reasons = None, None, []
+        for step in steps:
+            result = step["endpoints"][name]
+            if result["saturated"]:
+                saturated_at, reasons = step["rate"], result["saturated"]
+                break
+            sustained = step["rate"]
+        saturation[name] = {"sustained_rate": sustained, "saturated_at": saturated_at, "reasons": reasons}
+    print_saturation(saturation, profile)
+    return {"profile": profile, "target": args.target or "in-process", "steps": steps, "saturation": saturation}
+
+
+def print_step(rate: float, endpoints: dict):
+    print(f"Offered {rate:g} req/s")
+    print(f"  {'endpoint':<8} {'offered':>8} {'sent/s':>8} {'done/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7} {'shed':>6} {'dropped':>8} {'wrong':>6}")
+    for name, result in endpoints.items():
+        print(
+            f"  {name:<8} {result['offered_rps']:>8.2f} {result['sent_rps']:>8.2f} {result['completed_rps']:>8.2f} {result['p50_ms']:>8.0f} "
+            f"{result['p95_ms']:>8.0f} {result['p99_ms']:>8.0f} {result['errors']:>7} {result['shed']:>6} "
+            f"{result['dropped']:>8} {result['wrong']:>6}{'  SATURATED' if result['saturated'] else ''}"
+        )
+    print()
+
+
+def print_saturation(saturation: dict, profile: dict):
+    print("Saturation (total offered req/s)")
+    for name, result in saturation.items():
+        sustained = f"{result['sustained_rate']:g}" if result["sustained_rate"] is not None else "none"
+        if result["saturated_at"] is None:
+            print(f"  {name:<8} sustained {sustained} (p99 SLO {profile['slo_p99_ms'][name]:g} ms), not saturated")
+        else:
+            print(f"  {name:<8} sustained {sustained}, saturated at {result['saturated_at']:g}: {', '.join(result['reasons'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--profile", default="release", help=f"{', '.join(PROFILES)} or a JSON profile file")
+    parser.add_argument("--rates", type=float, nargs="+", help="Offered rates in req/s (default: the profile's)")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds per rate")
+    parser.add_argument("--max-in-flight", type=int, default=512, help="Requests beyond this are dropped client-side")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--target", help="Base URL of a running service (default: the app in-process)")
+    parser.add_argument("--image-host", help="Address the target reaches the image server at")
+    parser.add_argument("--redis", choices=["auto", "real"], default="auto", help="auto: fakeredis when installed (in-process)")
+    parser.add_argument("--output", help="Write the report as JSON")
+    args = parser.parse_args()
+    
+    report = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
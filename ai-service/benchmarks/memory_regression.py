@@ -0,0 +1,218 @@
+"""
+Memory regression check of the photo pipeline stages.
+
+Runs each stage on a deterministic synthetic photo in a fresh process and
+measures its peak memory above the state before the stage: peak traced
+allocation (tracemalloc: Python objects and NumPy arrays) and peak resident
+set size (also covers Pillow and dlib buffers, which tracemalloc does not
+see). The peaks are compared to a stored baseline, and the check fails (exit
+status 1) when a stage exceeds its baseline by more than the tolerance.
+
+Record a new baseline after intended changes with --update. The synthetic face
+engine stands in for dlib, so no models are needed.
+
+Usage:
+    python -m benchmarks.memory_regression [--megapixels 24] [--tolerance 0.1] [--update]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from app.services.memory_profiler import current_rss, peak_rss
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "memory_baseline.json")
+
+# Below this, differences are noise (allocator arenas, page granularity)
+SLACK_MB = 2.0
+
+MB = 1024 * 1024
+
+
+def make_photo(megapixels: float, seed: int = 0) -> bytes:
+    """JPEG of a smooth gradient with noise and a few bright squares (3:2, as cameras)."""
+    height = int((megapixels * 1e6 / 1.5) ** 0.5)
+    width = int(height * 1.5)
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    image = np.stack([x * 255 // width, y * 255 // height, (x + y) * 127 // (width + height)], axis=-1)
+    image = (image + rng.integers(0, 24, size=(height, width, 3))).clip(0, 255).astype(np.uint8)
+    for _ in range(4):
+        side = height // 10
+        top, left = rng.integers(0, height - side), rng.integers(0, width - side)
+        image[top:top + side, left:left + side] = (220, 40, 40)
+    buffer = BytesIO()
+    Image.fromarray(image).save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def reset_peak_rss() -> bool:
+    """Reset the process's RSS high-water mark (Linux clear_refs); False if unsupported."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _setup(case: str, photo: bytes, store_dir: str):
+    """Inputs of a case (built before measuring) and the stage to measure."""
+    from app.services.derivative_store import LocalDerivativeStore
+    from app.services.encodings import encoding_codec
+    from app.services.event_index import EventFaceIndex
+    from app.services.face_service import FaceService
+    from app.services.photo_processor import PhotoProcessor
+    from app.services.synthetic_engine import SyntheticFaceEngine
+
+    processor = PhotoProcessor()
+    processor._store = LocalDerivativeStore(store_dir)
+    faces = [
+        {"index": i, "bounding_box": {"top": 0.1 * i, "right": 0.1 * i + 0.1, "bottom": 0.1 * i + 0.1, "left": 0.1 * i}}
+        for i in range(4)
+    ]
+
+    if case == "decode":
+        return lambda: FaceService._decode_rgb_array(photo)
+    if case == "synthetic_detect":
+        image = FaceService._decode_rgb_array(photo)
+        engine = SyntheticFaceEngine(min_faces=3, max_faces=3)
+        return lambda: engine.detect(image)
+    if case == "derivatives_from_array":
+        image = FaceService._decode_rgb_array(photo)
+        return lambda: processor.generate_derivatives(image, "photo", "event", faces)
+    if case == "derivatives_from_bytes":
+        return lambda: processor.generate_derivatives(photo, "photo", "event", faces)
+    if case == "analyze_photo":
+        return lambda: processor.analyze_photo(photo)
+    if case == "event_match":
+        rng = np.random.default_rng(0)
+        index = EventFaceIndex("event")
+        index.add_faces([
+            {"photo_id": f"p{i // 2}", "face_id": f"p{i // 2}:{i % 2}", "encoding": encoding}
+            for i, encoding in enumerate(rng.normal(0.0, 0.07, size=(100000, 128)))
+        ])
+        target = encoding_codec.to_compact(rng.normal(0.0, 0.07, size=128))
+        return lambda: index.search(target, 0.6)
+    raise ValueError(f"Unknown case '{case}'")
+
+
+def _measure(case: str, photo: bytes, results):
+    """Worker: run one case and report its peaks above the state before it."""
+    with tempfile.TemporaryDirectory() as store_dir:
+        tracemalloc.start()
+        stage = _setup(case, photo, store_dir)
+        traced_start, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        rss_start = current_rss()
+        rss_reset = reset_peak_rss()
+
+        started = time.perf_counter()
+        stage()
+        seconds = time.perf_counter() - started
+
+        _, traced_peak = tracemalloc.get_traced_memory()
+        if rss_reset:
+            with open("/proc/self/status") as f:
+                hwm = next(int(line.split()[1]) * 1024 for line in f if line.startswith("VmHWM:"))
+        else:
+            hwm = peak_rss()
+        results.put({
+            "traced_peak_mb": (traced_peak - traced_start) / MB,
+            "rss_peak_mb": max(0, hwm - rss_start) / MB if rss_start is not None else None,
+            "seconds": seconds
+        })
+
+
+CASES = [
+    "decode",
+    "synthetic_detect",
+    "derivatives_from_array",
+    "derivatives_from_bytes",
+    "analyze_photo",
+    "event_match"
+]
+
+
+def measure(case: str, photo: bytes) -> dict:
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_measure, args=(case, photo, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def regressed(measured: float, baseline: float, tolerance: float) -> bool:
+    return measured > baseline * (1 + tolerance) + SLACK_MB
+
+
+def run(megapixels: float, tolerance: float, update: bool) -> int:
+    photo = make_photo(megapixels)
+    print(f"Photo: {megapixels:.0f} MP JPEG ({len(photo) / MB:.1f} MB)  Tolerance: {tolerance:.0%} + {SLACK_MB:.0f} MB\n")
+
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)
+    if baseline.get("megapixels") not in (None, megapixels) and not update:
+        raise SystemExit(f"Baseline was recorded at {baseline['megapixels']} MP; use --megapixels {baseline['megapixels']}")
+
+    measured = {}
+    failures = []
+    print(f"{'stage':<24} {'traced MB':>10} {'baseline':>9} {'RSS MB':>8} {'baseline':>9} {'seconds':>8}")
+    for case in CASES:
+        result = measured[case] = measure(case, photo)
+        reference = baseline.get("cases", {}).get(case, {})
+        flags = []
+        for metric in ("traced_peak_mb", "rss_peak_mb"):
+            if result[metric] is not None and metric in reference and regressed(result[metric], reference[metric], tolerance):
+                flags.append(metric)
+        if flags:
+            failures.append((case, flags))
+        print(
+            f"{case:<24} {result['traced_peak_mb']:>10.1f} {reference.get('traced_peak_mb', float('nan')):>9.1f} "
+            f"{result['rss_peak_mb'] or 0:>8.1f} {reference.get('rss_peak_mb', float('nan')):>9.1f} "
+            f"{result['seconds']:>8.2f}{'  REGRESSED' if flags else ''}"
+        )
+
+    if update:
+        with open(BASELINE_PATH, "w") as f:
+            json.dump({
+                "megapixels": megapixels,
+                "cases": {
+                    case: {metric: round(value, 1) for metric, value in result.items() if metric != "seconds" and value is not None}
+                    for case, result in measured.items()
+                }
+            }, f, indent=2)
+            f.write("\n")
+        print(f"\nBaseline written to {BASELINE_PATH}")
+        return 0
+    if failures:
+        print("\nMemory regressions: " + ", ".join(f"{case} ({', '.join(flags)})" for case, flags in failures))
+        return 1
+    print("\nNo memory regressions")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--megapixels", type=float, default=24)
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed growth over the baseline")
+    parser.add_argument("--update", action="store_true", help="Record the measured peaks as the new baseline")
+    args = parser.parse_args()
+    sys.exit(run(args.megapixels, args.tolerance, args.update))
+
+
+if __name__ == "__main__":
+    main()
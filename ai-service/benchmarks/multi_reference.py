@@ -0,0 +1,87 @@
+"""
+Recall and query cost of multi-reference guest profiles.
+
+Each guest has several noisy selfies of the same identity. Matches every guest
+against a synthetic event with a single selfie, with all selfies fused as
+min-over-references (one batched pass) and as their centroid, and with one
+separate scan per selfie, reporting recall, false matches and time per query.
+
+Usage:
+    python -m benchmarks.multi_reference [--identities 500] [--references 3]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from app.services.encodings import EncodingCodec
+from benchmarks.synthetic import make_faces, make_identities
+
+
+def run(
+    identities: int,
+    faces_per_identity: int,
+    guests: int,
+    references: int,
+    selfie_noise: float,
+    threshold: float,
+    dtype: str
+):
+    codec = EncodingCodec(dtype)
+    centres = make_identities(identities)
+    faces, labels = make_faces(centres, faces_per_identity)
+    matrix = codec.to_compact(faces)
+    selfies, _ = make_faces(centres[:guests], references, seed=2, noise=selfie_noise)
+    selfies = codec.to_compact(selfies).reshape(guests, references, -1)
+    
+    def separate_scans(refs):
+        return np.min([codec.distances(matrix, r) for r in refs], axis=0)
+    
+    strategies = [
+        ("single selfie", lambda refs: codec.min_distances(matrix, refs[:1])),
+        (f"min of {references}", lambda refs: codec.min_distances(matrix, codec.fuse(refs, "min"))),
+        (f"centroid of {references}", lambda refs: codec.min_distances(matrix, codec.fuse(refs, "centroid"))),
+        (f"{references} separate scans", separate_scans)
+    ]
+    
+    print(f"Event faces: {len(matrix)}  Guests: {guests}  References/guest: {references}  "
+          f"Selfie noise: {selfie_noise}  dtype: {dtype}\n")
+    print(f"{'strategy':<22} {'recall':>8} {'false':>7} {'ms/query':>9}")
+    
+    relevant = faces_per_identity * guests
+    for name, strategy in strategies:
+        found = false = 0
+        started = time.perf_counter()
+        for guest in range(guests):
+            matched = strategy(selfies[guest]) <= threshold
+            same = labels == guest
+            found += int((matched & same).sum())
+            false += int((matched & ~same).sum())
+        elapsed = (time.perf_counter() - started) / guests
+        print(f"{name:<22} {found / relevant:>8.3f} {false:>7} {elapsed * 1000:>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--identities", type=int, default=500)
+    parser.add_argument("--faces-per-identity", type=int, default=40)
+    parser.add_argument("--guests", type=int, default=100)
+    parser.add_argument("--references", type=int, default=3)
+    parser.add_argument("--selfie-noise", type=float, default=0.045)
+    parser.add_argument("--threshold", type=float, default=0.6)
+    parser.add_argument("--dtype", default="float32")
+    args = parser.parse_args()
+    run(
+        args.identities,
+        args.faces_per_identity,
+        args.guests,
+        args.references,
+        args.selfie_noise,
+        args.threshold,
+        args.dtype
+    )
+
+
+if __name__ == "__main__":
+    main()
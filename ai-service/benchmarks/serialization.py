@@ -0,0 +1,157 @@
+"""
+Response serialization cost of the detect and match endpoints.
+
+Compares the per-request CPU time of the previous response path (one Pydantic
+model per face or match, FastAPI response validation and the default JSON
+encoder) with the ORJSONNumpyResponse path used by the hot endpoints (plain
+dicts, NumPy arrays serialized directly by orjson).
+
+Usage:
+    python -m benchmarks.serialization [--faces 40] [--matches 500] [--repeat 200]
+"""
+
+import argparse
+import asyncio
+import time
+
+import numpy as np
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+
+from app.api.responses import ORJSON_AVAILABLE, ORJSONNumpyResponse, match_list
+from app.api.routes import (
+    DetectFacesResponse,
+    DetectedFace,
+    FaceBoundingBox,
+    FaceMatch,
+    MatchFacesResponse
+)
+from benchmarks.synthetic import make_faces, make_identities
+
+
+def detect_result(faces: int) -> dict:
+    """Service output of detect_faces_from_url for an image with the given number of faces."""
+    encodings, _ = make_faces(make_identities(faces), 1)
+    rng = np.random.default_rng(3)
+    return {
+        "face_count": faces,
+        "faces": [
+            {
+                "index": i,
+                "encoding": encoding,
+                "bounding_box": dict(zip(("top", "right", "bottom", "left"), rng.random(4).tolist()))
+            }
+            for i, encoding in enumerate(encodings)
+        ]
+    }
+
+
+def legacy_detect(result: dict, field) -> bytes:
+    response = DetectFacesResponse(
+        face_count=result["face_count"],
+        faces=[
+            DetectedFace(
+                index=f["index"],
+                encoding=f["encoding"].tolist(),
+                bounding_box=FaceBoundingBox(**f["bounding_box"])
+            )
+            for f in result["faces"]
+        ],
+        error=result.get("error")
+    )
+    return _render_legacy(response, field)
+
+
+def fast_detect(result: dict) -> bytes:
+    return ORJSONNumpyResponse({
+        "face_count": result["face_count"],
+        "faces": result["faces"],
+        "error": result.get("error")
+    }).body
+
+
+def legacy_match(ids: list[str], distances: np.ndarray, threshold: float, field) -> bytes:
+    response = MatchFacesResponse(
+        matches=[
+            FaceMatch(
+                photo_id=face_id,
+                face_id=face_id,
+                distance=float(d),
+                confidence=float(max(0, 1 - (d / threshold)))
+            )
+            for face_id, d in zip(ids, distances)
+        ]
+    )
+    return _render_legacy(response, field)
+
+
+def fast_match(ids: list[str], distances: np.ndarray, threshold: float) -> bytes:
+    return ORJSONNumpyResponse({"matches": match_list(ids, ids, distances, threshold)}).body
+
+
+def _render_legacy(response, field) -> bytes:
+    # What FastAPI does with a returned model: validate against response_model,
+    # dump to JSON-compatible Python objects, then json.dumps in JSONResponse
+    content = asyncio.run(serialize_response(field=field, response_content=response))
+    return JSONResponse(content).body
+
+
+def cpu_per_call(func, repeat: int) -> float:
+    func()
+    started = time.process_time()
+    for _ in range(repeat):
+        func()
+    return (time.process_time() - started) / repeat
+
+
+def run(faces: int, matches: int, repeat: int, threshold: float):
+    detect = detect_result(faces)
+    detect_field = create_model_field("Response_detect", DetectFacesResponse, mode="serialization")
+    
+    rng = np.random.default_rng(4)
+    distances = np.sort(rng.uniform(0.2, threshold, matches)).astype(np.float32)
+    ids = [f"photo-{i}:0" for i in range(matches)]
+    match_field = create_model_field("Response_match", MatchFacesResponse, mode="serialization")
+    
+    print(f"orjson available: {ORJSON_AVAILABLE}\n")
+    print(f"{'payload':<22} {'bytes':>9} {'legacy us':>11} {'fast us':>9} {'speedup':>8}")
+    cases = [
+        (
+            f"detect ({faces} faces)",
+            lambda: legacy_detect(detect, detect_field),
+            lambda: fast_detect(detect)
+        ),
+        (
+            f"match ({matches} matches)",
+            lambda: legacy_match(ids, distances, threshold, match_field),
+            lambda: fast_match(ids, distances, threshold)
+        )
+    ]
+    for name, legacy, fast in cases:
+        # asyncio.run() overhead is part of neither path in production; subtract it
+        baseline = cpu_per_call(lambda: asyncio.run(_noop()), repeat)
+        legacy_time = cpu_per_call(legacy, repeat) - baseline
+        fast_time = cpu_per_call(fast, repeat)
+        print(
+            f"{name:<22} {len(fast()):>9,} {legacy_time * 1e6:>11.0f} {fast_time * 1e6:>9.0f} "
+            f"{legacy_time / fast_time:>7.1f}x"
+        )
+
+
+async def _noop():
+    pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--faces", type=int, default=40)
+    parser.add_argument("--matches", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--threshold", type=float, default=0.6)
+    args = parser.parse_args()
+    run(args.faces, args.matches, args.repeat, args.threshold)
+
+
+if __name__ == "__main__":
+    main()
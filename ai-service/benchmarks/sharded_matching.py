@@ -0,0 +1,88 @@
+"""
+Scaling of sharded event matching with the number of worker processes.
+
+Builds one giant synthetic event and times a guest query with the in-process
+scan and with ShardedMatcher at increasing worker counts (up to the number of
+cores by default), checking that every mode returns the same matches.
+
+Usage:
+    python -m benchmarks.sharded_matching [--faces 500000] [--workers 1 2 4]
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+from app.services.event_index import EventFaceIndex
+from app.services.sharded_matcher import ShardedMatcher
+from benchmarks.synthetic import make_faces, make_identities
+
+
+def build_index(faces: int, faces_per_identity: int = 50, chunk: int = 50000) -> tuple[EventFaceIndex, np.ndarray]:
+    index = EventFaceIndex("benchmark")
+    centres = make_identities(max(1, faces // faces_per_identity))
+    for start in range(0, faces, chunk):
+        count = min(chunk, faces - start)
+        encodings, _ = make_faces(centres, 1, seed=start + 1)
+        encodings = encodings[np.arange(start, start + count) % len(encodings)]
+        index.add_faces([
+            {"photo_id": f"photo-{row}", "face_id": f"face-{row}", "encoding": encoding}
+            for row, encoding in zip(range(start, start + count), encodings)
+        ])
+    return index, centres
+
+
+def time_query(search, queries: np.ndarray, repeat: int) -> tuple[float, list]:
+    results = [search(q) for q in queries]
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for q in queries:
+            search(q)
+    return (time.perf_counter() - started) / (repeat * len(queries)), results
+
+
+def run(faces: int, worker_counts: list[int], queries: int, repeat: int, threshold: float):
+    print(f"Building event with {faces:,} faces...")
+    index, centres = build_index(faces)
+    query_set, _ = make_faces(centres[:queries], 1, seed=99)
+    query_set = query_set.astype(index.matrix.dtype)
+    print(f"Cores: {os.cpu_count()}  Index: {index.matrix.nbytes / 2**20:.0f} MB  Queries: {queries}\n")
+    
+    baseline, expected = time_query(lambda q: index.search(q, threshold), query_set, repeat)
+    print(f"{'mode':<16} {'ms/query':>9} {'speedup':>8} {'efficiency':>11} {'same hits':>10}")
+    print(f"{'in-process':<16} {baseline * 1000:>9.2f} {1.0:>7.2f}x {'':>11} {'':>10}")
+    
+    for workers in worker_counts:
+        matcher = ShardedMatcher(workers=workers, min_faces=0)
+        try:
+            elapsed, results = time_query(lambda q: matcher.search(index, q, threshold), query_set, repeat)
+        finally:
+            matcher.close()
+        same = all(
+            np.array_equal(np.sort(result["rows"]), np.sort(expected_rows))
+            for result, (expected_rows, _) in zip(results, expected)
+        )
+        speedup = baseline / elapsed
+        print(
+            f"{f'{workers} worker(s)':<16} {elapsed * 1000:>9.2f} {speedup:>7.2f}x "
+            f"{100 * speedup / workers:>10.0f}% {str(same):>10}"
+        )
+
+
+def main():
+    cores = os.cpu_count() or 1
+    default_workers = sorted({w for w in (1, 2, 4, 8, 16, 32) if w <= cores} | {cores})
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--faces", type=int, default=500000)
+    parser.add_argument("--workers", type=int, nargs="+", default=default_workers)
+    parser.add_argument("--queries", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--threshold", type=float, default=0.6)
+    args = parser.parse_args()
+    run(args.faces, args.workers, args.queries, args.repeat, args.threshold)
+
+
+if __name__ == "__main__":
+    main()
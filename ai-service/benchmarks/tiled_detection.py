@@ -0,0 +1,112 @@
+"""
+Recall and wall time of tiled detection on a large group photo.
+
+Detects faces in one large image (for example a group panorama; a smaller
+group photo can be repeated into a grid with --grid) in four ways: HOG on the
+full image, HOG on a copy downscaled to the tiling threshold, and tiled
+detection in process and across worker processes. Recall is measured against
+the full-image detections (boxes matched at IoU >= 0.5).
+
+Requires face_recognition (dlib).
+
+Usage:
+    python -m benchmarks.tiled_detection --image group.jpg [--grid 3] [--workers 4]
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+from app.services.face_service import load_face_recognition
+from app.services.tiled_detector import TiledDetector
+
+
+def load_image(path: str, grid: int) -> np.ndarray:
+    image = np.asarray(Image.open(path).convert("RGB"))
+    if grid > 1:
+        image = np.tile(image, (grid, grid, 1))
+    return np.ascontiguousarray(image)
+
+
+def recall(found: list, reference: list, iou: float = 0.5) -> float:
+    """Fraction of reference boxes matched by a found box at the given IoU."""
+    if not reference:
+        return 1.0
+    if not found:
+        return 0.0
+    a = np.asarray(reference, dtype=np.float64)[:, None, :]
+    b = np.asarray(found, dtype=np.float64)[None, :, :]
+    heights = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    widths = np.clip(np.minimum(a[..., 1], b[..., 1]) - np.maximum(a[..., 3], b[..., 3]), 0, None)
+    intersection = heights * widths
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 1] - a[..., 3])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 1] - b[..., 3])
+    overlap = intersection / (area_a + area_b - intersection)
+    return float((overlap.max(axis=1) >= iou).mean())
+
+
+def downscaled(image: np.ndarray, max_pixels: int, locate) -> list:
+    scale = min(1.0, (max_pixels / (image.shape[0] * image.shape[1])) ** 0.5)
+    size = (int(image.shape[1] * scale), int(image.shape[0] * scale))
+    small = np.asarray(Image.fromarray(image).resize(size, Image.Resampling.BILINEAR))
+    return [
+        (round(t / scale), round(r / scale), round(b / scale), round(l / scale))
+        for t, r, b, l in locate(small)
+    ]
+
+
+def run(path: str, grid: int, workers: int, tile_size: int, overlap: int, min_pixels: int):
+    if not load_face_recognition():
+        raise SystemExit("face_recognition (dlib) is required for this benchmark")
+    import face_recognition
+    
+    image = load_image(path, grid)
+    megapixels = image.shape[0] * image.shape[1] / 1e6
+    print(f"Image: {image.shape[1]}x{image.shape[0]} ({megapixels:.1f} MP)  Cores: {os.cpu_count()}\n")
+    
+    started = time.perf_counter()
+    reference = face_recognition.face_locations(image)
+    full_seconds = time.perf_counter() - started
+    
+    in_process = TiledDetector(min_pixels=1, tile_size=tile_size, overlap=overlap, workers=0)
+    pooled = TiledDetector(min_pixels=1, tile_size=tile_size, overlap=overlap, workers=workers)
+    # Start the pool (and load the models in the workers) outside the timing
+    pooled.detect(image[:tile_size, :tile_size], face_recognition.face_locations)
+    
+    modes = [
+        (f"downscaled to {min_pixels / 1e6:.0f} MP", lambda: downscaled(image, min_pixels, face_recognition.face_locations)),
+        ("tiled, in process", lambda: in_process.detect(image, face_recognition.face_locations)),
+        (f"tiled, {workers} worker(s)", lambda: pooled.detect(image, face_recognition.face_locations))
+    ]
+    print(f"{'mode':<24} {'faces':>6} {'recall':>7} {'seconds':>8} {'speedup':>8}")
+    print(f"{'full image':<24} {len(reference):>6} {1.0:>7.3f} {full_seconds:>8.2f} {1.0:>7.2f}x")
+    try:
+        for name, detect in modes:
+            started = time.perf_counter()
+            found = detect()
+            seconds = time.perf_counter() - started
+            print(
+                f"{name:<24} {len(found):>6} {recall(found, reference):>7.3f} "
+                f"{seconds:>8.2f} {full_seconds / seconds:>7.2f}x"
+            )
+    finally:
+        pooled.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--image", required=True)
+    parser.add_argument("--grid", type=int, default=1, help="Repeat the image in an n x n grid")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--tile-size", type=int, default=2048)
+    parser.add_argument("--overlap", type=int, default=256)
+    parser.add_argument("--min-pixels", type=int, default=12000000)
+    args = parser.parse_args()
+    run(args.image, args.grid, args.workers, args.tile_size, args.overlap, args.min_pixels)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Gunicorn configuration for running the AI service with pre-forked, pre-warmed workers.
+
+The master process imports the app and warms the face models once, then forks
+the uvicorn workers. The loaded dlib models are shared copy-on-write between the
+workers, so each new worker is ready within milliseconds instead of paying the
+model-load and first-inference latency itself.
+
+Usage:
+    gunicorn -c gunicorn.conf.py app.main:app
+
+BLAS threads are split between the workers (BLAS_THREADS overrides the share),
+so concurrent distance batches in several workers do not oversubscribe the cores.
+
+Event indexes, guest profiles and match deltas live in each worker's memory, so
+several workers are only allowed with EVENT_STATE_ENABLED=false (stateless
+detection pools); event matching runs one worker per instance, with events
+routed to instances by event_id.
+"""
+
+import gc
+import logging
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+
+# Must be in the environment before the preloaded app imports NumPy
+# (app.services.blas itself does not import it)
+from app.services.blas import set_blas_thread_env
+
+blas_threads = int(os.getenv("BLAS_THREADS", "0")) or max(1, (os.cpu_count() or 1) // workers)
+os.environ["BLAS_THREADS"] = str(blas_threads)
+set_blas_thread_env(blas_threads)
+
+# Read after BLAS_THREADS is set; app.config does not import NumPy
+from app.config import settings
+
+# A guest registered on one worker would never match faces ingested on another
+if workers > 1 and settings.event_state_enabled:
+    raise RuntimeError(
+        f"WEB_CONCURRENCY={workers} with event state enabled: event indexes and guests are "
+        "per process, so run one worker per instance and route events by event_id, or set "
+        "EVENT_STATE_ENABLED=false for a stateless detection pool"
+    )
+
+# Import the application (and its modules) in the master before forking.
+preload_app = True
+
+logger = logging.getLogger("gunicorn.error")
+
+
+def on_starting(server):
+    """Warm the models in the master so forked workers inherit them."""
+    from app.services.face_service import face_service
+
+    seconds = face_service.warm_up()
+    logger.info(f"Face models warmed in master process in {seconds:.2f}s")
+
+    # Move everything allocated so far into the permanent GC generation so the
+    # collector in each worker does not touch (and thereby copy) those pages.
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    """Redis connections must never be shared across a fork."""
+    from app.services.redis_service import redis_service
+
+    redis_service.client = None
+    redis_service.binary_client = None